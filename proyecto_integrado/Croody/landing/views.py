@@ -611,6 +611,8 @@ class RobotMonitorView(LandingNavigationMixin, TemplateView):
         ctx['show_global_shortcuts'] = True
         ctx['brand'] = 'gold'
         ctx['live_endpoint'] = '/api/telemetry/live'
+        ctx['stream_endpoint'] = '/api/telemetry/stream'
+        ctx['area_endpoint'] = '/api/telemetry/area'
         ctx['history_endpoint'] = '/api/telemetry/query'
         ctx['ingest_endpoint'] = '/api/telemetry/ingest'
         ctx['monitor_meta'] = {
@@ -1,13 +1,63 @@
 from __future__ import annotations
 
+import asyncio
+import bisect
+import csv
+import hashlib
+import json
+import logging
+import math
+import multiprocessing
+import operator
 import os
-from typing import Any, Dict, List, Optional
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+from itertools import chain
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Sequence, Tuple
 
-from fastapi import FastAPI, HTTPException, Header
+from fastapi import FastAPI, HTTPException, Header, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from starlette.requests import ClientDisconnect
 from pydantic import BaseModel, Field
 from fastapi.middleware.cors import CORSMiddleware
 
+try:  # pragma: no cover - path de import opcional
+    import numpy as np  # type: ignore
+except Exception:
+    np = None  # type: ignore
+
 MODEL_PATH = os.getenv("MODEL_PATH", "/models/best_model.joblib")
+# Cada cuántos segundos se revisa si train_ids_model.py dejó un modelo nuevo
+MODEL_POLL_SECONDS = float(os.getenv("IDS_MODEL_POLL_SECONDS", "5"))
+# Micro-batching: las peticiones concurrentes se agrupan hasta
+# IDS_BATCH_MAX_ROWS filas o IDS_BATCH_MAX_WAIT_MS de espera y se predicen
+# juntas en un solo model.predict.
+BATCHING_ENABLED = os.getenv("IDS_BATCHING", "1").strip().lower() not in {"0", "false", "no"}
+BATCH_MAX_ROWS = int(os.getenv("IDS_BATCH_MAX_ROWS", "512"))
+BATCH_MAX_WAIT_MS = float(os.getenv("IDS_BATCH_MAX_WAIT_MS", "2"))
+# Procesos de inferencia (0 = predecir en hilos del propio proceso). Con
+# "forkserver" o "spawn" cada uno abre el modelo con joblib.load(mmap_mode="r");
+# "fork" hereda el modelo ya cargado y comparte sus páginas, pero ver
+# InferencePool antes de usarlo. Los lotes grandes se reparten en trozos de
+# al menos IDS_WORKER_CHUNK_ROWS filas.
+WORKERS = int(os.getenv("IDS_WORKERS", "0"))
+WORKER_START = os.getenv("IDS_WORKER_START", "forkserver").strip().lower()
+WORKER_CHUNK_ROWS = int(os.getenv("IDS_WORKER_CHUNK_ROWS", "256"))
+# Scoring en streaming (POST /api/ids/predict/stream): filas por trozo, tope
+# de una línea sin salto (protege la memoria ante entradas corruptas) y
+# columnas que se copian tal cual en cada predicción si vienen en la entrada.
+STREAM_CHUNK_ROWS = int(os.getenv("IDS_STREAM_CHUNK_ROWS", "2000"))
+STREAM_MAX_LINE_BYTES = int(os.getenv("IDS_STREAM_MAX_LINE_BYTES", str(1 << 20)))
+STREAM_ECHO_COLUMNS = os.getenv("IDS_STREAM_ECHO", "Flow ID,Src IP,Src Port,Dst IP,Dst Port,Timestamp")
+# Columnas que el entrenamiento codifica one-hot (prefijo "<columna>_<valor>")
+CATEGORICAL_FEATURES = ("protocol_type", "service", "flag")
+
+logger = logging.getLogger("ids-ml")
 
 app = FastAPI(title="IDS ML Inference", version="0.1.0")
 
@@ -37,14 +87,916 @@ PredictRequest.model_rebuild()
 PredictResponse.model_rebuild()
 
 
-def _load_model():
+class FeatureTransformer:
+    """Convierte filas crudas en la matriz float32 que espera el modelo.
+
+    Se compila una vez por modelo a partir del preprocesado guardado por
+    train_ids_model.py: cada característica numérica y cada valor de
+    categoría conocen de antemano su columna, y el escalado (StandardScaler
+    sin centrar, x / scale) queda como un vector de factores. Transformar es
+    un np.asarray del bloque numérico escrito de una vez en la matriz
+    preasignada y una asignación indexada de los unos de cada categoría, sin
+    DataFrame ni get_dummies por petición. Faltantes y categorías no vistas
+    quedan en 0, igual que en el entrenamiento.
+    """
+
+    def __init__(self, spec: Dict[str, Any]) -> None:
+        self.columns: List[str] = list(spec["columns"])
+        position = {name: idx for idx, name in enumerate(self.columns)}
+        self.numeric = [(name, position[name]) for name in spec.get("numeric", []) if name in position]
+        self.categorical = [
+            (name, {value: position[f"{name}_{value}"] for value in values if f"{name}_{value}" in position})
+            for name, values in spec.get("categorical", {}).items()
+        ]
+        scale = spec.get("scale") or {}
+        self.numeric_names = [name for name, _ in self.numeric]
+        self._numeric_getter = operator.itemgetter(*self.numeric_names) if len(self.numeric_names) > 1 else None
+        self.numeric_idx = np.array([idx for _, idx in self.numeric], dtype=np.intp)
+        self.factors = np.array(
+            [1.0 / float(scale[name]) if scale.get(name) else 1.0 for name in self.numeric_names], dtype=np.float32
+        )
+        self.scaled = bool(scale)
+
+    @classmethod
+    def from_feature_names(cls, names: List[str]) -> "FeatureTransformer":
+        """Especificación deducida de ``feature_names_in_`` para modelos guardados sin preprocesado.
+
+        Recupera orden y vocabularios, pero no el escalado, que esos modelos
+        nunca guardaron.
+        """
+        categorical: Dict[str, List[str]] = {name: [] for name in CATEGORICAL_FEATURES}
+        numeric = []
+        for column in names:
+            prefix = next((p for p in CATEGORICAL_FEATURES if column.startswith(p + "_")), None)
+            if prefix is None:
+                numeric.append(column)
+            else:
+                categorical[prefix].append(column[len(prefix) + 1:])
+        return cls({"columns": names, "numeric": numeric, "categorical": categorical})
+
+    def transform(self, rows: List[Dict[str, Any]]) -> Any:
+        X = np.zeros((len(rows), len(self.columns)), dtype=np.float32)
+        if not rows:
+            return X
+        block = self._numeric_block(rows)
+        X[:, self.numeric_idx] = block * self.factors if self.scaled else block
+        hit_rows: List[int] = []
+        hit_cols: List[int] = []
+        for name, vocabulary in self.categorical:
+            for i, row in enumerate(rows):
+                idx = vocabulary.get(str(row.get(name)))
+                if idx is not None:
+                    hit_rows.append(i)
+                    hit_cols.append(idx)
+        X[hit_rows, hit_cols] = 1.0
+        return X
+
+    def _numeric_block(self, rows: List[Dict[str, Any]]) -> Any:
+        width = len(self.numeric_names)
+        if self._numeric_getter is not None:
+            # Camino rápido: filas completas y numéricas, leídas con itemgetter
+            # y volcadas sin listas intermedias
+            try:
+                flat = chain.from_iterable(map(self._numeric_getter, rows))
+                return np.fromiter(flat, dtype=np.float32, count=len(rows) * width).reshape(len(rows), width)
+            except (KeyError, TypeError, ValueError):
+                pass
+        # ``or 0`` convierte None, "" y ausentes en 0
+        return np.asarray(
+            [[row.get(name) or 0 for name in self.numeric_names] for row in rows], dtype=np.float32
+        ).reshape(len(rows), width)
+
+
+class LoadedModel(NamedTuple):
+    """Modelo residente, su preprocesado compilado y los datos del archivo del que salió."""
+
+    model: Any
+    transformer: Optional[FeatureTransformer]
+    preprocessing: Optional[str]
+    version: str
+    loaded_at: str
+    load_seconds: float
+    file_bytes: int
+    memory_bytes: int
+    metadata: Dict[str, Any]
+
+
+class ModelManager:
+    """Mantiene el modelo cargado en memoria y lo reemplaza cuando cambia el archivo.
+
+    Se carga una vez (al arrancar o en la primera predicción) y una tarea en
+    segundo plano revisa cada ``poll`` segundos el mtime/tamaño del archivo;
+    si cambian, calcula el SHA-256 y solo si el contenido es distinto carga el
+    nuevo modelo y lo publica de una vez en ``current``. Quien predice toma
+    ``current`` una sola vez, así que nunca mezcla modelo y versión de cargas
+    distintas. Si la carga falla (p. ej. archivo a medio escribir) se sigue
+    sirviendo el modelo anterior y se reintenta en la siguiente revisión.
+    """
+
+    def __init__(self, path: str, poll: float) -> None:
+        self.path = path
+        self.poll = max(0.5, poll)
+        self.current: Optional[LoadedModel] = None
+        self._stat: Optional[tuple] = None
+        self._checked = False
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.reloads_total = 0
+        self.errors_total = 0
+        self.last_error: Optional[str] = None
+
+    def get(self) -> Optional[LoadedModel]:
+        if not self._checked:
+            self.reload_if_changed()
+        return self.current
+
+    def reload_if_changed(self) -> bool:
+        """Carga el modelo si el archivo cambió; True si se publicó uno nuevo."""
+        with self._lock:
+            self._checked = True
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                return False
+            stat_key = (st.st_mtime_ns, st.st_size)
+            if stat_key == self._stat:
+                return False
+            try:
+                version = file_sha256(self.path)
+                if self.current is not None and version == self.current.version:
+                    self._stat = stat_key
+                    return False
+                loaded = self._load(version, st.st_size)
+            except Exception as exc:
+                self.errors_total += 1
+                self.last_error = f"{type(exc).__name__}: {exc}"
+                logger.warning("ids: no se pudo cargar %s (%s); se mantiene el modelo anterior", self.path, exc)
+                return False
+            self.current = loaded
+            self._stat = stat_key
+            self.reloads_total += 1
+            self.last_error = None
+            logger.info("ids: modelo %s cargado en %.2fs", loaded.version, loaded.load_seconds)
+            return True
+
+    def _load(self, version: str, file_bytes: int) -> LoadedModel:
+        import joblib  # type: ignore
+
+        start = time.perf_counter()
+        model, transformer, preprocessing = unpack_artifact(joblib.load(self.path))
+        elapsed = time.perf_counter() - start
+        return LoadedModel(
+            model=model,
+            transformer=transformer,
+            preprocessing=preprocessing,
+            version=version,
+            loaded_at=datetime.now(timezone.utc).isoformat(),
+            load_seconds=round(elapsed, 4),
+            file_bytes=file_bytes,
+            memory_bytes=model_memory_bytes(model),
+            metadata=read_metadata(self.path),
+        )
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll)
+            try:
+                await run_in_threadpool(self.reload_if_changed)
+            except Exception:  # pragma: no cover - reload_if_changed ya captura los fallos de carga
+                logger.exception("ids: fallo revisando el modelo")
+
+    def info(self) -> Dict[str, Any]:
+        loaded = self.current
+        return {
+            "path": self.path,
+            "available": os.path.exists(self.path),
+            "loaded": loaded is not None,
+            "version": loaded.version if loaded else None,
+            "loaded_at": loaded.loaded_at if loaded else None,
+            "load_seconds": loaded.load_seconds if loaded else None,
+            "file_bytes": loaded.file_bytes if loaded else None,
+            "memory_bytes": loaded.memory_bytes if loaded else None,
+            "estimator": type(loaded.model).__name__ if loaded else None,
+            "preprocessing": loaded.preprocessing if loaded else None,
+            "features": len(loaded.transformer.columns) if loaded and loaded.transformer else None,
+            "metadata": loaded.metadata if loaded else None,
+            "poll_seconds": self.poll,
+            "reloads_total": self.reloads_total,
+            "errors_total": self.errors_total,
+            "last_error": self.last_error,
+        }
+
+
+def unpack_artifact(artifact: Any) -> tuple:
+    """(modelo, transformer, origen del preprocesado) de lo que guardó el entrenamiento.
+
+    Los modelos nuevos son ``{"model", "preprocessing"}``; los antiguos son el
+    estimador a secas y, si tienen ``feature_names_in_``, se alinean con las
+    columnas deducidas ("derived", sin escalado).
+    """
+    if isinstance(artifact, dict) and "model" in artifact:
+        spec = artifact.get("preprocessing")
+        transformer = FeatureTransformer(spec) if spec and np is not None else None
+        return artifact["model"], transformer, "persisted" if transformer else None
+    names = getattr(artifact, "feature_names_in_", None)
+    if names is not None and np is not None:
+        transformer = FeatureTransformer.from_feature_names([str(n) for n in names])
+        # La matriz ya sale alineada: sin esto sklearn avisa en cada predict
+        # que X no trae nombres de columna
+        del artifact.feature_names_in_
+        return artifact, transformer, "derived"
+    return artifact, None, None
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def model_memory_bytes(model: Any) -> int:
+    """Bytes de los arrays de árboles (nodos y valores) del modelo; 0 si no es un ensamble de árboles."""
+    estimators = getattr(model, "estimators_", None)
+    trees = estimators if estimators is not None else [model]
+    total = 0
+    for est in trees:
+        tree = getattr(est, "tree_", None)
+        if tree is None:
+            continue
+        state = tree.__getstate__()
+        total += state["nodes"].nbytes + state["values"].nbytes
+    return total
+
+
+def read_metadata(model_path: str) -> Dict[str, Any]:
+    """model_metadata.json junto al modelo (métricas y fecha de entrenamiento), si existe."""
+    meta_path = Path(model_path).with_name("model_metadata.json")
     try:
+        return json.loads(meta_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+MODELS = ModelManager(MODEL_PATH, MODEL_POLL_SECONDS)
+
+
+def predict_rows(loaded: LoadedModel, rows: List[Dict[str, Any]]) -> List[int]:
+    """Inferencia con el modelo real: el transformer alinea las filas con las
+    columnas del entrenamiento; sin él se pasan tal cual en un DataFrame."""
+    if loaded.transformer is not None:
+        preds = loaded.model.predict(loaded.transformer.transform(rows))
+    else:
+        import pandas as pd  # type: ignore
+        preds = loaded.model.predict(pd.DataFrame(rows))
+    return [int(x) for x in preds]
+
+
+# Modelo de cada proceso de inferencia: heredado por fork o cargado en _worker_init
+_WORKER_MODEL: Any = None
+
+
+def _worker_init(path: Optional[str]) -> None:
+    global _WORKER_MODEL
+    if path is not None:
         import joblib  # type: ignore
-        if os.path.exists(MODEL_PATH):
-            return joblib.load(MODEL_PATH)
-    except Exception:
-        return None
-    return None
+
+        _WORKER_MODEL, _, _ = unpack_artifact(joblib.load(path, mmap_mode="r"))
+    # Un hilo por proceso: el paralelismo lo dan los procesos
+    if hasattr(_WORKER_MODEL, "n_jobs"):
+        _WORKER_MODEL.n_jobs = 1
+
+
+def _worker_predict(X: Any, method: str = "predict") -> Any:
+    return getattr(_WORKER_MODEL, method)(X)
+
+
+def _worker_pid(hold: float) -> int:
+    # Retiene al worker un momento para que cada ping lo atienda uno distinto
+    time.sleep(hold)
+    return os.getpid()
+
+
+class InferencePool:
+    """Procesos que ejecutan ``model.predict`` fuera del GIL del servidor.
+
+    El pool se crea para una versión de modelo y se rehace cuando
+    ModelManager publica otra; el anterior termina lo que tenga en curso.
+    Las filas se transforman en este proceso (FeatureTransformer) y a los
+    workers solo viaja la matriz float32, partida en tantos trozos como
+    workers, de al menos ``chunk_rows`` filas.
+
+    Por defecto los workers salen de un forkserver y cada uno abre el
+    archivo con ``mmap_mode="r"``; sklearn copia los nodos de cada árbol a
+    memoria propia al deserializar, así que cada worker paga el modelo
+    entero. "fork" lo evita (los workers heredan el modelo copy-on-write),
+    pero hace fork de un proceso con hilos (threadpool de Starlette, hilos
+    de sklearn) desde uno de ellos: un lock que otro hilo tuviera tomado en
+    ese instante queda tomado para siempre en el hijo. Solo es seguro si el
+    servicio no tiene otros hilos trabajando cuando se crea el pool.
+
+    Si un worker muere (p. ej. el OOM killer) el executor queda roto: se
+    descarta, se rehace y la llamada se reintenta una vez.
+    """
+
+    def __init__(self, workers: int, start_method: str, chunk_rows: int) -> None:
+        self.workers = max(0, workers)
+        self.start_method = start_method
+        self.chunk_rows = max(1, chunk_rows)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._version: Optional[str] = None
+        self._pids: List[int] = []
+        self._lock = threading.Lock()
+        self.rebuilds_total = 0
+        self.broken_total = 0
+        self.chunks_total = 0
+        self.rows_total = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def _executor_for(self, loaded: LoadedModel) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is not None and self._version == loaded.version:
+                return self._executor
+            global _WORKER_MODEL
+            previous = self._executor
+            if self.start_method == "fork":
+                _WORKER_MODEL = loaded.model
+                executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("fork"), initializer=_worker_init, initargs=(None,)
+                )
+            else:
+                executor = ProcessPoolExecutor(
+                    self.workers,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                    initializer=_worker_init,
+                    initargs=(MODELS.path,),
+                )
+            # Arranca todos los procesos ya, con el modelo de esta versión
+            self._pids = sorted(set(executor.map(_worker_pid, [0.05] * self.workers)))
+            if self.start_method == "fork":
+                _WORKER_MODEL = None
+            self._executor, self._version = executor, loaded.version
+            self.rebuilds_total += 1
+        if previous is not None:
+            previous.shutdown(wait=False)
+        return executor
+
+    def _discard(self, executor: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._executor is executor:
+                self._executor = self._version = None
+                self._pids = []
+                self.broken_total += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def predict(self, loaded: LoadedModel, X: Any, method: str = "predict") -> Any:
+        n = len(X)
+        size = max(self.chunk_rows, math.ceil(n / self.workers))
+        loop = asyncio.get_running_loop()
+        chunks = [X[start:start + size] for start in range(0, n, size)]
+        self.chunks_total += len(chunks)
+        self.rows_total += n
+        for attempt in range(2):
+            executor = await run_in_threadpool(self._executor_for, loaded)
+            try:
+                parts = await asyncio.gather(
+                    *(loop.run_in_executor(executor, _worker_predict, chunk, method) for chunk in chunks)
+                )
+                break
+            except BrokenProcessPool:
+                self._discard(executor)
+                if attempt:
+                    raise
+                logger.warning("ids: un proceso de inferencia murió; se rehace el pool y se reintenta")
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+    def serves(self, loaded: LoadedModel) -> bool:
+        """True si usar el pool con ``loaded`` no obliga a rehacerlo para otra versión."""
+        return self.enabled and self._version in (None, loaded.version)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = self._version = None
+            self._pids = []
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "start_method": self.start_method,
+            "chunk_rows": self.chunk_rows,
+            "running": self._executor is not None,
+            "model_version": self._version,
+            "pids": self._pids,
+            "rebuilds_total": self.rebuilds_total,
+            "broken_total": self.broken_total,
+            "chunks_total": self.chunks_total,
+            "rows_total": self.rows_total,
+        }
+
+
+WORKER_POOL = InferencePool(workers=WORKERS, start_method=WORKER_START, chunk_rows=WORKER_CHUNK_ROWS)
+
+
+async def infer(loaded: LoadedModel, rows: List[Dict[str, Any]]) -> List[int]:
+    """Predicciones de ``rows``: en los procesos de inferencia si los hay, si no en un hilo."""
+    if WORKER_POOL.enabled and loaded.transformer is not None:
+        X = await run_in_threadpool(loaded.transformer.transform, rows)
+        return [int(x) for x in await WORKER_POOL.predict(loaded, X)]
+    return await run_in_threadpool(predict_rows, loaded, rows)
+
+
+async def infer_matrix(loaded: LoadedModel, X: Any, method: str = "predict") -> Any:
+    """``model.<method>(X)`` sobre una matriz ya transformada, en los procesos de inferencia o en un hilo."""
+    if WORKER_POOL.enabled:
+        return await WORKER_POOL.predict(loaded, X, method)
+    return await run_in_threadpool(getattr(loaded.model, method), X)
+
+
+class Histogram:
+    """Conteos por bucket (límite superior inclusivo) más suma y total."""
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += 1
+        self.sum += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        labels = [f"<={b:g}" for b in self.bounds] + [f">{self.bounds[-1]:g}"]
+        return {
+            "buckets": dict(zip(labels, self.counts)),
+            "count": self.total,
+            "avg": round(self.sum / self.total, 4) if self.total else 0.0,
+        }
+
+
+class _Pending(NamedTuple):
+    rows: List[Dict[str, Any]]
+    future: asyncio.Future
+    enqueued_at: float
+
+
+class MicroBatcher:
+    """Agrupa predicciones concurrentes en un solo ``model.predict``.
+
+    Cada petición deja sus filas en una cola; el worker toma la primera y
+    espera como mucho ``max_wait`` segundos a que lleguen más, hasta
+    ``max_rows`` filas. El lote se predice en un hilo (el event loop sigue
+    recibiendo peticiones, que formarán el siguiente lote) y a cada petición
+    se le devuelve su tramo. Si el lote falla se repite petición a petición,
+    para que una fila inválida solo haga fallar a la suya. Las peticiones de
+    ``max_rows`` filas o más ya son un lote y no pasan por la cola.
+
+    La cola y el worker se crean en el event loop que los usa por primera
+    vez (y se recrean si cambia, como ocurre con TestClient fuera de un
+    ``with``).
+    """
+
+    def __init__(self, enabled: bool, max_rows: int, max_wait: float) -> None:
+        self.enabled = enabled
+        self.max_rows = max(1, max_rows)
+        self.max_wait = max(0.0, max_wait)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.batches_total = 0
+        self.requests_total = 0
+        self.rows_total = 0
+        self.direct_total = 0
+        self.isolated_total = 0
+        self.batch_rows = Histogram([1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024])
+        self.batch_requests = Histogram([1, 2, 4, 8, 16, 32, 64, 128])
+        self.queue_wait_ms = Histogram([0.1, 0.25, 0.5, 1, 2, 5, 10, 25, 50, 100])
+
+    async def submit(self, loaded: LoadedModel, rows: List[Dict[str, Any]]) -> Tuple[List[int], str]:
+        """Predicciones de ``rows`` y versión del modelo que las produjo."""
+        if not self.enabled or len(rows) >= self.max_rows:
+            self.direct_total += 1
+            return await infer(loaded, rows), loaded.version
+        queue = self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await queue.put(_Pending(rows, future, time.perf_counter()))
+        return await future
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._queue is None:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run(self._queue))
+        return self._queue
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except (asyncio.CancelledError, RuntimeError):
+            pass
+        self._task = self._queue = self._loop = None
+
+    async def _run(self, queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            rows = len(batch[0].rows)
+            deadline = loop.time() + self.max_wait
+            while rows < self.max_rows:
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                batch.append(item)
+                rows += len(item.rows)
+            try:
+                await self._predict(batch)
+            except Exception:  # pragma: no cover - el worker no debe morir con peticiones esperando
+                logger.exception("ids: fallo procesando un lote")
+                for item in batch:
+                    _resolve(item.future, exc=HTTPException(status_code=500, detail="Error interno de inferencia"))
+
+    async def _predict(self, batch: List[_Pending]) -> None:
+        started = time.perf_counter()
+        for item in batch:
+            self.queue_wait_ms.observe((started - item.enqueued_at) * 1000.0)
+        rows = [row for item in batch for row in item.rows]
+        self.batches_total += 1
+        self.requests_total += len(batch)
+        self.rows_total += len(rows)
+        self.batch_rows.observe(len(rows))
+        self.batch_requests.observe(len(batch))
+        loaded = MODELS.get()
+        if loaded is None:  # pragma: no cover - el modelo desapareció entre submit y el lote
+            for item in batch:
+                _resolve(item.future, exc=HTTPException(status_code=503, detail="Modelo no disponible"))
+            return
+        try:
+            preds = await infer(loaded, rows)
+        except Exception as exc:
+            if len(batch) == 1:
+                _resolve(batch[0].future, exc=HTTPException(status_code=400, detail=f"Error de inferencia: {exc}"))
+                return
+            self.isolated_total += 1
+            await asyncio.gather(*(self._predict_one(loaded, item) for item in batch))
+            return
+        offset = 0
+        for item in batch:
+            _resolve(item.future, (preds[offset:offset + len(item.rows)], loaded.version))
+            offset += len(item.rows)
+
+    async def _predict_one(self, loaded: LoadedModel, item: _Pending) -> None:
+        try:
+            _resolve(item.future, (await infer(loaded, item.rows), loaded.version))
+        except Exception as exc:
+            _resolve(item.future, exc=HTTPException(status_code=400, detail=f"Error de inferencia: {exc}"))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "max_rows": self.max_rows,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "batches_total": self.batches_total,
+            "requests_total": self.requests_total,
+            "rows_total": self.rows_total,
+            "direct_total": self.direct_total,
+            "isolated_total": self.isolated_total,
+            "batch_rows": self.batch_rows.snapshot(),
+            "batch_requests": self.batch_requests.snapshot(),
+            "queue_wait_ms": self.queue_wait_ms.snapshot(),
+        }
+
+
+def _resolve(future: asyncio.Future, result: Any = None, exc: Optional[BaseException] = None) -> None:
+    if future.done():  # el cliente se fue y la petición se canceló
+        return
+    if exc is not None:
+        future.set_exception(exc)
+    else:
+        future.set_result(result)
+
+
+BATCHER = MicroBatcher(enabled=BATCHING_ENABLED, max_rows=BATCH_MAX_ROWS, max_wait=BATCH_MAX_WAIT_MS / 1000.0)
+
+
+class StreamLineTooLong(ValueError):
+    pass
+
+
+async def split_lines(chunks: AsyncIterator[bytes], max_line_bytes: int) -> AsyncIterator[bytes]:
+    """Corta en líneas un cuerpo que llega por trozos sin juntarlo entero.
+
+    Solo se retiene la línea incompleta del final de cada trozo; si crece
+    más allá de ``max_line_bytes`` la entrada no es un CSV/NDJSON válido.
+    """
+    pending = bytearray()
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        pending += chunk
+        cut = pending.rfind(b"\n")
+        if cut >= 0:
+            for line in bytes(pending[:cut]).split(b"\n"):
+                yield line
+            del pending[:cut + 1]
+        if len(pending) > max_line_bytes:
+            raise StreamLineTooLong(len(pending))
+    if pending:
+        yield bytes(pending)
+
+
+class StreamScorer:
+    """Puntúa un archivo de flujos (CSV o NDJSON) mientras llega.
+
+    Las columnas deben ser las del esquema del modelo (las de
+    train_ids_model.py, hoy NSL-KDD: src_bytes, protocol_type, ...); no hay
+    traducción desde otros formatos. Un CSV de CICFlowMeter tal cual no trae
+    ninguna y se rechaza: hay que convertirlo antes o entrenar un modelo con
+    sus columnas.
+
+    ``prime`` lee la cabecera (o el primer registro NDJSON) antes de
+    responder, para rechazar con 400 una entrada sin ninguna característica
+    del modelo; las que falten quedan en 0 y se listan en el resumen. Luego
+    las líneas se agrupan en trozos de ``chunk_rows``; cada trozo se parsea y
+    transforma en un hilo, se predice con ``predict_proba`` y se devuelve
+    como NDJSON antes de leer el siguiente, así que la memoria queda acotada
+    por el trozo y no por el archivo.
+
+    Todo el archivo se puntúa con el modelo vigente al empezar aunque entre
+    tanto se recargue otro. Los procesos de inferencia solo se usan mientras
+    sirvan esa misma versión; si ya pasaron a la nueva, los trozos restantes
+    se predicen en un hilo en vez de rehacer el pool hacia atrás.
+
+    Cada predicción lleva el número de línea de entrada, las columnas de
+    ``echo`` presentes y la probabilidad por clase. Las filas que no se
+    pueden leer o transformar salen como ``{"error", "line"}`` sin cortar el
+    resto, y al final va un ``{"summary": ...}`` con los totales.
+    """
+
+    def __init__(self, loaded: LoadedModel, fmt: Optional[str], echo: Sequence[str], chunk_rows: int) -> None:
+        self.loaded = loaded
+        self.path = MODELS.path
+        self.fmt = fmt
+        self.echo = list(echo)
+        self.chunk_rows = max(1, chunk_rows)
+        self.header: Optional[List[str]] = None
+        transformer = loaded.transformer
+        self.features = transformer.numeric_names + [name for name, vocabulary in transformer.categorical if vocabulary]
+        self.missing: List[str] = []
+        self.classes = [c.item() if hasattr(c, "item") else c for c in getattr(loaded.model, "classes_", [])]
+        self.has_proba = hasattr(loaded.model, "predict_proba") and bool(self.classes)
+        self._lines: Optional[AsyncIterator[bytes]] = None
+        self._first: Optional[Tuple[int, str]] = None
+        self._lineno = 0
+        self.rows_total = 0
+        self.predicted_total = 0
+        self.errors_total = 0
+        self.chunks_total = 0
+
+    async def prime(self, body: AsyncIterator[bytes]) -> None:
+        """Lee hasta la primera línea con contenido y valida sus columnas contra el modelo."""
+        self._lines = split_lines(body, STREAM_MAX_LINE_BYTES)
+        try:
+            async for raw in self._lines:
+                self._lineno += 1
+                text = raw.decode("utf-8", errors="replace").strip()
+                if text:
+                    self._first = (self._lineno, text)
+                    break
+        except StreamLineTooLong:
+            raise HTTPException(status_code=400, detail=f"Línea de más de {STREAM_MAX_LINE_BYTES} bytes")
+        if self._first is None:
+            return
+        _, text = self._first
+        if self.fmt is None:
+            self.fmt = "ndjson" if text.startswith("{") else "csv"
+        if self.fmt == "csv":
+            self.header = [name.strip() for name in next(csv.reader([text]))]
+            self._first = None
+            columns: Sequence[str] = self.header
+        else:
+            try:
+                first = json.loads(text)
+            except ValueError:
+                first = None
+            columns = list(first) if isinstance(first, dict) else []
+        present = set(columns)
+        self.missing = [name for name in self.features if name not in present]
+        if len(self.missing) == len(self.features):
+            raise HTTPException(
+                status_code=400,
+                detail=f"La entrada no trae ninguna característica del modelo (espera p. ej. {', '.join(self.features[:5])})",
+            )
+
+    async def run(self) -> AsyncIterator[bytes]:
+        started = time.perf_counter()
+        lines: List[Tuple[int, str]] = [self._first] if self._first else []
+        try:
+            async for raw in self._lines or _no_lines():
+                self._lineno += 1
+                text = raw.decode("utf-8", errors="replace").strip()
+                if not text:
+                    continue
+                lines.append((self._lineno, text))
+                if len(lines) >= self.chunk_rows:
+                    yield await self._score(lines)
+                    lines = []
+            if lines:
+                yield await self._score(lines)
+        except StreamLineTooLong:
+            # Lo leído hasta la línea rota se puntúa igual
+            if lines:
+                yield await self._score(lines)
+            self.errors_total += 1
+            yield _ndjson({"error": f"Línea de más de {STREAM_MAX_LINE_BYTES} bytes, entrada cortada", "line": self._lineno + 1})
+        except ClientDisconnect:
+            return
+        yield _ndjson({"summary": self.summary(time.perf_counter() - started)})
+
+    async def _infer(self, X: Any, method: str) -> Any:
+        if WORKER_POOL.serves(self.loaded):
+            return await WORKER_POOL.predict(self.loaded, X, method)
+        return await run_in_threadpool(getattr(self.loaded.model, method), X)
+
+    async def _score(self, lines: List[Tuple[int, str]]) -> bytes:
+        self.chunks_total += 1
+        self.rows_total += len(lines)
+        numbers, echoes, X, out = await run_in_threadpool(self._prepare, lines)
+        if numbers:
+            try:
+                result = await self._infer(X, "predict_proba" if self.has_proba else "predict")
+            except Exception as e:
+                self.errors_total += len(numbers)
+                out.append(_ndjson({"error": f"Error de inferencia: {e}", "lines": [numbers[0], numbers[-1]]}))
+            else:
+                out.append(await run_in_threadpool(self._render, numbers, echoes, result))
+                self.predicted_total += len(numbers)
+        return b"".join(out)
+
+    def _prepare(self, lines: List[Tuple[int, str]]) -> Tuple[List[int], List[Dict[str, Any]], Any, List[bytes]]:
+        """Parsea y transforma un trozo; devuelve líneas válidas, columnas a copiar, matriz y errores."""
+        numbers: List[int] = []
+        rows: List[Dict[str, Any]] = []
+        out: List[bytes] = []
+        parsed = self._parse_csv(lines) if self.fmt == "csv" else self._parse_ndjson(lines)
+        for number, row, error in parsed:
+            if error is not None:
+                out.append(_ndjson({"error": error, "line": number}))
+            else:
+                numbers.append(number)
+                rows.append(row)
+        transformer = self.loaded.transformer
+        try:
+            X = transformer.transform(rows)
+        except (TypeError, ValueError):
+            # Alguna fila trae texto donde va un número: se aíslan fila a fila
+            keep, blocks = [], []
+            for i, row in enumerate(rows):
+                try:
+                    blocks.append(transformer.transform([row]))
+                    keep.append(i)
+                except (TypeError, ValueError) as e:
+                    out.append(_ndjson({"error": f"Fila no válida: {e}", "line": numbers[i]}))
+            numbers = [numbers[i] for i in keep]
+            rows = [rows[i] for i in keep]
+            X = np.concatenate(blocks) if blocks else transformer.transform([])
+        # Los extractores de flujos suelen escribir "Infinity" y "NaN" en tasas con duración 0
+        np.nan_to_num(X, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+        self.errors_total += len(out)
+        echoes = [{name: row[name] for name in self.echo if name in row} for row in rows]
+        return numbers, echoes, X, out
+
+    def _parse_csv(self, lines: List[Tuple[int, str]]) -> List[Tuple[int, Dict[str, Any], Optional[str]]]:
+        header = self.header or []
+        parsed = []
+        for (number, _), values in zip(lines, csv.reader(text for _, text in lines)):
+            if len(values) != len(header):
+                parsed.append((number, {}, f"Se esperaban {len(header)} columnas y llegaron {len(values)}"))
+            else:
+                parsed.append((number, dict(zip(header, values)), None))
+        return parsed
+
+    def _parse_ndjson(self, lines: List[Tuple[int, str]]) -> List[Tuple[int, Dict[str, Any], Optional[str]]]:
+        parsed = []
+        for number, text in lines:
+            try:
+                row = json.loads(text)
+            except ValueError as e:
+                parsed.append((number, {}, f"JSON inválido: {e}"))
+                continue
+            if isinstance(row, dict):
+                parsed.append((number, row, None))
+            else:
+                parsed.append((number, {}, "Cada línea debe ser un objeto JSON"))
+        return parsed
+
+    def _render(self, numbers: List[int], echoes: List[Dict[str, Any]], result: Any) -> bytes:
+        out = []
+        if self.has_proba:
+            best = result.argmax(axis=1)
+            for number, echo, idx, proba in zip(numbers, echoes, best.tolist(), result.tolist()):
+                out.append({
+                    "line": number,
+                    **echo,
+                    "prediction": self.classes[idx],
+                    "probability": round(proba[idx], 6),
+                    "probabilities": {str(c): round(p, 6) for c, p in zip(self.classes, proba)},
+                })
+        else:
+            for number, echo, pred in zip(numbers, echoes, result.tolist()):
+                out.append({"line": number, **echo, "prediction": pred})
+        return b"".join(_ndjson(item) for item in out)
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        return {
+            "format": self.fmt,
+            "rows": self.rows_total,
+            "predicted": self.predicted_total,
+            "errors": self.errors_total,
+            "chunks": self.chunks_total,
+            "elapsed_ms": round(elapsed * 1000.0, 1),
+            "missing_features": self.missing,
+            "model": {"path": self.path, "version": self.loaded.version},
+        }
+
+
+async def _no_lines() -> AsyncIterator[bytes]:
+    return
+    yield b""
+
+
+class BodyStreamingResponse(StreamingResponse):
+    """StreamingResponse que va leyendo el cuerpo de la petición mientras responde.
+
+    Con servidores ASGI < 2.4 StreamingResponse escucha la desconexión
+    llamando a ``receive()`` en paralelo, y esa tarea se come los mensajes
+    ``http.request`` que espera ``request.stream()``: la respuesta nunca
+    avanza. Aquí el único lector de ``receive()`` es el cuerpo; una
+    desconexión llega como ClientDisconnect y StreamScorer.run termina.
+    """
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+        if self.background is not None:
+            await self.background()
+
+
+def _ndjson(item: Dict[str, Any]) -> bytes:
+    return json.dumps(item, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def check_api_key(x_api_key: Optional[str]) -> None:
+    required = os.getenv("IDS_API_TOKEN")
+    if required and (x_api_key or "") != required:
+        raise HTTPException(status_code=401, detail="API key inválida o ausente")
+
+
+@app.on_event("startup")
+async def startup() -> None:
+    await run_in_threadpool(MODELS.reload_if_changed)
+    MODELS.start()
+
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    await BATCHER.stop()
+    await MODELS.stop()
+    WORKER_POOL.close()
 
 
 @app.get("/healthz")
@@ -54,17 +1006,27 @@ def healthz():
 
 @app.get("/api/ids/model")
 def model_info():
-    exists = os.path.exists(MODEL_PATH)
-    return {"path": MODEL_PATH, "available": exists}
+    MODELS.get()
+    return MODELS.info()
+
+
+@app.get("/api/ids/batching")
+def batching_stats():
+    """Lotes formados por el micro-batcher: filas y peticiones por lote y espera en cola."""
+    return BATCHER.stats()
+
+
+@app.get("/api/ids/workers")
+def worker_stats():
+    """Procesos de inferencia: cantidad, modo de arranque, versión de modelo que sirven y trozos repartidos."""
+    return WORKER_POOL.stats()
 
 
 @app.post("/api/ids/predict", response_model=PredictResponse)
-def predict(req: PredictRequest, x_api_key: str | None = Header(default=None, convert_underscores=True)) -> PredictResponse:
-    required = os.getenv("IDS_API_TOKEN")
-    if required and (x_api_key or "") != required:
-        raise HTTPException(status_code=401, detail="API key inválida o ausente")
-    model = _load_model()
-    if model is None:
+async def predict(req: PredictRequest, x_api_key: str | None = Header(default=None, convert_underscores=True)) -> PredictResponse:
+    check_api_key(x_api_key)
+    loaded = MODELS.get()
+    if loaded is None:
         # Fallback: clasificador trivial por umbral si existe feature conocida, si no 0
         preds = []
         for row in req.rows:
@@ -76,11 +1038,43 @@ def predict(req: PredictRequest, x_api_key: str | None = Header(default=None, co
                 preds.append(0)
         return PredictResponse(predictions=preds, model={"path": None})
 
-    # Inferencia con modelo real: requiere columnas alineadas al entrenamiento
     try:
-        import pandas as pd  # type: ignore
-        df = pd.DataFrame(req.rows)
-        preds = model.predict(df)
-        return PredictResponse(predictions=[int(x) for x in preds], model={"path": MODEL_PATH})
+        preds, version = await BATCHER.submit(loaded, req.rows)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error de inferencia: {e}")
+    return PredictResponse(predictions=preds, model={"path": MODEL_PATH, "version": version})
+
+
+@app.post("/api/ids/predict/stream")
+async def predict_stream(
+    request: Request,
+    fmt: Optional[str] = Query(default=None, alias="format"),
+    echo: Optional[str] = None,
+    chunk_rows: Optional[int] = Query(default=None, ge=1),
+    x_api_key: str | None = Header(default=None, convert_underscores=True),
+):
+    """Puntúa un CSV o NDJSON enviado por trozos, con las columnas del esquema del modelo.
+
+    Si la cabecera no trae ninguna característica del modelo responde 400
+    (p. ej. un CSV de CICFlowMeter sin convertir). El formato sale de ``?format=csv|ndjson``, del Content-Type o de la
+    primera línea; ``chunk_rows`` solo puede achicar el trozo configurado
+    (IDS_STREAM_CHUNK_ROWS). La respuesta es NDJSON: una línea por fila con
+    predicción y probabilidades, errores por fila y un resumen final.
+
+      curl -T flows.csv -H 'Content-Type: text/csv' http://ids-ml:8000/api/ids/predict/stream
+    """
+    check_api_key(x_api_key)
+    if fmt is None:
+        content_type = request.headers.get("content-type", "")
+        fmt = "csv" if "csv" in content_type else "ndjson" if "json" in content_type else None
+    elif fmt not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format debe ser csv o ndjson")
+    loaded = MODELS.get()
+    if loaded is None or loaded.transformer is None:
+        raise HTTPException(status_code=503, detail="No hay un modelo con preprocesado cargado para puntuar en streaming")
+    columns = [c.strip() for c in (STREAM_ECHO_COLUMNS if echo is None else echo).split(",") if c.strip()]
+    scorer = StreamScorer(loaded, fmt, columns, min(chunk_rows or STREAM_CHUNK_ROWS, STREAM_CHUNK_ROWS))
+    await scorer.prime(request.stream())
+    return BodyStreamingResponse(scorer.run(), media_type="application/x-ndjson")
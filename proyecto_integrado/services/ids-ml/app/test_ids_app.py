@@ -1,3 +1,4 @@
+import time
 from fastapi.testclient import TestClient
 import importlib.util
 from pathlib import Path
@@ -28,3 +29,237 @@ def test_predict_fallback():
     assert r.status_code == 200
     body = r.json()
     assert "predictions" in body
+
+
+def _train_tiny_model(path, flip=False):
+    import joblib
+    import pandas as pd
+    from sklearn.ensemble import RandomForestClassifier
+
+    X = pd.DataFrame({"src_bytes": [0, 10, 900, 1000], "dst_bytes": [1, 2, 3, 4]})
+    y = [1, 1, 0, 0] if flip else [0, 0, 1, 1]
+    joblib.dump(RandomForestClassifier(n_estimators=5, random_state=0).fit(X, y), path)
+
+
+def test_model_manager_keeps_model_resident_and_hot_swaps(tmp_path, monkeypatch):
+    import os
+
+    path = tmp_path / "best_model.joblib"
+    _train_tiny_model(path)
+    manager = mod.ModelManager(str(path), poll=1)
+    monkeypatch.setattr(mod, "MODELS", manager)
+    monkeypatch.setattr(mod, "MODEL_PATH", str(path))
+
+    rows = {"rows": [{"src_bytes": 950, "dst_bytes": 3}]}
+    first = client.post("/api/ids/predict", json=rows).json()
+    assert first["predictions"] == [1]
+    info = client.get("/api/ids/model").json()
+    assert info["loaded"] and info["version"] == first["model"]["version"]
+    assert info["memory_bytes"] > 0 and info["load_seconds"] is not None
+    assert manager.reload_if_changed() is False
+
+    _train_tiny_model(path, flip=True)
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 10**9))
+    assert manager.reload_if_changed() is True
+    second = client.post("/api/ids/predict", json=rows).json()
+    assert second["predictions"] == [0] and second["model"]["version"] != first["model"]["version"]
+
+    path.write_bytes(b"a medio escribir")
+    assert manager.reload_if_changed() is False
+    assert manager.current.version == second["model"]["version"] and manager.last_error
+
+
+def test_persisted_preprocessing_matches_training_matrix(tmp_path, monkeypatch):
+    import numpy as np
+    import pandas as pd
+
+    spec_train = importlib.util.spec_from_file_location("ids_train", _MAIN.parent.parent / "training" / "train_ids_model.py")
+    train = importlib.util.module_from_spec(spec_train)  # type: ignore
+    spec_train.loader.exec_module(train)  # type: ignore
+
+    rng = np.random.default_rng(0)
+
+    def frame(n):
+        df = pd.DataFrame(rng.integers(0, 50, size=(n, len(train.COLUMN_NAMES))), columns=train.COLUMN_NAMES)
+        df["protocol_type"] = rng.choice(["tcp", "udp", "icmp"], n)
+        df["service"] = rng.choice(["http", "ftp", "smtp"], n)
+        df["flag"] = rng.choice(["SF", "S0"], n)
+        df["attack"] = np.where(df["src_bytes"] > 25, "neptune", "normal")
+        return df
+
+    train_df, test_df = frame(300), frame(40)
+    test_df.loc[0, "service"] = "telnet"  # categoría no vista en entrenamiento
+    X_train, y_train, X_test, _, preprocessing = train.preprocess(train_df, test_df)
+    clf = train.train_model(X_train, y_train)
+    path = tmp_path / "best_model.joblib"
+    train.save_model(clf, preprocessing, path)
+
+    manager = mod.ModelManager(str(path), poll=1)
+    monkeypatch.setattr(mod, "MODELS", manager)
+    rows = test_df.drop(columns=["attack", "difficulty"]).to_dict(orient="records")
+    loaded = manager.get()
+    assert loaded.preprocessing == "persisted"
+    matrix = loaded.transformer.transform(rows)
+    assert matrix.dtype == np.float32
+    np.testing.assert_allclose(matrix, X_test.to_numpy(dtype=np.float32), rtol=1e-6)
+
+    r = client.post("/api/ids/predict", json={"rows": rows})
+    assert r.json()["predictions"] == clf.predict(X_test.to_numpy(dtype=np.float32)).tolist()
+    assert client.get("/api/ids/model").json()["features"] == len(preprocessing["columns"])
+
+
+def test_micro_batcher_coalesces_concurrent_requests_and_isolates_bad_rows(tmp_path, monkeypatch):
+    import asyncio
+
+    path = tmp_path / "best_model.joblib"
+    _train_tiny_model(path)
+    manager = mod.ModelManager(str(path), poll=1)
+    batcher = mod.MicroBatcher(enabled=True, max_rows=64, max_wait=0.02)
+    monkeypatch.setattr(mod, "MODELS", manager)
+    monkeypatch.setattr(mod, "BATCHER", batcher)
+    loaded = manager.get()
+
+    rows = [{"src_bytes": 950 if i % 2 else 5, "dst_bytes": 3 if i % 2 else 1} for i in range(10)]
+    expected = [[p] for p in mod.predict_rows(loaded, rows)]
+
+    async def burst():
+        good = [batcher.submit(loaded, [row]) for row in rows]
+        bad = batcher.submit(loaded, [{"src_bytes": "no-numérico", "dst_bytes": 1}])
+        results = await asyncio.gather(*good, bad, return_exceptions=True)
+        await batcher.stop()
+        return results
+
+    results = asyncio.run(burst())
+    assert [r[0] for r in results[:10]] == expected
+    assert isinstance(results[10], mod.HTTPException) and results[10].status_code == 400
+    stats = batcher.stats()
+    assert stats["requests_total"] == 11 and stats["batches_total"] < 11 and stats["isolated_total"] >= 1
+    assert stats["queue_wait_ms"]["count"] == 11
+
+
+def test_inference_pool_matches_in_process_predictions_and_follows_model_version(tmp_path, monkeypatch):
+    import asyncio
+    import sys
+
+    path = tmp_path / "best_model.joblib"
+    _train_tiny_model(path)
+    manager = mod.ModelManager(str(path), poll=1)
+    # Los workers resuelven las funciones por nombre de módulo al despickear
+    monkeypatch.setitem(sys.modules, mod.__name__, mod)
+    pool = mod.InferencePool(workers=2, start_method="fork", chunk_rows=4)
+    monkeypatch.setattr(mod, "MODELS", manager)
+    monkeypatch.setattr(mod, "WORKER_POOL", pool)
+    try:
+        loaded = manager.get()
+        rows = [{"src_bytes": 950 if i % 3 else 5, "dst_bytes": i} for i in range(20)]
+        assert asyncio.run(mod.infer(loaded, rows)) == mod.predict_rows(loaded, rows)
+        stats = pool.stats()
+        assert stats["running"] and stats["model_version"] == loaded.version
+        assert stats["chunks_total"] == 2 and stats["rows_total"] == 20
+        assert len(stats["pids"]) == 2
+
+        time.sleep(0.01)
+        _train_tiny_model(path, flip=True)
+        assert manager.reload_if_changed()
+        swapped = manager.get()
+        assert asyncio.run(mod.infer(swapped, rows)) == mod.predict_rows(swapped, rows)
+        assert pool.stats()["rebuilds_total"] == 2 and pool.stats()["model_version"] == swapped.version
+    finally:
+        pool.close()
+    assert not pool.stats()["running"]
+
+
+def test_inference_pool_default_start_loads_model_and_recovers_from_dead_worker(tmp_path, monkeypatch):
+    import asyncio
+    import os
+    import signal
+    import sys
+
+    # forkserver arranca intérpretes limpios: necesitan importar el servicio por nombre
+    monkeypatch.syspath_prepend(str(_MAIN.parent))
+    import main as service
+
+    path = tmp_path / "best_model.joblib"
+    _train_tiny_model(path)
+    manager = service.ModelManager(str(path), poll=1)
+    pool = service.InferencePool(workers=2, start_method=service.WORKER_START, chunk_rows=4)
+    monkeypatch.setattr(service, "MODELS", manager)
+    assert pool.start_method == "forkserver"
+    try:
+        loaded = manager.get()
+        rows = [{"src_bytes": 950 if i % 3 else 5, "dst_bytes": i} for i in range(20)]
+        expected = service.predict_rows(loaded, rows)
+        X = loaded.transformer.transform(rows)
+        assert asyncio.run(pool.predict(loaded, X)).tolist() == expected
+
+        # Un worker muerto (OOM killer) rompe el executor: se rehace y se reintenta
+        os.kill(pool.stats()["pids"][0], signal.SIGKILL)
+        time.sleep(0.2)
+        assert asyncio.run(pool.predict(loaded, X)).tolist() == expected
+        stats = pool.stats()
+        assert stats["broken_total"] == 1 and stats["rebuilds_total"] == 2 and stats["running"]
+    finally:
+        pool.close()
+        sys.modules.pop("main", None)
+
+
+def test_predict_stream_scores_csv_and_ndjson_by_chunks(tmp_path, monkeypatch):
+    import json
+
+    path = tmp_path / "best_model.joblib"
+    _train_tiny_model(path)
+    manager = mod.ModelManager(str(path), poll=1)
+    monkeypatch.setattr(mod, "MODELS", manager)
+    loaded = manager.get()
+
+    csv_text = "Flow ID, src_bytes, dst_bytes\n" + "".join(
+        f"f{i},{950 if i % 2 else 5},{i}\n" for i in range(7)
+    ) + "f7,Infinity,NaN\nf8,1,2,3\nf9,texto,1\nf10,1000,4"
+    body = csv_text.encode()
+
+    def chunks():
+        # Trozos de 5 bytes: las líneas llegan partidas entre trozos
+        for start in range(0, len(body), 5):
+            yield body[start:start + 5]
+
+    res = client.post(
+        "/api/ids/predict/stream?chunk_rows=3&echo=Flow ID",
+        content=chunks(),
+        headers={"Content-Type": "text/csv"},
+    )
+    assert res.status_code == 200 and res.headers["content-type"].startswith("application/x-ndjson")
+    items = [json.loads(line) for line in res.text.splitlines()]
+    summary = items[-1]["summary"]
+    assert summary == {**summary, "format": "csv", "rows": 11, "predicted": 9, "errors": 2, "chunks": 4, "missing_features": []}
+    assert summary["model"]["version"] == loaded.version
+
+    preds = {item["line"]: item for item in items if "prediction" in item}
+    rows = [{"src_bytes": 950 if i % 2 else 5, "dst_bytes": i} for i in range(7)]
+    assert [preds[i + 2]["prediction"] for i in range(7)] == mod.predict_rows(loaded, rows)
+    assert preds[2]["Flow ID"] == "f0" and set(preds[2]["probabilities"]) == {"0", "1"}
+    assert preds[2]["probability"] == max(preds[2]["probabilities"].values())
+    assert 9 in preds and 12 in preds  # Infinity/NaN se puntúan como 0
+    errors = {item["line"]: item["error"] for item in items if "error" in item}
+    assert set(errors) == {10, 11} and "columnas" in errors[10]
+
+    ndjson = b'{"src_bytes": 1000, "dst_bytes": 4}\n[1]\n{"src_bytes": 0, "dst_bytes": 1}\n'
+    res = client.post("/api/ids/predict/stream", content=ndjson)
+    items = [json.loads(line) for line in res.text.splitlines()]
+    assert items[-1]["summary"]["format"] == "ndjson" and items[-1]["summary"]["predicted"] == 2
+    assert [item["prediction"] for item in items if "prediction" in item] == mod.predict_rows(
+        loaded, [{"src_bytes": 1000, "dst_bytes": 4}, {"src_bytes": 0, "dst_bytes": 1}]
+    )
+
+    # Cabecera sin ninguna característica del modelo: se rechaza antes de responder
+    res = client.post("/api/ids/predict/stream", content=b"Flow ID,Flow Duration\nf0,12\n", headers={"Content-Type": "text/csv"})
+    assert res.status_code == 400 and "src_bytes" in res.json()["detail"]
+    res = client.post("/api/ids/predict/stream?format=csv", content=b"src_bytes\n1000\n")
+    assert json.loads(res.text.splitlines()[-1])["summary"]["missing_features"] == ["dst_bytes"]
+
+    monkeypatch.setattr(mod, "STREAM_MAX_LINE_BYTES", 16)
+    res = client.post("/api/ids/predict/stream?format=ndjson", content=b'{"src_bytes": 1000, "dst_bytes": 4, "x": 1}')
+    assert res.status_code == 400
+    res = client.post("/api/ids/predict/stream?format=ndjson", content=iter([b'{"src_bytes": 1}\n', b'{"src_bytes": 1000, ', b'"dst_bytes": 4}']))
+    items = [json.loads(line) for line in res.text.splitlines()]
+    assert items[0]["line"] == 1 and "error" in items[1] and items[-1]["summary"]["predicted"] == 1
+    assert client.post("/api/ids/predict/stream?format=xml", content=b"").status_code == 400
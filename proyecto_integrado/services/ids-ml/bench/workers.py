@@ -0,0 +1,138 @@
+"""
+Benchmark de los procesos de inferencia del IDS-ML.
+
+Carga best_model.joblib con el mismo ModelManager del servicio y, para cada
+cantidad de workers, predice lotes de filas a través de infer(): 0 workers es
+el camino en hilos del propio proceso, N > 0 usa InferencePool. Reporta
+filas/s, latencia p50/p95 por lote y la memoria de cada worker leída de
+/proc/<pid>/smaps_rollup (RSS, PSS y páginas privadas), que es lo que dice si
+el modelo se comparte o se copia en cada proceso.
+
+  python3 bench/workers.py --workers 0 1 2 4 --batch 2000 --repeat 20
+  python3 bench/workers.py --start fork --workers 2 --json /tmp/ids_workers.json
+
+Sin --rows, las filas se generan a partir del preprocesado del modelo
+(numéricas exponenciales y categorías de su vocabulario).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+
+
+def load_service() -> Any:
+    # Importado como módulo "main" desde app/: con spawn los workers heredan
+    # sys.path y resuelven por ese nombre las funciones del pool
+    sys.path.insert(0, str(SERVICE_DIR / "app"))
+    return importlib.import_module("main")
+
+
+def smaps(pid: int) -> Dict[str, int]:
+    """RSS, PSS y memoria privada (MB) de un proceso."""
+    fields = {"Rss:": "rss_mb", "Pss:": "pss_mb", "Private_Clean:": "private_mb", "Private_Dirty:": "private_mb"}
+    out = {"rss_mb": 0, "pss_mb": 0, "private_mb": 0}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as fh:
+            for line in fh:
+                parts = line.split()
+                if parts and parts[0] in fields:
+                    out[fields[parts[0]]] += int(parts[1])
+    except OSError:
+        return {}
+    return {key: value // 1024 for key, value in out.items()}
+
+
+def synth_rows(transformer: Any, count: int, seed: int) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(count):
+        row: Dict[str, Any] = {name: rng.expovariate(1 / 50) for name in transformer.numeric_names}
+        for name, vocabulary in transformer.categorical:
+            if vocabulary:
+                row[name] = rng.choice(list(vocabulary))
+        rows.append(row)
+    return rows
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+async def run_case(mod: Any, loaded: Any, rows: List[Dict[str, Any]], args: argparse.Namespace) -> Dict[str, Any]:
+    await mod.infer(loaded, rows[: args.chunk_rows])  # calentamiento: arranca el pool
+    batches = [rows] * args.concurrency
+    latencies: List[float] = []
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        await asyncio.gather(*(mod.infer(loaded, batch) for batch in batches))
+        latencies.append((time.perf_counter() - t0) * 1000)
+    elapsed = time.perf_counter() - started
+    total_rows = len(rows) * args.concurrency * args.repeat
+    return {
+        "rows_per_s": round(total_rows / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--model", default=str(SERVICE_DIR / "models" / "best_model.joblib"))
+    ap.add_argument("--rows", help="JSON con una lista de filas crudas")
+    ap.add_argument("--workers", nargs="+", type=int, default=[0, 1, 2, 4])
+    ap.add_argument("--start", choices=("fork", "spawn", "forkserver"), default="forkserver")
+    ap.add_argument("--batch", type=int, default=2000, help="filas por lote")
+    ap.add_argument("--concurrency", type=int, default=1, help="lotes simultáneos por iteración")
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--chunk-rows", type=int, default=256)
+    ap.add_argument("--json", help="Vuelca los resultados a este archivo")
+    args = ap.parse_args()
+
+    if not Path(args.model).exists():
+        sys.exit(f"No existe {args.model}; genera el modelo con training/train_ids_model.py o usa --model")
+    mod = load_service()
+    manager = mod.ModelManager(args.model, poll=0)
+    loaded = manager.get()
+    if loaded is None or loaded.transformer is None:
+        sys.exit(f"No se pudo cargar {args.model}: {manager.info().get('error')}")
+    mod.MODELS = manager
+    if args.rows:
+        rows = json.loads(Path(args.rows).read_text())
+        rows = (rows * (args.batch // max(1, len(rows)) + 1))[: args.batch]
+    else:
+        rows = synth_rows(loaded.transformer, args.batch, seed=7)
+
+    results = []
+    print(f"modelo {loaded.version[:12]}  {loaded.memory_bytes // 2**20} MB  cpus={os.cpu_count()}  start={args.start}")
+    print(f"{'workers':>7}  {'filas/s':>10}  {'p50 ms':>8}  {'p95 ms':>8}  memoria por worker (rss/pss/privada MB)")
+    for workers in args.workers:
+        mod.WORKER_POOL = mod.InferencePool(workers=workers, start_method=args.start, chunk_rows=args.chunk_rows)
+        try:
+            case = asyncio.run(run_case(mod, loaded, rows, args))
+            stats = mod.WORKER_POOL.stats()
+            case.update(workers=workers, parent=smaps(os.getpid()), worker_memory=[smaps(pid) for pid in stats["pids"]])
+        finally:
+            mod.WORKER_POOL.close()
+        results.append(case)
+        memory = "  ".join(f"{m.get('rss_mb')}/{m.get('pss_mb')}/{m.get('private_mb')}" for m in case["worker_memory"]) or "-"
+        print(f"{workers:>7}  {case['rows_per_s']:>10}  {case['p50_ms']:>8}  {case['p95_ms']:>8}  {memory}")
+
+    if args.json:
+        meta = {"model": args.model, "version": loaded.version, "cpus": os.cpu_count(), "start": args.start, "batch": args.batch}
+        Path(args.json).write_text(json.dumps({"meta": meta, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
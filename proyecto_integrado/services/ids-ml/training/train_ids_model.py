@@ -4,11 +4,13 @@ from __future__ import annotations
 
 import argparse
 import json
+import os
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Tuple
+from typing import Any, Dict, Tuple
 
 import joblib
+import numpy as np
 import pandas as pd
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score, classification_report, f1_score
@@ -29,6 +31,7 @@ COLUMN_NAMES = [
     'dst_host_serror_rate', 'dst_host_srv_serror_rate', 'dst_host_rerror_rate',
     'dst_host_srv_rerror_rate', 'attack', 'difficulty'
 ]
+CATEGORICAL_COLUMNS = ['protocol_type', 'service', 'flag']
 
 
 def load_dataset(train_url: str, test_url: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
@@ -37,7 +40,12 @@ def load_dataset(train_url: str, test_url: str) -> Tuple[pd.DataFrame, pd.DataFr
     return train_df, test_df
 
 
-def preprocess(train_df: pd.DataFrame, test_df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.Series, pd.DataFrame, pd.Series]:
+def preprocess(
+    train_df: pd.DataFrame, test_df: pd.DataFrame
+) -> Tuple[pd.DataFrame, pd.Series, pd.DataFrame, pd.Series, Dict[str, Any]]:
+    """Codifica y escala como en el notebook; devuelve además la especificación
+    del preprocesado (orden de columnas, vocabularios y escalas) que el servicio
+    necesita para transformar las filas de inferencia igual que aquí."""
     train_df = train_df.copy()
     test_df = test_df.copy()
     train_df['is_attack'] = (train_df['attack'] != 'normal').astype(int)
@@ -45,7 +53,7 @@ def preprocess(train_df: pd.DataFrame, test_df: pd.DataFrame) -> Tuple[pd.DataFr
     train_df.drop(columns=['attack', 'difficulty'], inplace=True)
     test_df.drop(columns=['attack', 'difficulty'], inplace=True)
 
-    cat_cols = ['protocol_type', 'service', 'flag']
+    cat_cols = CATEGORICAL_COLUMNS
     train_proc = pd.get_dummies(train_df, columns=cat_cols)
     test_proc = pd.get_dummies(test_df, columns=cat_cols)
 
@@ -67,7 +75,14 @@ def preprocess(train_df: pd.DataFrame, test_df: pd.DataFrame) -> Tuple[pd.DataFr
     X_train[numeric] = scaler.fit_transform(X_train[numeric])
     X_test[numeric] = scaler.transform(X_test[numeric])
 
-    return X_train, y_train, X_test, y_test
+    preprocessing = {
+        'version': 1,
+        'columns': list(X_train.columns),
+        'numeric': numeric,
+        'categorical': {col: sorted(train_df[col].astype(str).unique().tolist()) for col in cat_cols},
+        'scale': {col: float(scale) for col, scale in zip(numeric, scaler.scale_)},
+    }
+    return X_train, y_train, X_test, y_test, preprocessing
 
 
 def train_model(X_train: pd.DataFrame, y_train: pd.Series) -> RandomForestClassifier:
@@ -77,12 +92,14 @@ def train_model(X_train: pd.DataFrame, y_train: pd.Series) -> RandomForestClassi
         random_state=42,
         class_weight='balanced',
     )
-    clf.fit(X_train, y_train)
+    # Se entrena sobre la matriz float32 (sin nombres de columna): es lo que el
+    # servicio le pasa en inferencia, ya alineada según el preprocesado guardado.
+    clf.fit(X_train.to_numpy(dtype=np.float32), y_train)
     return clf
 
 
 def evaluate(clf: RandomForestClassifier, X_test: pd.DataFrame, y_test: pd.Series) -> dict:
-    preds = clf.predict(X_test)
+    preds = clf.predict(X_test.to_numpy(dtype=np.float32))
     accuracy = accuracy_score(y_test, preds)
     f1 = f1_score(y_test, preds)
     report = classification_report(y_test, preds, target_names=['Normal', 'Attack'])
@@ -93,6 +110,18 @@ def evaluate(clf: RandomForestClassifier, X_test: pd.DataFrame, y_test: pd.Serie
     }
 
 
+def save_model(clf: RandomForestClassifier, preprocessing: Dict[str, Any], out_path: Path) -> None:
+    """Guarda modelo y preprocesado juntos, de forma atómica.
+
+    Se escribe a un temporal y se renombra: el servicio vigila el archivo y
+    nunca debe ver un modelo a medio escribir.
+    """
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = out_path.with_name(out_path.name + '.tmp')
+    joblib.dump({'model': clf, 'preprocessing': preprocessing}, tmp_path)
+    os.replace(tmp_path, out_path)
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(description='Train IDS model (NSL-KDD)')
     parser.add_argument('--output', default='proyecto_integrado/services/ids-ml/models/best_model.joblib')
@@ -102,14 +131,13 @@ def main() -> None:
     print('Descargando dataset...')
     train_df, test_df = load_dataset(TRAIN_URL, TEST_URL)
     print('Preprocesando...')
-    X_train, y_train, X_test, y_test = preprocess(train_df, test_df)
+    X_train, y_train, X_test, y_test, preprocessing = preprocess(train_df, test_df)
     print('Entrenando RandomForest...')
     clf = train_model(X_train, y_train)
     print('Evaluando...')
     metrics = evaluate(clf, X_test, y_test)
     out_path = Path(args.output)
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    joblib.dump(clf, out_path)
+    save_model(clf, preprocessing, out_path)
     print(f'Modelo guardado en {out_path}')
     metadata = {
         'generated_at': datetime.now(timezone.utc).isoformat(),
@@ -117,6 +145,7 @@ def main() -> None:
         'test_url': TEST_URL,
         'accuracy': metrics['accuracy'],
         'f1': metrics['f1'],
+        'features': len(preprocessing['columns']),
     }
     Path(args.metadata).write_text(json.dumps(metadata, indent=2), encoding='utf-8')
     (out_path.parent / 'evaluation.txt').write_text(metrics['classification_report'], encoding='utf-8')
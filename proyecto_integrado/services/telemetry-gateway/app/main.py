@@ -1,26 +1,2149 @@
 from __future__ import annotations
 
+import asyncio
+import bisect
+import gzip
+import hashlib
+import hmac
 import json
+import logging
+import math
+import operator
 import os
+import re
 import sqlite3
-from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional, Sequence
+import struct
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from itertools import islice
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterator, List, Optional, Sequence, Set, Tuple
 
 # psycopg2 es opcional: si no está instalado y no se define TG_DB_URL,
 # permitimos que el servicio funcione con SQLite (usado en CI/tests).
 try:  # pragma: no cover - path de import opcional
     import psycopg2  # type: ignore
+    import psycopg2.pool  # type: ignore
 except Exception:  # ModuleNotFoundError o similar
     psycopg2 = None  # type: ignore
-from fastapi import FastAPI, HTTPException, Header, Query
+# orjson acelera la serialización de respuestas grandes; si falta se usa json.
+try:  # pragma: no cover - path de import opcional
+    import orjson  # type: ignore
+except Exception:
+    orjson = None  # type: ignore
+# zstandard habilita Content-Encoding: zstd; sin él sólo se negocia gzip.
+try:  # pragma: no cover - path de import opcional
+    import zstandard  # type: ignore
+except Exception:
+    zstandard = None  # type: ignore
+from fastapi import FastAPI, HTTPException, Header, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.datastructures import Headers, MutableHeaders
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+
+
+DB_PATH = os.getenv("TG_DB_PATH", "/tmp/telemetry.db")
+DB_URL = os.getenv("TG_DB_URL")
+# Usamos Postgres solo si hay URL y el módulo está disponible
+USE_POSTGRES = bool(DB_URL) and psycopg2 is not None
+
+# Pool de conexiones: tamaño máximo de conexiones simultáneas y segundos que un
+# request espera por una libre antes de responder 503.
+DB_POOL_MIN = int(os.getenv("TG_DB_POOL_MIN", "1"))
+DB_POOL_SIZE = int(os.getenv("TG_DB_POOL_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("TG_DB_POOL_TIMEOUT", "5"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("TG_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_KB = int(os.getenv("TG_SQLITE_CACHE_KB", "16384"))
+# Sentencias compiladas que guarda cada conexión SQLite (fetch_many genera una
+# variante por combinación de filtros, además de los INSERT multi-fila)
+SQLITE_STATEMENT_CACHE = int(os.getenv("TG_SQLITE_STATEMENT_CACHE", "256"))
+# Cómo esperan los handlers a la BD: "threadpool" usa el threadpool compartido
+# de FastAPI/anyio; "async" usa ejecutores propios (lectores + writer dedicado
+# en SQLite) que no compiten con el resto del threadpool ni por su límite.
+DB_MODE = os.getenv("TG_DB_MODE", "threadpool").strip().lower()
+# Motor de almacenamiento: sqlite, postgres o memory (sin persistencia; tests,
+# demos y benchmarks). Por defecto se deduce de TG_DB_URL.
+STORE_ENGINE = os.getenv("TG_STORE", "").strip().lower() or ("postgres" if USE_POSTGRES else "sqlite")
+# Máximo de lecturas aceptadas por POST /api/telemetry/ingest/batch
+INGEST_BATCH_MAX = int(os.getenv("TG_INGEST_BATCH_MAX", "5000"))
+# Tramas binarias de ingesta (ver decode_frames): Content-Type que las anuncia y
+# tabla de métricas; el id de cada métrica es su posición en TG_BINARY_METRICS,
+# así que sólo se pueden añadir nombres al final.
+BINARY_CONTENT_TYPE = "application/x-telemetry-frame"
+BINARY_METRIC_NAMES = [
+    m.strip()
+    for m in os.getenv(
+        "TG_BINARY_METRICS", "TEMP,HUM,LAT,LON,ALT,BATT,SPEED,HEADING,PRESSURE,CO2"
+    ).split(",")
+    if m.strip()
+]
+BINARY_METRIC_IDS = {name: idx for idx, name in enumerate(BINARY_METRIC_NAMES)}
+# Filas por INSERT multi-fila (hasta 8 parámetros por fila, bajo el límite de 999 de SQLite)
+MULTI_ROW_CHUNK = 100
+
+# Modo de ingesta: "sync" (responde tras el commit) o "write-behind" (encola la
+# lectura, responde 202 y un writer en segundo plano la persiste por lotes).
+INGEST_MODE = os.getenv("TG_INGEST_MODE", "sync").strip().lower()
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv("TG_WRITE_BEHIND_QUEUE_SIZE", "10000"))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("TG_WRITE_BEHIND_BATCH_SIZE", "500"))
+WRITE_BEHIND_FLUSH_MS = float(os.getenv("TG_WRITE_BEHIND_FLUSH_MS", "50"))
+
+# Caché en memoria de /last y /live: robots retenidos, lecturas por robot y
+# segundos sin datos tras los que un robot se descarta de la caché.
+LIVE_MAX_ROBOTS = int(os.getenv("TG_LIVE_MAX_ROBOTS", "5000"))
+LIVE_TRAIL_SIZE = int(os.getenv("TG_LIVE_TRAIL_SIZE", "100"))
+LIVE_IDLE_SECONDS = float(os.getenv("TG_LIVE_IDLE_SECONDS", "3600"))
+
+# Push de lecturas (SSE / WebSocket): clientes simultáneos, mensajes en cola por
+# cliente antes de descartar los más viejos y segundos entre keepalives.
+STREAM_MAX_CLIENTS = int(os.getenv("TG_STREAM_MAX_CLIENTS", "500"))
+STREAM_CLIENT_QUEUE = int(os.getenv("TG_STREAM_CLIENT_QUEUE", "256"))
+STREAM_KEEPALIVE_SECONDS = float(os.getenv("TG_STREAM_KEEPALIVE_SECONDS", "15"))
+
+# Compresión HTTP: respuestas desde TG_COMPRESSION_MIN_BYTES con zstd o gzip
+# según Accept-Encoding; cuerpos gzip/zstd de entrada hasta TG_MAX_BODY_BYTES.
+COMPRESSION_MIN_BYTES = int(os.getenv("TG_COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("TG_GZIP_LEVEL", "6"))
+ZSTD_LEVEL = int(os.getenv("TG_ZSTD_LEVEL", "3"))
+MAX_BODY_BYTES = int(os.getenv("TG_MAX_BODY_BYTES", str(64 * 1024 * 1024)))
+
+# Rollups min/max/avg/count por métrica numérica, robot y bucket temporal,
+# mantenidos en la misma transacción que la ingesta.
+ROLLUPS_ENABLED = os.getenv("TG_ROLLUPS_ENABLED", "1").strip().lower() not in {"0", "false", "no"}
+ROLLUP_BUCKETS = ("1m", "1h")
+
+# Retención: días que se conservan las lecturas crudas y cada nivel de rollup
+# (0 = sin límite), cada cuánto corre la purga, filas por DELETE y pausa entre
+# lotes para no acaparar el lock de escritura. Con TG_ARCHIVE_DIR las filas
+# crudas vencidas se exportan a NDJSON gzip por día antes de borrarlas.
+RETENTION_RAW_DAYS = float(os.getenv("TG_RETENTION_RAW_DAYS", "0"))
+RETENTION_ROLLUP_DAYS = {
+    "1m": float(os.getenv("TG_RETENTION_ROLLUP_1M_DAYS", "0")),
+    "1h": float(os.getenv("TG_RETENTION_ROLLUP_1H_DAYS", "0")),
+}
+RETENTION_INTERVAL_SECONDS = float(os.getenv("TG_RETENTION_INTERVAL_SECONDS", "3600"))
+RETENTION_CHUNK = int(os.getenv("TG_RETENTION_CHUNK", "5000"))
+RETENTION_PAUSE_MS = float(os.getenv("TG_RETENTION_PAUSE_MS", "50"))
+ARCHIVE_DIR = os.getenv("TG_ARCHIVE_DIR")
+
+# Almacenamiento de métricas: "json" guarda solo el blob ``data``; "narrow"
+# además copia cada métrica numérica a telemetry_metric(telemetry_id, key,
+# value) indexada, y en Postgres migra ``data`` a JSONB.
+METRICS_STORAGE = os.getenv("TG_METRICS_STORAGE", "json").strip().lower()
+
+# Filtros ?metric=TEMP>28 de /api/telemetry/query
+METRIC_FILTER_RE = re.compile(r"^\s*([A-Za-z0-9_]+)\s*(>=|<=|!=|=|>|<)\s*(-?\d+(?:\.\d+)?)\s*$")
+
+# Rejilla espacial de /area: celdas de GEO_CELL_DEG grados (~1.1 km en el
+# ecuador) numeradas fila × GEO_COLS + columna. Cambiar el tamaño invalida la
+# columna geo_cell de las filas ya guardadas.
+GEO_CELL_DEG = 0.01
+GEO_COLS = int(round(360 / GEO_CELL_DEG)) + 1
+# Con más filas de rejilla que esto, /area consulta un único rango de celdas
+GEO_MAX_CELL_RANGES = 64
+
+# Exposición Prometheus en /metrics: peticiones y latencia por ruta, tiempo de
+# BD por operación, filas ingeridas por robot y peticiones en curso.
+PROMETHEUS_ENABLED = os.getenv("TG_PROMETHEUS_ENABLED", "1").strip().lower() not in {"0", "false", "no"}
+HTTP_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+# Autenticación de ingesta. TG_INGEST_TOKEN es la clave compartida de
+# siempre; TG_KEYS_FILE (JSON) y TG_KEYS_DB (ruta SQLite, p. ej. la BD de
+# Croody, o URL Postgres) alimentan un registro de claves por robot/usuario
+# que vive en memoria y se recarga cada TG_KEYS_REFRESH_SECONDS. Cada clave
+# del registro admite TG_KEY_RATE lecturas/seg con ráfagas de TG_KEY_BURST
+# (0 = sin límite), salvo que el archivo indique otros valores.
+INGEST_TOKEN = os.getenv("TG_INGEST_TOKEN")
+KEYS_FILE = os.getenv("TG_KEYS_FILE")
+KEYS_DB = os.getenv("TG_KEYS_DB")
+KEYS_DB_QUERY = os.getenv(
+    "TG_KEYS_DB_QUERY", "SELECT ingest_token, 'user:' || user_id FROM landing_userprofile"
+)
+KEYS_REFRESH_SECONDS = float(os.getenv("TG_KEYS_REFRESH_SECONDS", "60"))
+KEY_RATE = float(os.getenv("TG_KEY_RATE", "100"))
+KEY_BURST = float(os.getenv("TG_KEY_BURST", "1000"))
+
+logger = logging.getLogger("telemetry-gateway")
+
+
+class PrometheusRegistry:
+    """Contadores, gauges e histogramas en memoria con salida en formato texto de Prometheus.
+
+    Cada serie se indexa por la tupla de valores de sus etiquetas. Los
+    histogramas guardan el conteo por bucket sin acumular (se acumula al
+    exponer), así que ``observe`` es un bisect y dos sumas bajo un lock. Los
+    gauges con ``callback`` se leen en el momento del scrape.
+    """
+
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._meta: Dict[str, Tuple[str, str, Tuple[str, ...], Tuple[float, ...]]] = {}
+        self._series: Dict[str, Dict[Tuple[str, ...], Any]] = {}
+        self._callbacks: Dict[str, Callable[[], float]] = {}
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> None:
+        self._declare(name, "counter", help_text, labels)
+
+    def gauge(
+        self, name: str, help_text: str, labels: Tuple[str, ...] = (), callback: Optional[Callable[[], float]] = None
+    ) -> None:
+        self._declare(name, "gauge", help_text, labels)
+        if callback is not None:
+            self._callbacks[name] = callback
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...], labels: Tuple[str, ...] = ()) -> None:
+        self._declare(name, "histogram", help_text, labels, buckets)
+
+    def _declare(
+        self, name: str, kind: str, help_text: str, labels: Tuple[str, ...], buckets: Tuple[float, ...] = ()
+    ) -> None:
+        self._meta[name] = (kind, help_text, labels, tuple(sorted(buckets)))
+        self._series[name] = {}
+
+    def inc(self, name: str, labels: Tuple[str, ...] = (), amount: float = 1.0) -> None:
+        """Suma a un contador o gauge."""
+        if not self.enabled:
+            return
+        series = self._series[name]
+        with self._lock:
+            series[labels] = series.get(labels, 0.0) + amount
+
+    def inc_counts(self, name: str, counts: Dict[Tuple[str, ...], int]) -> None:
+        """Varios incrementos con un solo lock (p. ej. filas por robot de un lote)."""
+        if not self.enabled or not counts:
+            return
+        series = self._series[name]
+        with self._lock:
+            for labels, amount in counts.items():
+                series[labels] = series.get(labels, 0.0) + amount
+
+    def observe(self, name: str, value: float, labels: Tuple[str, ...] = ()) -> None:
+        if not self.enabled:
+            return
+        buckets = self._meta[name][3]
+        slot = bisect.bisect_left(buckets, value)
+        series = self._series[name]
+        with self._lock:
+            state = series.get(labels)
+            if state is None:
+                state = series[labels] = [[0] * (len(buckets) + 1), 0.0]
+            state[0][slot] += 1
+            state[1] += value
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            snapshot = {
+                name: {labels: [list(v[0]), v[1]] if isinstance(v, list) else v for labels, v in series.items()}
+                for name, series in self._series.items()
+            }
+        for name, (kind, help_text, label_names, buckets) in self._meta.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if name in self._callbacks:
+                try:
+                    lines.append(f"{name} {_prom_value(self._callbacks[name]())}")
+                except Exception:  # pragma: no cover - un gauge roto no tumba el scrape
+                    logger.exception("metrics: fallo al leer %s", name)
+                continue
+            for labels, value in sorted(snapshot[name].items()):
+                pairs = list(zip(label_names, labels))
+                if kind != "histogram":
+                    lines.append(f"{name}{_prom_labels(pairs)} {_prom_value(value)}")
+                    continue
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(buckets, counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_prom_labels(pairs + [('le', _prom_value(bound))])} {cumulative}")
+                cumulative += counts[-1]
+                lines.append(f"{name}_bucket{_prom_labels(pairs + [('le', '+Inf')])} {cumulative}")
+                lines.append(f"{name}_sum{_prom_labels(pairs)} {_prom_value(total)}")
+                lines.append(f"{name}_count{_prom_labels(pairs)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _prom_labels(pairs: Sequence[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_prom_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _prom_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _prom_value(value: float) -> str:
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+PROM = PrometheusRegistry(enabled=PROMETHEUS_ENABLED)
+PROM.counter("tg_http_requests_total", "Peticiones HTTP atendidas", ("method", "route", "status"))
+PROM.histogram(
+    "tg_http_request_duration_seconds", "Latencia de las peticiones HTTP", HTTP_LATENCY_BUCKETS, ("method", "route")
+)
+PROM.gauge("tg_http_requests_in_flight", "Peticiones HTTP en curso")
+PROM.histogram("tg_db_query_duration_seconds", "Tiempo de cada operación de BD", DB_LATENCY_BUCKETS, ("operation",))
+PROM.histogram("tg_serialize_duration_seconds", "Tiempo de serialización de respuestas JSON", DB_LATENCY_BUCKETS)
+PROM.counter("tg_rows_ingested_total", "Lecturas confirmadas en la BD", ("robot_id",))
+PROM.counter("tg_auth_rejected_total", "Ingestas rechazadas por autenticación o límite de tasa", ("reason",))
+
+
+def timed_db(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Ejecuta una operación de BD midiendo su duración (sin la espera en cola)."""
+    start = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        PROM.observe("tg_db_query_duration_seconds", time.perf_counter() - start, (fn.__name__,))
+
+
+class ConnectionPool:
+    """Conexiones reutilizables compartidas por todos los handlers.
+
+    - Postgres: ``ThreadedConnectionPool`` de psycopg2 acotado por un semáforo,
+      de modo que un request espera hasta ``timeout`` en lugar de fallar en
+      cuanto el pool se agota.
+    - SQLite: hasta ``size`` conexiones abiertas una sola vez en modo WAL y con
+      pragmas ajustados, que se reutilizan entre los hilos del threadpool (los
+      hilos de anyio pueden rotar, así que no se atan a un hilo concreto).
+
+    ``connection()`` hace commit al salir sin errores y rollback si hay excepción.
+    """
+
+    def __init__(self, size: int, timeout: float, minconn: int = 1) -> None:
+        self.size = max(1, size)
+        self.minconn = max(0, min(minconn, self.size))
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._pg_pool: Any = None
+        self._sqlite_conns: List[sqlite3.Connection] = []
+        self._sqlite_idle: List[sqlite3.Connection] = []
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.acquired_total = 0
+        self.waits_total = 0
+        self.timeouts_total = 0
+        self.wait_seconds_total = 0.0
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        self._acquire_slot()
+        try:
+            conn = self._checkout()
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self._checkin(conn)
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            self._slots.release()
+
+    def _acquire_slot(self) -> None:
+        start = time.perf_counter()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.waits_total += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self.timeouts_total += 1
+                raise HTTPException(
+                    status_code=503,
+                    detail="Pool de base de datos saturado",
+                    headers={"Retry-After": "1"},
+                )
+        with self._lock:
+            self.wait_seconds_total += time.perf_counter() - start
+            self.acquired_total += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def _checkout(self) -> Any:
+        if USE_POSTGRES:
+            if self._pg_pool is None:
+                with self._lock:
+                    if self._pg_pool is None:
+                        self._pg_pool = psycopg2.pool.ThreadedConnectionPool(self.minconn, self.size, DB_URL)
+            return self._pg_pool.getconn()
+        with self._lock:
+            if self._sqlite_idle:
+                return self._sqlite_idle.pop()
+        return self._open_sqlite()
+
+    def _checkin(self, conn: Any) -> None:
+        if USE_POSTGRES:
+            self._pg_pool.putconn(conn, close=bool(conn.closed))
+            return
+        with self._lock:
+            self._sqlite_idle.append(conn)
+
+    def _open_sqlite(self) -> sqlite3.Connection:
+        directory = os.path.dirname(DB_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        con = sqlite3.connect(
+            DB_PATH,
+            timeout=SQLITE_BUSY_TIMEOUT_MS / 1000.0,
+            check_same_thread=False,
+            cached_statements=SQLITE_STATEMENT_CACHE,
+        )
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        con.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+        con.execute("PRAGMA temp_store=MEMORY")
+        with self._lock:
+            self._sqlite_conns.append(con)
+        return con
+
+    def open_connections(self) -> int:
+        if USE_POSTGRES:
+            if self._pg_pool is None:
+                return 0
+            return len(self._pg_pool._used) + len(self._pg_pool._pool)
+        return len(self._sqlite_conns)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            acquired = self.acquired_total
+            return {
+                "backend": "postgres" if USE_POSTGRES else "sqlite",
+                "size": self.size,
+                "timeout_s": self.timeout,
+                "in_use": self.in_use,
+                "available": self.size - self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "saturation": round(self.in_use / self.size, 3),
+                "open_connections": self.open_connections(),
+                "acquired_total": acquired,
+                "waits_total": self.waits_total,
+                "timeouts_total": self.timeouts_total,
+                "avg_wait_ms": round(self.wait_seconds_total * 1000.0 / acquired, 3) if acquired else 0.0,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._pg_pool is not None:
+                self._pg_pool.closeall()
+                self._pg_pool = None
+            for con in self._sqlite_conns:
+                con.close()
+            self._sqlite_conns.clear()
+            self._sqlite_idle.clear()
+
+
+POOL = ConnectionPool(size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, minconn=DB_POOL_MIN)
+PROM.gauge("tg_db_pool_in_use", "Conexiones del pool en uso", callback=lambda: POOL.in_use)
+
+
+class DatabaseExecutor:
+    """Puente entre los handlers ``async def`` y las llamadas bloqueantes a la BD.
+
+    En modo "threadpool" delega en ``run_in_threadpool``. En modo "async" usa
+    un ejecutor de lectura con ``readers`` hilos y uno de escritura: en SQLite
+    es un único hilo, de modo que las escrituras se serializan sin pelear por
+    el lock de la base (los lectores siguen en paralelo gracias a WAL); en
+    Postgres tiene tantos hilos como el pool.
+    """
+
+    def __init__(self, mode: str, readers: int) -> None:
+        self.mode = mode
+        self.readers = max(1, readers)
+        self.writers = 1 if not USE_POSTGRES else self.readers
+        self._read_executor: Optional[ThreadPoolExecutor] = None
+        self._write_executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.reads_total = 0
+        self.writes_total = 0
+
+    @property
+    def dedicated(self) -> bool:
+        return self.mode == "async"
+
+    async def read(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        self.reads_total += 1
+        if not self.dedicated:
+            return await run_in_threadpool(timed_db, fn, *args, **kwargs)
+        read_executor, _ = self._executors()
+        return await asyncio.get_running_loop().run_in_executor(read_executor, partial(timed_db, fn, *args, **kwargs))
+
+    async def write(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        self.writes_total += 1
+        if not self.dedicated:
+            return await run_in_threadpool(timed_db, fn, *args, **kwargs)
+        _, write_executor = self._executors()
+        return await asyncio.get_running_loop().run_in_executor(write_executor, partial(timed_db, fn, *args, **kwargs))
+
+    def _executors(self) -> Tuple[ThreadPoolExecutor, ThreadPoolExecutor]:
+        with self._lock:
+            if self._read_executor is None or self._write_executor is None:
+                self._read_executor = ThreadPoolExecutor(self.readers, thread_name_prefix="tg-db-read")
+                self._write_executor = ThreadPoolExecutor(self.writers, thread_name_prefix="tg-db-write")
+            return self._read_executor, self._write_executor
+
+    def close(self) -> None:
+        with self._lock:
+            for executor in (self._read_executor, self._write_executor):
+                if executor is not None:
+                    executor.shutdown(wait=True)
+            self._read_executor = self._write_executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "readers": self.readers if self.dedicated else None,
+            "writers": self.writers if self.dedicated else None,
+            "reads_total": self.reads_total,
+            "writes_total": self.writes_total,
+        }
+
+
+DB = DatabaseExecutor(mode=DB_MODE, readers=DB_POOL_SIZE)
+
+
+TELEMETRY_COLUMNS = "id, ts, data, robot_id, position_lat, position_lng, position_alt, environment, status"
+INSERT_COLUMNS = "telemetry(ts, data, robot_id, position_lat, position_lng, position_alt, environment, status, geo_cell)"
+
+# Índices de las consultas de historial: por robot en orden de id (last/query),
+# por rango temporal global y por rango temporal de un robot.
+TELEMETRY_INDEXES = {
+    "idx_telemetry_robot_id": "telemetry(robot_id, id)",
+    "idx_telemetry_ts": "telemetry(ts)",
+    "idx_telemetry_robot_ts": "telemetry(robot_id, ts)",
+    "idx_telemetry_geo_cell": "telemetry(geo_cell, id)",
+}
+
+METRIC_OPERATORS: Dict[str, Callable[[float, float], bool]] = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "=": operator.eq,
+    "!=": operator.ne,
+}
+
+
+def numeric_metrics(data: Any) -> List[Tuple[str, float]]:
+    """Pares (métrica, valor) numéricos de un payload; ignora booleanos y texto."""
+    data = loads(data) if isinstance(data, (str, bytes)) else data
+    return [
+        (key, float(value))
+        for key, value in data.items()
+        if not isinstance(value, bool) and isinstance(value, (int, float)) and math.isfinite(value)
+    ]
+
+
+def rollup_deltas(
+    rows: Sequence[Sequence[Any]], ts_to_param: Callable[[datetime], Any]
+) -> Dict[Tuple[str, str, str, Any], List[float]]:
+    """Agrega en memoria [count, sum, min, max] por (robot, métrica, bucket, inicio).
+
+    ``rows`` son tuplas de prepare_insert; así un lote produce un UPSERT por
+    clave y no uno por lectura.
+    """
+    deltas: Dict[Tuple[str, str, str, Any], List[float]] = {}
+    for row in rows:
+        ts = datetime.fromisoformat(row[0]) if isinstance(row[0], str) else row[0]
+        starts = {bucket: ts_to_param(bucket_start(ts, bucket)) for bucket in ROLLUP_BUCKETS}
+        for metric, value in numeric_metrics(row[1]):
+            for bucket, start in starts.items():
+                acc = deltas.get((row[2], metric, bucket, start))
+                if acc is None:
+                    deltas[(row[2], metric, bucket, start)] = [1, value, value, value]
+                else:
+                    acc[0] += 1
+                    acc[1] += value
+                    acc[2] = min(acc[2], value)
+                    acc[3] = max(acc[3], value)
+    return deltas
+
+
+def geo_cell(lat: Optional[float], lng: Optional[float]) -> Optional[int]:
+    """Celda de la rejilla que contiene (lat, lng); misma cuenta que SqlTelemetryStore.geo_cell_sql."""
+    if lat is None or lng is None or not (math.isfinite(lat) and math.isfinite(lng)):
+        return None
+    return int((lat + 90) / GEO_CELL_DEG) * GEO_COLS + int((lng + 180) / GEO_CELL_DEG)
+
+
+def geo_cell_ranges(bbox: Tuple[float, float, float, float]) -> List[Tuple[int, int]]:
+    """Rangos [desde, hasta] de geo_cell que cubren ``bbox`` (min_lng, min_lat, max_lng, max_lat).
+
+    Cada fila de la rejilla es un rango contiguo; si la caja abarca demasiadas
+    filas se devuelve un solo rango que las incluye todas (el filtro exacto por
+    lat/lng descarta lo que sobra).
+    """
+    min_lng, min_lat, max_lng, max_lat = bbox
+    r0, r1 = int((min_lat + 90) / GEO_CELL_DEG), int((max_lat + 90) / GEO_CELL_DEG)
+    c0, c1 = int((min_lng + 180) / GEO_CELL_DEG), int((max_lng + 180) / GEO_CELL_DEG)
+    if r1 - r0 + 1 > GEO_MAX_CELL_RANGES:
+        return [(r0 * GEO_COLS + c0, r1 * GEO_COLS + c1)]
+    return [(row * GEO_COLS + c0, row * GEO_COLS + c1) for row in range(r0, r1 + 1)]
+
+
+def with_geo_cell(values: Sequence[Any]) -> Tuple[Any, ...]:
+    """Tupla de prepare_insert + geo_cell, en el orden de INSERT_COLUMNS."""
+    return (*values, geo_cell(values[3], values[4]))
+
+
+def in_bbox(row: Sequence[Any], bbox: Tuple[float, float, float, float]) -> bool:
+    return (
+        row[4] is not None
+        and row[5] is not None
+        and bbox[1] <= row[4] <= bbox[3]
+        and bbox[0] <= row[5] <= bbox[2]
+    )
+
+
+class TelemetryStore(ABC):
+    """Interfaz de almacenamiento de la telemetría.
+
+    Las filas que devuelve siguen el orden de TELEMETRY_COLUMNS y los valores
+    de entrada son tuplas de prepare_insert. Los métodos son bloqueantes: los
+    handlers los invocan a través de DB.read / DB.write.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def init(self) -> None:
+        ...
+
+    def ts_param(self, value: datetime) -> Any:
+        """Parámetro comparable con la columna ts del motor."""
+        return to_utc(value).isoformat()
+
+    @abstractmethod
+    def insert_one(self, values: Tuple[Any, ...]) -> Sequence[Any]:
+        ...
+
+    @abstractmethod
+    def insert_many(self, rows: Sequence[Sequence[Any]]) -> List[int]:
+        """Inserta en una transacción y devuelve los ids en el orden de ``rows``."""
+
+    @abstractmethod
+    def fetch_one(self, robot_id: Optional[str]) -> Optional[Sequence[Any]]:
+        ...
+
+    @abstractmethod
+    def fetch_many(
+        self,
+        limit: int,
+        robot_id: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        before_id: Optional[int] = None,
+        metrics: Sequence[Tuple[str, str, float]] = (),
+    ) -> List[Sequence[Any]]:
+        ...
+
+    @abstractmethod
+    def fetch_latest_per_robot(self, limit_per_robot: int) -> List[Sequence[Any]]:
+        """Últimas ``limit_per_robot`` lecturas de cada robot, por robot_id e id DESC."""
+
+    @abstractmethod
+    def fetch_area(
+        self, bbox: Tuple[float, float, float, float], since: Optional[datetime], limit: int
+    ) -> List[Sequence[Any]]:
+        """Lecturas con posición dentro de ``bbox`` (min_lng, min_lat, max_lng, max_lat), por id DESC."""
+
+    @abstractmethod
+    def fetch_rollups(
+        self,
+        robot_id: str,
+        metric: str,
+        bucket: str,
+        since: Optional[datetime],
+        until: Optional[datetime],
+        limit: int,
+    ) -> List[Sequence[Any]]:
+        """Filas (bucket_start, count, min, max, sum) ordenadas por bucket_start."""
+
+    @abstractmethod
+    def purge_raw(
+        self,
+        cutoff: datetime,
+        limit: int,
+        archive: Optional[Callable[[Sequence[Sequence[Any]]], None]] = None,
+    ) -> int:
+        """Borra hasta ``limit`` lecturas con ts < cutoff; ``archive`` las recibe antes."""
+
+    @abstractmethod
+    def purge_rollups(self, bucket: str, cutoff: datetime, limit: int) -> int:
+        ...
+
+    def stats(self) -> Dict[str, Any]:
+        return {"engine": self.name}
+
+
+class SqlTelemetryStore(TelemetryStore):
+    """Parte común de los motores SQL; las subclases aportan el dialecto.
+
+    Las sentencias fijas se arman una sola vez en el constructor: el texto es
+    idéntico en cada llamada, así que la caché de sentencias del driver las
+    reutiliza en lugar de recompilarlas.
+    """
+
+    ph = "?"
+    id_ddl = "INTEGER PRIMARY KEY AUTOINCREMENT"
+    ts_ddl = "TEXT"
+    real_ddl = "REAL"
+    bigint_ddl = "INTEGER"
+    least, greatest = "MIN", "MAX"
+    trunc = "CAST({} AS INTEGER)"
+    # Pistas de índice para /area (cajas pequeñas, cajas grandes). Sin
+    # estadísticas, SQLite elige al revés: recorre la tabla por id DESC con
+    # cajas de pocas celdas y ordena todo el rango del índice con las grandes.
+    area_hints = ("", "")
+
+    def __init__(self, pool: ConnectionPool) -> None:
+        self.pool = pool
+        ph = self.ph
+        self.sql_fetch_last = f"SELECT {TELEMETRY_COLUMNS} FROM telemetry ORDER BY id DESC LIMIT 1"
+        self.sql_fetch_last_robot = (
+            f"SELECT {TELEMETRY_COLUMNS} FROM telemetry WHERE robot_id = {ph} ORDER BY id DESC LIMIT 1"
+        )
+        self._values_sql: Dict[Tuple[str, int], str] = {}
+        self.sql_rollup_head = (
+            "INSERT INTO telemetry_rollup(robot_id, metric, bucket, bucket_start, val_count, val_sum, val_min, val_max)"
+        )
+        self.sql_rollup_tail = (
+            " ON CONFLICT (robot_id, metric, bucket, bucket_start) DO UPDATE SET "
+            "val_count = telemetry_rollup.val_count + excluded.val_count, "
+            "val_sum = telemetry_rollup.val_sum + excluded.val_sum, "
+            f"val_min = {self.least}(telemetry_rollup.val_min, excluded.val_min), "
+            f"val_max = {self.greatest}(telemetry_rollup.val_max, excluded.val_max)"
+        )
+        self.sql_metric_head = "INSERT INTO telemetry_metric(telemetry_id, key, value)"
+        self.sql_select_expired = (
+            f"SELECT {TELEMETRY_COLUMNS} FROM telemetry WHERE ts < {ph} ORDER BY id LIMIT {ph}"
+        )
+        # Subconsulta con LIMIT: DELETE ... LIMIT no existe en Postgres
+        self.sql_purge_rollups = (
+            "DELETE FROM telemetry_rollup WHERE (robot_id, metric, bucket, bucket_start) IN ("
+            " SELECT robot_id, metric, bucket, bucket_start FROM telemetry_rollup"
+            f" WHERE bucket = {ph} AND bucket_start < {ph} LIMIT {ph})"
+        )
+        # Recorre los robot_id distintos saltando por el índice (robot_id, id) con
+        # un CTE recursivo y toma el top-N de cada uno, así que el coste es
+        # robots × N y no depende del tamaño total de la tabla.
+        self.sql_latest_per_robot = (
+            "WITH RECURSIVE robots(robot_id) AS ("
+            " SELECT MIN(robot_id) FROM telemetry"
+            " UNION ALL"
+            " SELECT (SELECT MIN(robot_id) FROM telemetry WHERE robot_id > robots.robot_id)"
+            " FROM robots WHERE robots.robot_id IS NOT NULL"
+            ") "
+            "SELECT t.id, t.ts, t.data, t.robot_id, t.position_lat, t.position_lng, t.position_alt, "
+            f"t.environment, t.status FROM robots r {self.latest_join()} ORDER BY t.robot_id, t.id DESC"
+        )
+
+    @contextmanager
+    def cursor(self) -> Iterator[Any]:
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            try:
+                yield cur
+            finally:
+                cur.close()
+
+    @abstractmethod
+    def latest_join(self) -> str:
+        """JOIN que toma el top-N de cada robot del CTE ``robots r``."""
+
+    @abstractmethod
+    def existing_columns(self, cur: Any) -> Set[str]:
+        ...
+
+    @abstractmethod
+    def json_metric_clause(self, key: str, op: str, value: float) -> Tuple[str, List[Any]]:
+        ...
+
+    @abstractmethod
+    def insert_rows(self, cur: Any, rows: Sequence[Sequence[Any]]) -> List[int]:
+        ...
+
+    def init(self) -> None:
+        real = self.real_ddl
+        columns = {
+            "robot_id": "TEXT",
+            "position_lat": real,
+            "position_lng": real,
+            "position_alt": real,
+            "environment": "TEXT",
+            "status": "TEXT",
+            "geo_cell": self.bigint_ddl,
+        }
+        with self.cursor() as cur:
+            cur.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS telemetry (
+                    id {self.id_ddl},
+                    ts {self.ts_ddl} NOT NULL,
+                    data TEXT NOT NULL,
+                    robot_id TEXT NOT NULL,
+                    position_lat {real},
+                    position_lng {real},
+                    position_alt {real},
+                    environment TEXT,
+                    status TEXT,
+                    geo_cell {self.bigint_ddl}
+                )
+                """
+            )
+            existing = self.existing_columns(cur)
+            for name, ddl in columns.items():
+                if name not in existing:
+                    cur.execute(f"ALTER TABLE telemetry ADD COLUMN {name} {ddl}")
+            if "geo_cell" not in existing:
+                cur.execute(
+                    f"UPDATE telemetry SET geo_cell = {self.geo_cell_sql()} "
+                    "WHERE position_lat IS NOT NULL AND position_lng IS NOT NULL"
+                )
+            for name, target in TELEMETRY_INDEXES.items():
+                cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+            cur.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS telemetry_rollup (
+                    robot_id TEXT NOT NULL,
+                    metric TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    bucket_start {self.ts_ddl} NOT NULL,
+                    val_count {self.bigint_ddl} NOT NULL,
+                    val_sum {real} NOT NULL,
+                    val_min {real} NOT NULL,
+                    val_max {real} NOT NULL,
+                    PRIMARY KEY (robot_id, metric, bucket, bucket_start)
+                )
+                """
+            )
+            if METRICS_STORAGE == "narrow":
+                self.init_metric_storage(cur)
+
+    def geo_cell_sql(self) -> str:
+        """Expresión SQL equivalente a geo_cell() para rellenar filas antiguas."""
+        row = self.trunc.format(f"(position_lat + 90) / {GEO_CELL_DEG}")
+        col = self.trunc.format(f"(position_lng + 180) / {GEO_CELL_DEG}")
+        return f"{row} * {GEO_COLS} + {col}"
+
+    def init_metric_storage(self, cur: Any) -> None:
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS telemetry_metric (
+                telemetry_id {self.bigint_ddl} NOT NULL,
+                key TEXT NOT NULL,
+                value {self.real_ddl} NOT NULL,
+                PRIMARY KEY (telemetry_id, key)
+            )
+            """
+        )
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_telemetry_metric_key_value ON telemetry_metric(key, value, telemetry_id)"
+        )
+
+    def insert_many(self, rows: Sequence[Sequence[Any]]) -> List[int]:
+        if not rows:
+            return []
+        with self.cursor() as cur:
+            ids = self.insert_rows(cur, rows)
+            self.after_insert(cur, rows, ids)
+        return ids
+
+    def values_sql(self, head: str, width: int, count: int, tail: str = "") -> str:
+        """``head VALUES (...), ... tail`` para ``count`` filas, memorizado por tamaño.
+
+        Con el texto idéntico entre llamadas la caché de sentencias de cada
+        conexión reutiliza la sentencia ya compilada.
+        """
+        sql = self._values_sql.get((head, count))
+        if sql is None:
+            group = "(" + ", ".join([self.ph] * width) + ")"
+            sql = f"{head} VALUES {', '.join([group] * count)}{tail}"
+            self._values_sql[(head, count)] = sql
+        return sql
+
+    def execute_values(self, cur: Any, head: str, rows: Sequence[Sequence[Any]], tail: str = "") -> List[Any]:
+        """Ejecuta ``rows`` como INSERT multi-fila de MULTI_ROW_CHUNK filas.
+
+        Devuelve lo que produzca ``tail`` (p.ej. RETURNING id) de cada sentencia.
+        """
+        returned: List[Any] = []
+        for start in range(0, len(rows), MULTI_ROW_CHUNK):
+            chunk = rows[start:start + MULTI_ROW_CHUNK]
+            cur.execute(self.values_sql(head, len(chunk[0]), len(chunk), tail), [v for row in chunk for v in row])
+            if tail:
+                returned.extend(cur.fetchall())
+        return returned
+
+    def after_insert(self, cur: Any, rows: Sequence[Sequence[Any]], ids: Sequence[int]) -> None:
+        """Rollups y métricas normalizadas, en la misma transacción que el INSERT.
+
+        Las claves de rollup_deltas son únicas, así que cada bloque es un único
+        UPSERT multi-fila en lugar de uno por (métrica, bucket).
+        """
+        if ROLLUPS_ENABLED:
+            deltas = rollup_deltas(rows, self.ts_param)
+            if deltas:
+                self.execute_values(
+                    cur, self.sql_rollup_head, [(*key, *acc) for key, acc in deltas.items()], self.sql_rollup_tail
+                )
+        if METRICS_STORAGE == "narrow":
+            values = [
+                (row_id, key, value)
+                for row_id, row in zip(ids, rows)
+                for key, value in numeric_metrics(row[1])
+            ]
+            if values:
+                self.execute_values(cur, self.sql_metric_head, values)
+
+    def fetch_one(self, robot_id: Optional[str]) -> Optional[Sequence[Any]]:
+        with self.cursor() as cur:
+            if robot_id:
+                cur.execute(self.sql_fetch_last_robot, (robot_id,))
+            else:
+                cur.execute(self.sql_fetch_last)
+            return cur.fetchone()
+
+    def metric_clause(self, key: str, op: str, value: float) -> Tuple[str, List[Any]]:
+        """Condición SQL para ``key op value`` sobre una lectura de telemetry.
+
+        En modo "narrow" usa el índice (key, value) de telemetry_metric; en modo
+        "json" evalúa el blob con las funciones JSON del motor. ``op`` viene
+        siempre de METRIC_FILTER_RE.
+        """
+        op = "<>" if op == "!=" else op
+        if METRICS_STORAGE == "narrow":
+            return (
+                f"EXISTS (SELECT 1 FROM telemetry_metric m WHERE m.telemetry_id = telemetry.id "
+                f"AND m.key = {self.ph} AND m.value {op} {self.ph})",
+                [key, value],
+            )
+        return self.json_metric_clause(key, op, value)
+
+    def fetch_many(
+        self,
+        limit: int,
+        robot_id: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        before_id: Optional[int] = None,
+        metrics: Sequence[Tuple[str, str, float]] = (),
+    ) -> List[Sequence[Any]]:
+        ph = self.ph
+        clauses: List[str] = []
+        params: List[Any] = []
+        for key, op, value in metrics:
+            clause, clause_params = self.metric_clause(key, op, value)
+            clauses.append(clause)
+            params.extend(clause_params)
+        if robot_id:
+            clauses.append(f"robot_id = {ph}")
+            params.append(robot_id)
+        if since is not None:
+            clauses.append(f"ts >= {ph}")
+            params.append(self.ts_param(since))
+        if until is not None:
+            clauses.append(f"ts < {ph}")
+            params.append(self.ts_param(until))
+        if before_id is not None:
+            clauses.append(f"id < {ph}")
+            params.append(before_id)
+        where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+        params.append(limit)
+        with self.cursor() as cur:
+            cur.execute(f"SELECT {TELEMETRY_COLUMNS} FROM telemetry {where}ORDER BY id DESC LIMIT {ph}", params)
+            return cur.fetchall()
+
+    def fetch_latest_per_robot(self, limit_per_robot: int) -> List[Sequence[Any]]:
+        with self.cursor() as cur:
+            cur.execute(self.sql_latest_per_robot, (limit_per_robot,))
+            return cur.fetchall()
+
+    def fetch_area(
+        self, bbox: Tuple[float, float, float, float], since: Optional[datetime], limit: int
+    ) -> List[Sequence[Any]]:
+        ph = self.ph
+        ranges = geo_cell_ranges(bbox)
+        clauses = [
+            "(" + " OR ".join([f"geo_cell BETWEEN {ph} AND {ph}"] * len(ranges)) + ")",
+            f"position_lat BETWEEN {ph} AND {ph}",
+            f"position_lng BETWEEN {ph} AND {ph}",
+        ]
+        params: List[Any] = [v for cell_range in ranges for v in cell_range]
+        params.extend((bbox[1], bbox[3], bbox[0], bbox[2]))
+        if since is not None:
+            clauses.append(f"ts >= {ph}")
+            params.append(self.ts_param(since))
+        params.append(limit)
+        # En cajas grandes (un solo rango colapsado) recorrer por id con LIMIT es más barato
+        hint = self.area_hints[(bbox[3] - bbox[1]) / GEO_CELL_DEG >= GEO_MAX_CELL_RANGES]
+        with self.cursor() as cur:
+            cur.execute(
+                f"SELECT {TELEMETRY_COLUMNS} FROM telemetry{hint} "
+                f"WHERE {' AND '.join(clauses)} ORDER BY id DESC LIMIT {ph}",
+                params,
+            )
+            return cur.fetchall()
+
+    def fetch_rollups(
+        self,
+        robot_id: str,
+        metric: str,
+        bucket: str,
+        since: Optional[datetime],
+        until: Optional[datetime],
+        limit: int,
+    ) -> List[Sequence[Any]]:
+        ph = self.ph
+        clauses = [f"robot_id = {ph}", f"metric = {ph}", f"bucket = {ph}"]
+        params: List[Any] = [robot_id, metric, bucket]
+        if since is not None:
+            clauses.append(f"bucket_start >= {ph}")
+            params.append(self.ts_param(bucket_start(since, bucket)))
+        if until is not None:
+            clauses.append(f"bucket_start < {ph}")
+            params.append(self.ts_param(until if until.tzinfo else until.replace(tzinfo=timezone.utc)))
+        params.append(limit)
+        with self.cursor() as cur:
+            cur.execute(
+                "SELECT bucket_start, val_count, val_min, val_max, val_sum FROM telemetry_rollup "
+                f"WHERE {' AND '.join(clauses)} ORDER BY bucket_start LIMIT {ph}",
+                params,
+            )
+            return cur.fetchall()
+
+    def purge_raw(
+        self,
+        cutoff: datetime,
+        limit: int,
+        archive: Optional[Callable[[Sequence[Sequence[Any]]], None]] = None,
+    ) -> int:
+        with self.cursor() as cur:
+            cur.execute(self.sql_select_expired, (self.ts_param(cutoff), limit))
+            rows = cur.fetchall()
+            if not rows:
+                return 0
+            if archive is not None:
+                archive(rows)
+            ids = [r[0] for r in rows]
+            id_list = ", ".join([self.ph] * len(ids))
+            if METRICS_STORAGE == "narrow":
+                cur.execute(f"DELETE FROM telemetry_metric WHERE telemetry_id IN ({id_list})", ids)
+            cur.execute(f"DELETE FROM telemetry WHERE id IN ({id_list})", ids)
+        return len(rows)
+
+    def purge_rollups(self, bucket: str, cutoff: datetime, limit: int) -> int:
+        with self.cursor() as cur:
+            cur.execute(self.sql_purge_rollups, (bucket, self.ts_param(cutoff), limit))
+            return cur.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        return {"engine": self.name, "pool": self.pool.stats()}
+
+
+class SQLiteStore(SqlTelemetryStore):
+    name = "sqlite"
+    area_hints = (" INDEXED BY idx_telemetry_geo_cell", " NOT INDEXED")
+
+    def __init__(self, pool: ConnectionPool) -> None:
+        super().__init__(pool)
+        self.sql_insert_one = f"INSERT INTO {INSERT_COLUMNS} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+    def latest_join(self) -> str:
+        return (
+            "JOIN telemetry t ON t.id IN ("
+            " SELECT id FROM telemetry WHERE robot_id = r.robot_id ORDER BY id DESC LIMIT ?)"
+        )
+
+    def existing_columns(self, cur: Any) -> Set[str]:
+        cur.execute("PRAGMA table_info(telemetry)")
+        return {row[1] for row in cur.fetchall()}
+
+    def json_metric_clause(self, key: str, op: str, value: float) -> Tuple[str, List[Any]]:
+        path = f"$.{key}"
+        return (
+            f"(json_type(data, ?) IN ('integer', 'real') AND json_extract(data, ?) {op} ?)",
+            [path, path, value],
+        )
+
+    def insert_one(self, values: Tuple[Any, ...]) -> Sequence[Any]:
+        with self.cursor() as cur:
+            cur.execute(self.sql_insert_one, with_geo_cell(values))
+            # Lo guardado es exactamente ``values``: no hace falta releer la fila
+            row = (cur.lastrowid, *values)
+            self.after_insert(cur, [values], [row[0]])
+        return row
+
+    def insert_rows(self, cur: Any, rows: Sequence[Sequence[Any]]) -> List[int]:
+        # Los ids salen de una secuencia creciente asignada en el orden de
+        # VALUES, así que ordenar lo devuelto por RETURNING reproduce la entrada.
+        ids: List[int] = []
+        if sqlite3.sqlite_version_info < (3, 35, 0):
+            for row in rows:
+                cur.execute(self.sql_insert_one, with_geo_cell(row))
+                ids.append(cur.lastrowid)
+            return ids
+        for start in range(0, len(rows), MULTI_ROW_CHUNK):
+            chunk = rows[start:start + MULTI_ROW_CHUNK]
+            returned = self.execute_values(
+                cur, f"INSERT INTO {INSERT_COLUMNS}", [with_geo_cell(row) for row in chunk], " RETURNING id"
+            )
+            ids.extend(sorted(r[0] for r in returned))
+        return ids
+
+
+class PostgresStore(SqlTelemetryStore):
+    name = "postgres"
+    ph = "%s"
+    id_ddl = "SERIAL PRIMARY KEY"
+    ts_ddl = "TIMESTAMP"
+    real_ddl = "DOUBLE PRECISION"
+    bigint_ddl = "BIGINT"
+    least, greatest = "LEAST", "GREATEST"
+    trunc = "TRUNC({})::BIGINT"
+
+    def __init__(self, pool: ConnectionPool) -> None:
+        super().__init__(pool)
+        self.sql_insert_one = (
+            f"INSERT INTO {INSERT_COLUMNS} VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING {TELEMETRY_COLUMNS}"
+        )
+
+    def ts_param(self, value: datetime) -> Any:
+        return to_utc(value).replace(tzinfo=None)
+
+    def latest_join(self) -> str:
+        return (
+            "CROSS JOIN LATERAL ("
+            " SELECT * FROM telemetry WHERE robot_id = r.robot_id ORDER BY id DESC LIMIT %s) t"
+        )
+
+    def existing_columns(self, cur: Any) -> Set[str]:
+        cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name='telemetry'")
+        return {row[0] for row in cur.fetchall()}
+
+    def init_metric_storage(self, cur: Any) -> None:
+        cur.execute(
+            "SELECT data_type FROM information_schema.columns WHERE table_name='telemetry' AND column_name='data'"
+        )
+        found = cur.fetchone()
+        if found and found[0] != "jsonb":
+            cur.execute("ALTER TABLE telemetry ALTER COLUMN data TYPE JSONB USING data::jsonb")
+        super().init_metric_storage(cur)
+
+    def json_metric_clause(self, key: str, op: str, value: float) -> Tuple[str, List[Any]]:
+        return (
+            "(CASE WHEN jsonb_typeof(data::jsonb -> %s) = 'number' "
+            f"THEN (data::jsonb ->> %s)::double precision END) {op} %s",
+            [key, key, value],
+        )
+
+    def insert_one(self, values: Tuple[Any, ...]) -> Sequence[Any]:
+        with self.cursor() as cur:
+            cur.execute(self.sql_insert_one, with_geo_cell(values))
+            row = cur.fetchone()
+            self.after_insert(cur, [values], [row[0]])
+        return row
+
+    def insert_rows(self, cur: Any, rows: Sequence[Sequence[Any]]) -> List[int]:
+        from psycopg2.extras import execute_values  # type: ignore
+
+        result = execute_values(
+            cur,
+            f"INSERT INTO {INSERT_COLUMNS} VALUES %s RETURNING id",
+            [with_geo_cell(row) for row in rows],
+            page_size=len(rows),
+            fetch=True,
+        )
+        return sorted(r[0] for r in result)
+
+
+class MemoryStore(TelemetryStore):
+    """Motor en memoria del proceso, sin persistencia.
+
+    Pensado para tests, demos y para medir el coste del gateway sin la base de
+    datos. Un lock serializa escrituras y lecturas; cada robot y cada celda de
+    la rejilla guardan sus filas en un dict ordenado por id para que
+    last/query/live/area no recorran toda la tabla.
+    """
+
+    name = "memory"
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._rows: Dict[int, Tuple[Any, ...]] = {}
+        self._by_robot: Dict[str, Dict[int, Tuple[Any, ...]]] = {}
+        self._by_cell: Dict[int, Dict[int, Tuple[Any, ...]]] = {}
+        self._rollups: Dict[Tuple[str, str, str, Any], List[float]] = {}
+        self._next_id = 1
+
+    def init(self) -> None:
+        pass
+
+    def insert_one(self, values: Tuple[Any, ...]) -> Sequence[Any]:
+        return self._append([values])[0]
+
+    def insert_many(self, rows: Sequence[Sequence[Any]]) -> List[int]:
+        return [row[0] for row in self._append(rows)]
+
+    def _append(self, rows: Sequence[Sequence[Any]]) -> List[Tuple[Any, ...]]:
+        deltas = rollup_deltas(rows, self.ts_param) if ROLLUPS_ENABLED else {}
+        stored: List[Tuple[Any, ...]] = []
+        with self._lock:
+            for values in rows:
+                row = (self._next_id, *values)
+                self._next_id += 1
+                self._rows[row[0]] = row
+                self._by_robot.setdefault(row[3], {})[row[0]] = row
+                cell = geo_cell(row[4], row[5])
+                if cell is not None:
+                    self._by_cell.setdefault(cell, {})[row[0]] = row
+                stored.append(row)
+            for key, delta in deltas.items():
+                acc = self._rollups.get(key)
+                if acc is None:
+                    self._rollups[key] = list(delta)
+                else:
+                    acc[0] += delta[0]
+                    acc[1] += delta[1]
+                    acc[2] = min(acc[2], delta[2])
+                    acc[3] = max(acc[3], delta[3])
+        return stored
+
+    def fetch_one(self, robot_id: Optional[str]) -> Optional[Sequence[Any]]:
+        with self._lock:
+            source = self._by_robot.get(robot_id, {}) if robot_id else self._rows
+            return next(reversed(source.values()), None)
+
+    def fetch_many(
+        self,
+        limit: int,
+        robot_id: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        before_id: Optional[int] = None,
+        metrics: Sequence[Tuple[str, str, float]] = (),
+    ) -> List[Sequence[Any]]:
+        since_param = self.ts_param(since) if since is not None else None
+        until_param = self.ts_param(until) if until is not None else None
+        out: List[Sequence[Any]] = []
+        with self._lock:
+            source = self._by_robot.get(robot_id, {}) if robot_id else self._rows
+            for row in reversed(source.values()):
+                if before_id is not None and row[0] >= before_id:
+                    continue
+                if since_param is not None and row[1] < since_param:
+                    continue
+                if until_param is not None and row[1] >= until_param:
+                    continue
+                if metrics and not self._matches(row[2], metrics):
+                    continue
+                out.append(row)
+                if len(out) >= limit:
+                    break
+        return out
+
+    @staticmethod
+    def _matches(data: Any, metrics: Sequence[Tuple[str, str, float]]) -> bool:
+        values = dict(numeric_metrics(data))
+        return all(key in values and METRIC_OPERATORS[op](values[key], value) for key, op, value in metrics)
+
+    def fetch_latest_per_robot(self, limit_per_robot: int) -> List[Sequence[Any]]:
+        out: List[Sequence[Any]] = []
+        with self._lock:
+            for robot in sorted(self._by_robot):
+                out.extend(islice(reversed(self._by_robot[robot].values()), limit_per_robot))
+        return out
+
+    def fetch_area(
+        self, bbox: Tuple[float, float, float, float], since: Optional[datetime], limit: int
+    ) -> List[Sequence[Any]]:
+        since_param = self.ts_param(since) if since is not None else None
+        found: List[Sequence[Any]] = []
+        with self._lock:
+            for low, high in geo_cell_ranges(bbox):
+                # Recorre el rango o las celdas ocupadas, lo que sea menor
+                if high - low < len(self._by_cell):
+                    cells = [self._by_cell[c] for c in range(low, high + 1) if c in self._by_cell]
+                else:
+                    cells = [rows for cell, rows in self._by_cell.items() if low <= cell <= high]
+                for rows in cells:
+                    found.extend(
+                        row
+                        for row in rows.values()
+                        if in_bbox(row, bbox) and (since_param is None or row[1] >= since_param)
+                    )
+        found.sort(key=lambda row: row[0], reverse=True)
+        return found[:limit]
+
+    def fetch_rollups(
+        self,
+        robot_id: str,
+        metric: str,
+        bucket: str,
+        since: Optional[datetime],
+        until: Optional[datetime],
+        limit: int,
+    ) -> List[Sequence[Any]]:
+        low = self.ts_param(bucket_start(since, bucket)) if since is not None else None
+        high = self.ts_param(until if until.tzinfo else until.replace(tzinfo=timezone.utc)) if until is not None else None
+        with self._lock:
+            found = [
+                (key[3], acc[0], acc[2], acc[3], acc[1])
+                for key, acc in self._rollups.items()
+                if key[:3] == (robot_id, metric, bucket)
+                and (low is None or key[3] >= low)
+                and (high is None or key[3] < high)
+            ]
+        found.sort(key=lambda r: r[0])
+        return found[:limit]
+
+    def purge_raw(
+        self,
+        cutoff: datetime,
+        limit: int,
+        archive: Optional[Callable[[Sequence[Sequence[Any]]], None]] = None,
+    ) -> int:
+        cutoff_param = self.ts_param(cutoff)
+        with self._lock:
+            expired = [row for row in self._rows.values() if row[1] < cutoff_param][:limit]
+            if expired and archive is not None:
+                archive(expired)
+            for row in expired:
+                del self._rows[row[0]]
+                robot_rows = self._by_robot[row[3]]
+                del robot_rows[row[0]]
+                if not robot_rows:
+                    del self._by_robot[row[3]]
+                cell = geo_cell(row[4], row[5])
+                if cell is not None:
+                    cell_rows = self._by_cell[cell]
+                    del cell_rows[row[0]]
+                    if not cell_rows:
+                        del self._by_cell[cell]
+        return len(expired)
+
+    def purge_rollups(self, bucket: str, cutoff: datetime, limit: int) -> int:
+        cutoff_param = self.ts_param(cutoff)
+        with self._lock:
+            expired = [key for key in self._rollups if key[2] == bucket and key[3] < cutoff_param][:limit]
+            for key in expired:
+                del self._rollups[key]
+        return len(expired)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "engine": self.name,
+                "rows": len(self._rows),
+                "robots": len(self._by_robot),
+                "rollups": len(self._rollups),
+            }
+
+
+def make_store(engine: str) -> TelemetryStore:
+    if engine == "memory":
+        return MemoryStore()
+    if engine == "postgres":
+        if not USE_POSTGRES:
+            raise RuntimeError("TG_STORE=postgres requiere TG_DB_URL y psycopg2")
+        return PostgresStore(POOL)
+    if engine == "sqlite":
+        if USE_POSTGRES:
+            raise RuntimeError("TG_STORE=sqlite no es compatible con TG_DB_URL")
+        return SQLiteStore(POOL)
+    raise RuntimeError(f"TG_STORE desconocido: {engine!r} (sqlite, postgres o memory)")
+
+
+STORE = make_store(STORE_ENGINE)
+
+
+class WriteBehindQueue:
+    """Cola asyncio acotada entre ``ingest`` y la base de datos.
+
+    Un único writer toma lecturas de la cola y las escribe con ``insert_many``
+    en cuanto junta ``batch_size`` filas o pasan ``flush_interval`` segundos
+    desde la primera del lote. Con la cola llena ``offer`` devuelve False y el
+    handler responde 503 con Retry-After. ``stop`` deja de aceptar lecturas y
+    vacía la cola antes de terminar.
+    """
+
+    _STOP = object()
+
+    def __init__(self, enabled: bool, maxsize: int, batch_size: int, flush_interval: float) -> None:
+        self.enabled = enabled
+        self.maxsize = max(1, maxsize)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.0, flush_interval)
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._accepting = False
+        self.enqueued_total = 0
+        self.rejected_total = 0
+        self.flushes_total = 0
+        self.flushed_rows_total = 0
+        self.dropped_rows_total = 0
+        self.last_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.flush_seconds_total = 0.0
+
+    @property
+    def retry_after(self) -> str:
+        return str(max(1, math.ceil(self.flush_interval)))
+
+    def start(self) -> None:
+        if not self.enabled or self._task is not None:
+            return
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+        self._accepting = True
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None or self.queue is None:
+            return
+        self._accepting = False
+        await self.queue.put(self._STOP)
+        await self._task
+        self._task = None
+        self.queue = None
+
+    def offer(self, row: Tuple[Any, ...]) -> bool:
+        if not self._accepting or self.queue is None:
+            self.rejected_total += 1
+            return False
+        try:
+            self.queue.put_nowait(row)
+        except asyncio.QueueFull:
+            self.rejected_total += 1
+            return False
+        self.enqueued_total += 1
+        return True
+
+    async def _run(self) -> None:
+        assert self.queue is not None
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            first = await self.queue.get()
+            if first is self._STOP:
+                break
+            batch = [first]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Tuple[Any, ...]]) -> None:
+        start = time.perf_counter()
+        try:
+            await DB.write(insert_many, batch)
+        except Exception:
+            self.dropped_rows_total += len(batch)
+            logger.exception("write-behind: no se pudo escribir un lote de %d lecturas", len(batch))
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        self.flushes_total += 1
+        self.flushed_rows_total += len(batch)
+        self.last_batch_size = len(batch)
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.flush_seconds_total += elapsed_ms / 1000.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "running": self._task is not None,
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "queue_size": self.maxsize,
+            "batch_size": self.batch_size,
+            "flush_interval_ms": self.flush_interval * 1000.0,
+            "enqueued_total": self.enqueued_total,
+            "rejected_total": self.rejected_total,
+            "flushes_total": self.flushes_total,
+            "flushed_rows_total": self.flushed_rows_total,
+            "dropped_rows_total": self.dropped_rows_total,
+            "last_batch_size": self.last_batch_size,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self.flush_seconds_total * 1000.0 / self.flushes_total, 3) if self.flushes_total else 0.0,
+        }
+
+
+WRITE_BEHIND = WriteBehindQueue(
+    enabled=INGEST_MODE == "write-behind",
+    maxsize=WRITE_BEHIND_QUEUE_SIZE,
+    batch_size=WRITE_BEHIND_BATCH_SIZE,
+    flush_interval=WRITE_BEHIND_FLUSH_MS / 1000.0,
+)
+
+
+class LiveStore:
+    """Última lectura y ring buffer de las últimas N lecturas por robot.
+
+    Guarda filas con el mismo formato que los SELECT (id, ts, data, robot_id,
+    ...). Se rellena desde la BD en el arranque (``warm``) y se actualiza tras
+    cada commit de ingesta; hasta que ``ready`` es True los endpoints siguen
+    leyendo de la BD. Los robots se guardan en orden de última actualización:
+    se descartan los que superan ``idle_seconds`` sin datos y, si hay más de
+    ``max_robots``, el que lleva más tiempo sin reportar.
+    """
+
+    def __init__(self, max_robots: int, trail_size: int, idle_seconds: float) -> None:
+        self.max_robots = max(1, max_robots)
+        self.trail_size = max(1, trail_size)
+        self.idle_seconds = idle_seconds
+        self._robots: "OrderedDict[str, Deque[Sequence[Any]]]" = OrderedDict()
+        self._seen: Dict[str, float] = {}
+        self._latest: Optional[Sequence[Any]] = None
+        self._lock = threading.Lock()
+        self.ready = False
+        self.hits_total = 0
+        self.misses_total = 0
+        self.evicted_total = 0
+
+    def warm(self, rows: Sequence[Sequence[Any]]) -> None:
+        """Carga filas agrupadas por robot y ordenadas por id DESC.
+
+        La última actividad de cada robot sale del ts de su lectura más
+        nueva, no de la hora del arranque: un robot callado hace días no
+        reaparece en /live tras reiniciar.
+        """
+        grouped: Dict[str, List[Sequence[Any]]] = {}
+        for row in rows:
+            grouped.setdefault(row[3] or "robot-unknown", []).append(row)
+        now = time.monotonic()
+        wall = datetime.now(timezone.utc)
+        seen = {
+            robot_id: now - max(0.0, (wall - row_ts(robot_rows[0])).total_seconds())
+            for robot_id, robot_rows in grouped.items()
+        }
+        ordered = sorted(grouped.items(), key=lambda item: (seen[item[0]], item[1][0][0]))[-self.max_robots:]
+        with self._lock:
+            self._robots.clear()
+            self._seen.clear()
+            self._latest = None
+            for robot_id, robot_rows in ordered:
+                trail: Deque[Sequence[Any]] = deque(maxlen=self.trail_size)
+                trail.extend(reversed(robot_rows[: self.trail_size]))
+                self._robots[robot_id] = trail
+                self._seen[robot_id] = seen[robot_id]
+                if self._latest is None or robot_rows[0][0] > self._latest[0]:
+                    self._latest = robot_rows[0]
+            self._evict(now)
+            self.ready = True
+
+    def purge_before(self, cutoff: datetime) -> int:
+        """Quita las lecturas con ts < cutoff que la retención ya borró de la BD."""
+        removed = 0
+        with self._lock:
+            for robot_id in list(self._robots):
+                trail = self._robots[robot_id]
+                kept = [row for row in trail if row_ts(row) >= cutoff]
+                if len(kept) != len(trail):
+                    removed += len(trail) - len(kept)
+                    trail.clear()
+                    trail.extend(kept)
+                if not trail:
+                    del self._robots[robot_id]
+                    self._seen.pop(robot_id, None)
+            if self._latest is not None and row_ts(self._latest) < cutoff:
+                tails = [trail[-1] for trail in self._robots.values()]
+                self._latest = max(tails, key=lambda row: row[0]) if tails else None
+        return removed
+
+    def add(self, rows: Sequence[Sequence[Any]]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for row in rows:
+                robot_id = row[3] or "robot-unknown"
+                trail = self._robots.get(robot_id)
+                if trail is None:
+                    trail = deque(maxlen=self.trail_size)
+                    self._robots[robot_id] = trail
+                else:
+                    self._robots.move_to_end(robot_id)
+                self._insert(trail, row)
+                self._seen[robot_id] = now
+                if self._latest is None or row[0] > self._latest[0]:
+                    self._latest = row
+            self._evict(now)
+
+    @staticmethod
+    def _insert(trail: Deque[Sequence[Any]], row: Sequence[Any]) -> None:
+        """Mete ``row`` en el trail manteniendo el orden por id.
+
+        En modo threadpool dos commits concurrentes pueden llegar a ``add``
+        en orden inverso al de sus ids; la lectura más vieja se intercala en
+        su sitio (o se descarta si el buffer lleno ya es más nuevo) para que
+        ``trail[-1]`` siga siendo la última.
+        """
+        if not trail or row[0] > trail[-1][0]:
+            trail.append(row)
+            return
+        if len(trail) == trail.maxlen and row[0] < trail[0][0]:
+            return
+        idx = len(trail)
+        while idx > 0 and trail[idx - 1][0] > row[0]:
+            idx -= 1
+        if idx > 0 and trail[idx - 1][0] == row[0]:
+            return
+        if len(trail) == trail.maxlen:
+            trail.popleft()
+            idx -= 1
+        trail.insert(idx, row)
+
+    def last(self, robot_id: Optional[str]) -> Optional[Sequence[Any]]:
+        """Última fila del robot (o global); None si la caché no la tiene."""
+        with self._lock:
+            self._evict(time.monotonic())
+            if robot_id:
+                trail = self._robots.get(robot_id)
+                row = trail[-1] if trail else None
+            else:
+                row = self._latest
+            if row is None:
+                self.misses_total += 1
+            else:
+                self.hits_total += 1
+            return row
+
+    def trails(self, limit_per_robot: int) -> Dict[str, List[Sequence[Any]]]:
+        """Últimas ``limit_per_robot`` filas de cada robot, de más nueva a más antigua."""
+        with self._lock:
+            self._evict(time.monotonic())
+            self.hits_total += 1
+            return {
+                robot_id: list(trail)[-limit_per_robot:][::-1]
+                for robot_id, trail in self._robots.items()
+                if trail
+            }
+
+    def _evict(self, now: float) -> None:
+        while len(self._robots) > self.max_robots:
+            robot_id, _ = self._robots.popitem(last=False)
+            self._seen.pop(robot_id, None)
+            self.evicted_total += 1
+        if self.idle_seconds <= 0:
+            return
+        cutoff = now - self.idle_seconds
+        while self._robots:
+            robot_id = next(iter(self._robots))
+            if self._seen.get(robot_id, now) >= cutoff:
+                break
+            del self._robots[robot_id]
+            self._seen.pop(robot_id, None)
+            self.evicted_total += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "robots": len(self._robots),
+                "points": sum(len(t) for t in self._robots.values()),
+                "max_robots": self.max_robots,
+                "trail_size": self.trail_size,
+                "idle_seconds": self.idle_seconds,
+                "hits_total": self.hits_total,
+                "misses_total": self.misses_total,
+                "evicted_total": self.evicted_total,
+            }
+
+
+def row_ts(row: Sequence[Any]) -> datetime:
+    """ts de una fila como datetime UTC con zona (SQLite lo guarda como texto ISO)."""
+    value = row[1]
+    return aware_utc(datetime.fromisoformat(value) if isinstance(value, str) else value)
+
+
+LIVE = LiveStore(max_robots=LIVE_MAX_ROBOTS, trail_size=LIVE_TRAIL_SIZE, idle_seconds=LIVE_IDLE_SECONDS)
+
+
+class StreamSubscriber:
+    def __init__(self, robot_id: Optional[str], maxsize: int) -> None:
+        self.robot_id = robot_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+
+class StreamHub:
+    """Reparte cada lectura confirmada a los clientes SSE/WebSocket conectados.
+
+    ``publish`` puede llamarse desde los hilos del threadpool: serializa las
+    filas una sola vez y programa el reparto en el event loop. Cada cliente
+    tiene una cola acotada; si un cliente lento la llena se descarta su mensaje
+    más antiguo para no frenar a los demás ni a la ingesta.
+    """
+
+    def __init__(self, max_clients: int, client_queue: int) -> None:
+        self.max_clients = max(1, max_clients)
+        self.client_queue = max(1, client_queue)
+        self._subscribers: Set[StreamSubscriber] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.published_total = 0
+        self.dropped_total = 0
+        self.rejected_total = 0
+
+    def subscribe(self, robot_id: Optional[str]) -> StreamSubscriber:
+        """Registra un cliente; debe llamarse desde el event loop."""
+        if len(self._subscribers) >= self.max_clients:
+            self.rejected_total += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Demasiados clientes de streaming",
+                headers={"Retry-After": "5"},
+            )
+        self._loop = asyncio.get_running_loop()
+        sub = StreamSubscriber(robot_id, self.client_queue)
+        self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: StreamSubscriber) -> None:
+        self._subscribers.discard(sub)
+
+    def publish(self, rows: Sequence[Sequence[Any]]) -> None:
+        loop = self._loop
+        if not self._subscribers or loop is None or loop.is_closed():
+            return
+        messages = [(row[3], row[0], dumps(row_to_dict(row)).decode("utf-8")) for row in rows]
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._fanout(messages)
+        else:
+            loop.call_soon_threadsafe(self._fanout, messages)
+
+    def _fanout(self, messages: List[Tuple[str, int, str]]) -> None:
+        for robot_id, row_id, body in messages:
+            self.published_total += 1
+            for sub in self._subscribers:
+                if sub.robot_id and sub.robot_id != robot_id:
+                    continue
+                if sub.queue.full():
+                    sub.queue.get_nowait()
+                    sub.dropped += 1
+                    self.dropped_total += 1
+                sub.queue.put_nowait((row_id, body))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "connected_clients": len(self._subscribers),
+            "max_clients": self.max_clients,
+            "client_queue": self.client_queue,
+            "published_total": self.published_total,
+            "dropped_total": self.dropped_total,
+            "rejected_total": self.rejected_total,
+        }
+
+
+STREAM = StreamHub(max_clients=STREAM_MAX_CLIENTS, client_queue=STREAM_CLIENT_QUEUE)
+PROM.gauge("tg_stream_clients", "Clientes SSE/WebSocket conectados", callback=lambda: STREAM.stats()["connected_clients"])
+
+
+class RetentionWorker:
+    """Purga periódica de lecturas crudas y rollups vencidos.
+
+    Borra en lotes de ``chunk`` filas, cada uno en su propia transacción y con
+    una pausa entre lotes, para que la ingesta nunca espere mucho por el lock.
+    Si hay ``archive_dir``, cada lote de filas crudas se anexa antes de
+    borrarse a ``telemetry-YYYY-MM-DD.ndjson.gz`` según el día de la lectura.
+    """
+
+    def __init__(
+        self,
+        raw_days: float,
+        rollup_days: Dict[str, float],
+        interval: float,
+        chunk: int,
+        pause: float,
+        archive_dir: Optional[str],
+    ) -> None:
+        self.raw_days = raw_days
+        self.rollup_days = rollup_days
+        self.interval = max(1.0, interval)
+        self.chunk = max(1, chunk)
+        self.pause = max(0.0, pause)
+        self.archive_dir = archive_dir
+        self._task: Optional[asyncio.Task] = None
+        self.runs_total = 0
+        self.errors_total = 0
+        self.raw_purged_total = 0
+        self.rollups_purged_total = 0
+        self.archived_total = 0
+        self.last_run_at: Optional[str] = None
+        self.last_run_seconds = 0.0
+        self.seconds_total = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.raw_days > 0 or any(days > 0 for days in self.rollup_days.values())
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                self.errors_total += 1
+                logger.exception("retención: fallo purgando telemetría")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Una pasada de purga. Cada lote va por DB.write, así que en modo
+        async comparte el escritor serializado con la ingesta en vez de
+        competir con ella por el lock de SQLite; las pausas no lo retienen."""
+        now = now or datetime.now(timezone.utc)
+        start = time.perf_counter()
+        purged = {"raw": 0, "rollups": 0}
+        if self.raw_days > 0:
+            purged["raw"] = await self._purge_raw(now - timedelta(days=self.raw_days))
+        for bucket, days in self.rollup_days.items():
+            if days > 0:
+                purged["rollups"] += await self._purge_rollups(bucket, now - timedelta(days=days))
+        elapsed = time.perf_counter() - start
+        self.runs_total += 1
+        self.last_run_at = now.isoformat()
+        self.last_run_seconds = elapsed
+        self.seconds_total += elapsed
+        return purged
+
+    async def _purge_raw(self, cutoff: datetime) -> int:
+        total = 0
+        archive = self._archive if self.archive_dir else None
+        while True:
+            purged = await DB.write(STORE.purge_raw, cutoff, self.chunk, archive)
+            total += purged
+            self.raw_purged_total += purged
+            if purged < self.chunk:
+                break
+            await asyncio.sleep(self.pause)
+        # La caché de /live no debe seguir sirviendo lo que ya no está en la BD
+        LIVE.purge_before(aware_utc(cutoff))
+        return total
+
+    async def _purge_rollups(self, bucket: str, cutoff: datetime) -> int:
+        total = 0
+        while True:
+            deleted = await DB.write(STORE.purge_rollups, bucket, cutoff, self.chunk)
+            total += deleted
+            self.rollups_purged_total += deleted
+            if deleted < self.chunk:
+                break
+            await asyncio.sleep(self.pause)
+        return total
+
+    def _archive(self, rows: Sequence[Sequence[Any]]) -> None:
+        assert self.archive_dir
+        os.makedirs(self.archive_dir, exist_ok=True)
+        by_day: Dict[str, List[str]] = {}
+        for row in rows:
+            out = row_to_dict(row)
+            by_day.setdefault(out["ts"][:10], []).append(dumps(out).decode("utf-8"))
+        for day, lines in by_day.items():
+            path = os.path.join(self.archive_dir, f"telemetry-{day}.ndjson.gz")
+            # gzip admite miembros concatenados: cada lote se anexa como uno nuevo
+            with gzip.open(path, "at", encoding="utf-8") as fh:
+                fh.write("\n".join(lines) + "\n")
+        self.archived_total += len(rows)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "running": self._task is not None,
+            "raw_days": self.raw_days,
+            "rollup_days": self.rollup_days,
+            "archive_dir": self.archive_dir,
+            "runs_total": self.runs_total,
+            "errors_total": self.errors_total,
+            "raw_purged_total": self.raw_purged_total,
+            "rollups_purged_total": self.rollups_purged_total,
+            "archived_total": self.archived_total,
+            "last_run_at": self.last_run_at,
+            "last_run_seconds": round(self.last_run_seconds, 3),
+            "seconds_total": round(self.seconds_total, 3),
+        }
+
+
+RETENTION = RetentionWorker(
+    raw_days=RETENTION_RAW_DAYS,
+    rollup_days=RETENTION_ROLLUP_DAYS,
+    interval=RETENTION_INTERVAL_SECONDS,
+    chunk=RETENTION_CHUNK,
+    pause=RETENTION_PAUSE_MS / 1000.0,
+    archive_dir=ARCHIVE_DIR,
+)
+
+
+class ApiKey:
+    """Clave del registro: dueño, robot al que se limita (opcional) y cubeta de tokens."""
+
+    __slots__ = ("owner", "robot_id", "rate", "burst", "tokens", "updated_at")
 
+    def __init__(self, owner: str, robot_id: Optional[str], rate: float, burst: float) -> None:
+        self.owner = owner
+        self.robot_id = robot_id
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
 
-DB_PATH = os.getenv("TG_DB_PATH", "/tmp/telemetry.db")
-DB_URL = os.getenv("TG_DB_URL")
-# Usamos Postgres solo si hay URL y el módulo está disponible
-USE_POSTGRES = bool(DB_URL) and psycopg2 is not None
+    def consume(self, count: int) -> float:
+        """Descuenta ``count`` lecturas; devuelve 0 o los segundos a esperar si no hay saldo.
+
+        Con saldo para al menos una lectura se admite el lote completo aunque
+        deje la cubeta en negativo: así un lote mayor que ``burst`` no queda rechazado para
+        siempre, y la deuda se paga esperando antes del siguiente.
+        """
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return (1.0 - self.tokens) / self.rate
+        self.tokens -= count
+        return 0.0
+
+
+class KeyRegistry:
+    """Claves de ingesta por robot/usuario cacheadas en memoria.
+
+    Las claves se cargan de ``keys_file`` y/o ``keys_db`` al arrancar y luego
+    cada ``refresh`` segundos en segundo plano, de modo que autenticar una
+    lectura no toca la BD. Se guardan indexadas por su SHA-256: el tiempo de
+    la búsqueda depende del hash y no del secreto, y la clave en claro no
+    queda en memoria; la clave compartida se compara con hmac.compare_digest.
+    Si una recarga falla se conservan las claves anteriores. Sin ninguna
+    fuente ni clave compartida, la ingesta queda abierta como antes.
+    """
+
+    def __init__(
+        self,
+        shared_token: Optional[str],
+        keys_file: Optional[str],
+        keys_db: Optional[str],
+        db_query: str,
+        refresh: float,
+        rate: float,
+        burst: float,
+    ) -> None:
+        self.shared_token = shared_token.encode("utf-8") if shared_token else None
+        self.keys_file = keys_file
+        self.keys_db = keys_db
+        self.db_query = db_query
+        self.refresh = max(1.0, refresh)
+        self.rate = rate
+        self.burst = burst
+        self._keys: Dict[bytes, ApiKey] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.loaded_at: Optional[str] = None
+        self.reloads_total = 0
+        self.errors_total = 0
+        self.rejected_total = 0
+        self.forbidden_total = 0
+        self.rate_limited_total = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.shared_token or self.keys_file or self.keys_db)
+
+    @staticmethod
+    def digest(key: str) -> bytes:
+        return hashlib.sha256(key.encode("utf-8")).digest()
+
+    def load(self) -> int:
+        """Relee las fuentes y reemplaza el registro; las cubetas de claves que siguen se conservan."""
+        entries: List[Tuple[str, str, Optional[str], float, float]] = []
+        if self.keys_file:
+            entries.extend(self._read_file(self.keys_file))
+        if self.keys_db:
+            entries.extend(self._read_db(self.keys_db))
+        current = self._keys
+        keys: Dict[bytes, ApiKey] = {}
+        for key, owner, robot_id, rate, burst in entries:
+            digest = self.digest(key)
+            previous = current.get(digest)
+            if previous is not None and (previous.owner, previous.robot_id) == (owner, robot_id):
+                previous.rate, previous.burst = rate, burst
+                keys[digest] = previous
+            else:
+                keys[digest] = ApiKey(owner, robot_id, rate, burst)
+        self._keys = keys
+        self.reloads_total += 1
+        self.loaded_at = datetime.now(timezone.utc).isoformat()
+        return len(keys)
+
+    def _read_file(self, path: str) -> List[Tuple[str, str, Optional[str], float, float]]:
+        """JSON: lista (o {"keys": [...]}) de {"key", "owner", "robot_id", "rate", "burst"}."""
+        with open(path, "r", encoding="utf-8") as fh:
+            raw = json.load(fh)
+        items = raw.get("keys", []) if isinstance(raw, dict) else raw
+        return [
+            (
+                str(item["key"]),
+                str(item.get("owner") or item.get("robot_id") or "file"),
+                item.get("robot_id") or None,
+                float(item.get("rate", self.rate)),
+                float(item.get("burst", self.burst)),
+            )
+            for item in items
+            if item.get("key")
+        ]
+
+    def _read_db(self, target: str) -> List[Tuple[str, str, Optional[str], float, float]]:
+        """Filas (clave, dueño[, robot_id]) de ``db_query`` en SQLite o Postgres."""
+        if target.startswith(("postgres://", "postgresql://")):
+            if psycopg2 is None:
+                raise RuntimeError("TG_KEYS_DB apunta a Postgres pero psycopg2 no está instalado")
+            conn = psycopg2.connect(target)
+        else:
+            conn = sqlite3.connect(f"file:{target}?mode=ro", uri=True)
+        try:
+            cur = conn.cursor()
+            cur.execute(self.db_query)
+            rows = cur.fetchall()
+        finally:
+            conn.close()
+        return [
+            (str(row[0]), str(row[1]), (row[2] or None) if len(row) > 2 else None, self.rate, self.burst)
+            for row in rows
+            if row[0]
+        ]
+
+    def authenticate(self, key: Optional[str]) -> Optional[ApiKey]:
+        """ApiKey del registro, o None si la ingesta está abierta o se usó la clave compartida."""
+        if not self.enabled:
+            return None
+        if key:
+            if self.shared_token is not None and hmac.compare_digest(key.encode("utf-8"), self.shared_token):
+                return None
+            entry = self._keys.get(self.digest(key))
+            if entry is not None:
+                return entry
+        self.rejected_total += 1
+        PROM.inc("tg_auth_rejected_total", ("invalid_key",))
+        raise HTTPException(status_code=401, detail="API key inválida o ausente")
+
+    def authorize(self, entry: Optional[ApiKey], robot_ids: Sequence[str]) -> None:
+        """Comprueba el robot permitido y descuenta las lecturas de la cubeta de la clave."""
+        if entry is None:
+            return
+        if entry.robot_id is not None and any(robot_id != entry.robot_id for robot_id in robot_ids):
+            self.forbidden_total += 1
+            PROM.inc("tg_auth_rejected_total", ("robot_mismatch",))
+            raise HTTPException(status_code=403, detail=f"La API key solo admite lecturas de {entry.robot_id}")
+        wait = entry.consume(len(robot_ids))
+        if wait:
+            self.rate_limited_total += 1
+            PROM.inc("tg_auth_rejected_total", ("rate_limited",))
+            raise HTTPException(
+                status_code=429,
+                detail=f"Límite de {entry.rate:g} lecturas/seg superado",
+                headers={"Retry-After": str(max(1, math.ceil(wait)))},
+            )
+
+    def start(self) -> None:
+        if (self.keys_file or self.keys_db) and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await run_in_threadpool(self.load)
+            except Exception:
+                self.errors_total += 1
+                logger.exception("claves: no se pudo recargar el registro; se mantienen las anteriores")
+            await asyncio.sleep(self.refresh)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "shared_token": self.shared_token is not None,
+            "sources": [name for name, value in (("file", self.keys_file), ("db", self.keys_db)) if value],
+            "keys": len(self._keys),
+            "refresh_s": self.refresh,
+            "default_rate": self.rate,
+            "default_burst": self.burst,
+            "loaded_at": self.loaded_at,
+            "reloads_total": self.reloads_total,
+            "errors_total": self.errors_total,
+            "rejected_total": self.rejected_total,
+            "forbidden_total": self.forbidden_total,
+            "rate_limited_total": self.rate_limited_total,
+        }
+
+
+KEYS = KeyRegistry(
+    shared_token=INGEST_TOKEN,
+    keys_file=KEYS_FILE,
+    keys_db=KEYS_DB,
+    db_query=KEYS_DB_QUERY,
+    refresh=KEYS_REFRESH_SECONDS,
+    rate=KEY_RATE,
+    burst=KEY_BURST,
+)
+
+
+def on_committed(rows: Sequence[Sequence[Any]]) -> None:
+    """Propaga filas recién confirmadas a la caché en memoria y al streaming."""
+    LIVE.add(rows)
+    STREAM.publish(rows)
+    PROM.inc_counts("tg_rows_ingested_total", Counter((row[3],) for row in rows))
 
 
 class Position(BaseModel):
@@ -66,6 +2189,19 @@ class LiveResponse(BaseModel):
     updated_at: datetime
 
 
+class BatchIngestOut(BaseModel):
+    count: int
+    ids: List[int] = Field(..., description="Ids asignados, en el mismo orden que las lecturas enviadas")
+
+
+class AggregatePoint(BaseModel):
+    bucket_start: datetime
+    count: int
+    min: float
+    max: float
+    avg: float
+
+
 TelemetryIn.model_rebuild()
 TelemetryOut.model_rebuild()
 RobotTrail.model_rebuild()
@@ -74,6 +2210,210 @@ TelemetryIn.model_rebuild()
 TelemetryOut.model_rebuild()
 RobotTrail.model_rebuild()
 LiveResponse.model_rebuild()
+BatchIngestOut.model_rebuild()
+AggregatePoint.model_rebuild()
+
+TelemetryBatch = TypeAdapter(List[TelemetryIn])
+
+class CompressionMiddleware:
+    """Compresión HTTP en ambos sentidos.
+
+    - Respuestas: si el cliente acepta zstd (y está instalado ``zstandard``) o
+      gzip y el cuerpo alcanza ``minimum_size``, se comprime; las respuestas en
+      streaming se comprimen por trozos con flush para no retener datos. SSE y
+      respuestas que ya traen Content-Encoding pasan intactas.
+    - Peticiones: los cuerpos con ``Content-Encoding: gzip``/``zstd`` se
+      descomprimen antes de llegar a los handlers, hasta ``max_body`` bytes.
+    """
+
+    def __init__(self, app: Any, minimum_size: int, gzip_level: int, zstd_level: int, max_body: int) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.zstd_level = zstd_level
+        self.max_body = max_body
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable[..., Any], send: Callable[..., Any]) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        encoding = headers.get("content-encoding", "").strip().lower()
+        if encoding and encoding != "identity":
+            try:
+                body = self.decode_body(await self._read_body(receive), encoding)
+            except HTTPException as exc:
+                await JSONResponse({"detail": exc.detail}, status_code=exc.status_code)(scope, receive, send)
+                return
+            scope, receive = self._replace_body(scope, receive, body)
+        coding = self.negotiate(headers.get("accept-encoding", ""))
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _CompressingSend(send, coding, self))
+
+    def negotiate(self, accept: str) -> Optional[str]:
+        accepted: Dict[str, float] = {}
+        for part in accept.lower().split(","):
+            name, _, params = part.strip().partition(";")
+            q = 1.0
+            if params.strip().startswith("q="):
+                try:
+                    q = float(params.strip()[2:])
+                except ValueError:
+                    q = 0.0
+            accepted[name.strip()] = q
+        if zstandard is not None and accepted.get("zstd", 0) > 0:
+            return "zstd"
+        if accepted.get("gzip", accepted.get("*", 0)) > 0:
+            return "gzip"
+        return None
+
+    def compressor(self, coding: str) -> Any:
+        if coding == "zstd":
+            return zstandard.ZstdCompressor(level=self.zstd_level).compressobj()
+        return zlib.compressobj(self.gzip_level, zlib.DEFLATED, 31)
+
+    def decode_body(self, raw: bytes, encoding: str) -> bytes:
+        if encoding == "gzip":
+            decoder = zlib.decompressobj(31)
+            try:
+                body = decoder.decompress(raw, self.max_body + 1)
+            except zlib.error as exc:
+                raise HTTPException(status_code=400, detail=f"Cuerpo gzip inválido: {exc}")
+        elif encoding == "zstd" and zstandard is not None:
+            try:
+                with zstandard.ZstdDecompressor().stream_reader(raw) as reader:
+                    body = reader.read(self.max_body + 1)
+            except zstandard.ZstdError as exc:
+                raise HTTPException(status_code=400, detail=f"Cuerpo zstd inválido: {exc}")
+        else:
+            raise HTTPException(status_code=415, detail=f"Content-Encoding no soportado: {encoding}")
+        if len(body) > self.max_body:
+            raise HTTPException(status_code=413, detail=f"Cuerpo descomprimido mayor que {self.max_body} bytes")
+        return body
+
+    @staticmethod
+    async def _read_body(receive: Callable[..., Any]) -> bytes:
+        chunks: List[bytes] = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                return b"".join(chunks)
+
+    @staticmethod
+    def _replace_body(
+        scope: Dict[str, Any], receive: Callable[..., Any], body: bytes
+    ) -> Tuple[Dict[str, Any], Callable[..., Any]]:
+        raw_headers = [
+            (k, v) for k, v in scope["headers"] if k not in (b"content-encoding", b"content-length")
+        ]
+        raw_headers.append((b"content-length", str(len(body)).encode("latin-1")))
+        pending = [{"type": "http.request", "body": body, "more_body": False}]
+
+        async def replay() -> Dict[str, Any]:
+            return pending.pop() if pending else await receive()
+
+        # Se modifica el scope en sitio: los middlewares externos (métricas)
+        # leen de él la ruta resuelta por el router
+        scope["headers"] = raw_headers
+        return scope, replay
+
+
+class _CompressingSend:
+    """``send`` que comprime el cuerpo de la respuesta en curso."""
+
+    def __init__(self, send: Callable[..., Any], coding: str, middleware: CompressionMiddleware) -> None:
+        self.send = send
+        self.coding = coding
+        self.middleware = middleware
+        self.start: Optional[Dict[str, Any]] = None
+        self.compressor: Any = None
+        self.passthrough = False
+
+    async def __call__(self, message: Dict[str, Any]) -> None:
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self._flush_start()
+            await self.send(message)
+            return
+        body = message.get("body", b"")
+        more = message.get("more_body", False)
+        if self.start is not None:
+            headers = MutableHeaders(raw=self.start["headers"])
+            if (
+                "content-encoding" in headers
+                or headers.get("content-type", "").startswith("text/event-stream")
+                or (not more and len(body) < self.middleware.minimum_size)
+            ):
+                self.passthrough = True
+                await self._flush_start()
+                await self.send(message)
+                return
+            self.compressor = self.middleware.compressor(self.coding)
+            headers["content-encoding"] = self.coding
+            headers.add_vary_header("Accept-Encoding")
+            if not more:
+                body = self.compressor.compress(body) + self.compressor.flush()
+                headers["content-length"] = str(len(body))
+                await self._flush_start()
+                await self.send({"type": "http.response.body", "body": body, "more_body": False})
+                return
+            del headers["content-length"]
+            await self._flush_start()
+        await self.send({"type": "http.response.body", "body": self._compress_chunk(body, more), "more_body": more})
+
+    def _compress_chunk(self, body: bytes, more: bool) -> bytes:
+        data = self.compressor.compress(body)
+        if not more:
+            return data + self.compressor.flush()
+        if self.coding == "zstd":
+            return data + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return data + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    async def _flush_start(self) -> None:
+        if self.start is not None:
+            start, self.start = self.start, None
+            await self.send(start)
+
+
+class MetricsMiddleware:
+    """Cuenta peticiones HTTP y mide su latencia por plantilla de ruta.
+
+    La etiqueta ``route`` es la ruta declarada (``/api/telemetry/query``), no
+    la URL, para acotar la cardinalidad; lo que no casa con ninguna ruta va a
+    "unmatched". Los WebSocket pasan sin medir.
+    """
+
+    def __init__(self, app: Any, registry: PrometheusRegistry) -> None:
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable[..., Any], send: Callable[..., Any]) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = [500]
+
+        async def send_with_status(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        registry = self.registry
+        registry.inc("tg_http_requests_in_flight")
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            registry.inc("tg_http_requests_in_flight", amount=-1.0)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            registry.inc("tg_http_requests_total", (scope["method"], route, str(status[0])))
+            registry.observe("tg_http_request_duration_seconds", elapsed, (scope["method"], route))
 
 
 app = FastAPI(title="Telemetry Gateway", version="0.2.0")
@@ -86,273 +2426,666 @@ app.add_middleware(
     allow_origins=origins if origins else ["*"],
     allow_credentials=True,
     allow_methods=["*"],
-    allow_headers=["*"]
+    allow_headers=["*"],
+    # El cursor de /query viaja en cabecera: sin esto un dashboard de otro origen no puede paginar
+    expose_headers=["X-Next-Before-Id"],
+)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=COMPRESSION_MIN_BYTES,
+    gzip_level=GZIP_LEVEL,
+    zstd_level=ZSTD_LEVEL,
+    max_body=MAX_BODY_BYTES,
 )
+if PROMETHEUS_ENABLED:
+    app.add_middleware(MetricsMiddleware, registry=PROM)
 
 
 @app.on_event("startup")
-def startup() -> None:
+async def startup() -> None:
     init_db()
+    if KEYS.keys_file or KEYS.keys_db:
+        KEYS.load()
+    LIVE.warm(STORE.fetch_latest_per_robot(LIVE.trail_size))
+    WRITE_BEHIND.start()
+    RETENTION.start()
+    KEYS.start()
+
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    await KEYS.stop()
+    await RETENTION.stop()
+    await WRITE_BEHIND.stop()
+    DB.close()
+    POOL.close()
 
 
 def init_db() -> None:
-    columns = {
-        "robot_id": "TEXT",
-        "position_lat": "DOUBLE PRECISION" if USE_POSTGRES else "REAL",
-        "position_lng": "DOUBLE PRECISION" if USE_POSTGRES else "REAL",
-        "position_alt": "DOUBLE PRECISION" if USE_POSTGRES else "REAL",
-        "environment": "TEXT",
-        "status": "TEXT",
-    }
+    STORE.init()
+
+
+@app.get("/healthz")
+def healthz() -> Dict[str, str]:
+    return {"status": "ok"}
+
+
+@app.get("/metrics")
+def metrics() -> Response:
+    """Métricas en formato de exposición de Prometheus."""
+    return Response(PROM.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/telemetry/pool")
+def pool_stats() -> Dict[str, Any]:
+    """Ocupación del pool de conexiones (saturation = in_use / size) y modo de acceso."""
+    return {**POOL.stats(), "executor": DB.stats(), "store": STORE.name}
+
+
+@app.get("/api/telemetry/keys")
+def key_registry_stats() -> Dict[str, Any]:
+    """Estado del registro de claves de ingesta (sin exponer las claves)."""
+    return KEYS.stats()
 
-    if USE_POSTGRES:
-        conn = psycopg2.connect(DB_URL)
-        try:
-            cur = conn.cursor()
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS telemetry (
-                    id SERIAL PRIMARY KEY,
-                    ts TIMESTAMP NOT NULL,
-                    data TEXT NOT NULL,
-                    robot_id TEXT NOT NULL,
-                    position_lat DOUBLE PRECISION,
-                    position_lng DOUBLE PRECISION,
-                    position_alt DOUBLE PRECISION,
-                    environment TEXT,
-                    status TEXT
-                )
-                """
-            )
-            ensure_columns_postgres(cur, columns)
-            conn.commit()
-        finally:
-            cur.close()
-            conn.close()
-    else:
-        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-        with sqlite3.connect(DB_PATH) as con:
-            con.execute(
-                """
-                CREATE TABLE IF NOT EXISTS telemetry (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    ts TEXT NOT NULL,
-                    data TEXT NOT NULL,
-                    robot_id TEXT NOT NULL,
-                    position_lat REAL,
-                    position_lng REAL,
-                    position_alt REAL,
-                    environment TEXT,
-                    status TEXT
-                )
-                """
-            )
-            ensure_columns_sqlite(con, columns)
-            con.commit()
 
+@app.get("/api/telemetry/ingest/queue")
+def ingest_queue_stats() -> Dict[str, Any]:
+    """Contadores del modo write-behind (profundidad, latencia de flush, descartes)."""
+    return WRITE_BEHIND.stats()
 
-def ensure_columns_postgres(cur: Any, required: Dict[str, str]) -> None:
-    cur.execute(
-        "SELECT column_name FROM information_schema.columns WHERE table_name='telemetry'"
+
+@app.get("/api/telemetry/cache")
+def live_cache_stats() -> Dict[str, Any]:
+    """Estado de la caché en memoria que sirve /last y /live."""
+    return LIVE.stats()
+
+
+@app.get("/api/telemetry/retention")
+def retention_stats() -> Dict[str, Any]:
+    """Política de retención y contadores de filas purgadas/archivadas."""
+    return RETENTION.stats()
+
+
+@app.get("/api/telemetry/stream/stats")
+def stream_stats() -> Dict[str, Any]:
+    """Clientes conectados al push de lecturas y mensajes descartados."""
+    return STREAM.stats()
+
+
+@app.get("/api/telemetry/stream")
+async def stream(request: Request, robot_id: Optional[str] = Query(default=None, description="Filtra por robot")) -> StreamingResponse:
+    """Server-Sent Events: un evento ``telemetry`` por lectura ingerida."""
+    sub = STREAM.subscribe(robot_id)
+    return StreamingResponse(
+        sse_events(sub, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    existing = {row[0] for row in cur.fetchall()}
-    for name, ddl in required.items():
-        if name not in existing:
-            cur.execute(f"ALTER TABLE telemetry ADD COLUMN {name} {ddl}")
 
 
-def ensure_columns_sqlite(con: sqlite3.Connection, required: Dict[str, str]) -> None:
-    cur = con.cursor()
-    cur.execute("PRAGMA table_info(telemetry)")
-    existing = {row[1] for row in cur.fetchall()}
-    for name, ddl in required.items():
-        if name not in existing:
-            cur.execute(f"ALTER TABLE telemetry ADD COLUMN {name} {ddl}")
-    cur.close()
+async def sse_events(sub: StreamSubscriber, is_disconnected: Callable[[], Awaitable[bool]]) -> AsyncIterator[str]:
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                row_id, body = await asyncio.wait_for(sub.queue.get(), STREAM_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                if await is_disconnected():
+                    break
+                yield ": keepalive\n\n"
+                continue
+            yield f"id: {row_id}\nevent: telemetry\ndata: {body}\n\n"
+    finally:
+        STREAM.unsubscribe(sub)
+
 
+@app.websocket("/api/telemetry/ws")
+async def stream_ws(websocket: WebSocket, robot_id: Optional[str] = None) -> None:
+    """Variante WebSocket de /stream: un mensaje JSON por lectura ingerida."""
+    try:
+        sub = STREAM.subscribe(robot_id)
+    except HTTPException:
+        await websocket.close(code=1013)
+        return
+    await websocket.accept()
 
-@app.get("/healthz")
-def healthz() -> Dict[str, str]:
-    return {"status": "ok"}
+    async def wait_disconnect() -> None:
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    closed = asyncio.ensure_future(wait_disconnect())
+    try:
+        while True:
+            pending = asyncio.ensure_future(sub.queue.get())
+            done, _ = await asyncio.wait({pending, closed}, return_when=asyncio.FIRST_COMPLETED)
+            if pending not in done:
+                pending.cancel()
+                break
+            await websocket.send_text(pending.result()[1])
+    except WebSocketDisconnect:
+        pass
+    finally:
+        closed.cancel()
+        STREAM.unsubscribe(sub)
 
 
-@app.post("/api/telemetry/ingest", response_model=TelemetryOut)
-def ingest(payload: TelemetryIn, x_api_key: Optional[str] = Header(default=None, convert_underscores=True)) -> TelemetryOut:
-    required = os.getenv("TG_INGEST_TOKEN")
-    if required and (x_api_key or "") != required:
-        raise HTTPException(status_code=401, detail="API key inválida o ausente")
+def check_ingest_token(x_api_key: Optional[str]) -> Optional[ApiKey]:
+    return KEYS.authenticate(x_api_key)
 
-    ts = (payload.ts or datetime.now(timezone.utc)).isoformat()
+
+def to_utc(value: datetime) -> datetime:
+    """Pasa timestamps con zona a UTC; los naive se asumen ya en UTC."""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc)
+
+
+def aware_utc(value: datetime) -> datetime:
+    """Como to_utc, pero los naive se marcan como UTC para poder compararlos."""
+    return to_utc(value) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def prepare_insert(payload: TelemetryIn) -> Tuple[Any, ...]:
+    """Normaliza una lectura validada a la tupla de columnas de INSERT_COLUMNS."""
+    ts = to_utc(payload.ts or datetime.now(timezone.utc)).isoformat()
     robot_id = (payload.robot_id or payload.data.get("robot_id") or "robot-unknown").strip()
     if not robot_id:
         raise HTTPException(status_code=422, detail="robot_id requerido")
 
     position = payload.position or build_position_from_data(payload.data)
+    if position and not all(v is None or math.isfinite(v) for v in (position.lat, position.lng, position.alt)):
+        raise HTTPException(status_code=422, detail="position no admite valores NaN ni Infinity")
 
     try:
-        data_json = json.dumps(payload.data, ensure_ascii=False)
+        # allow_nan=False: NaN/Infinity no son JSON y orjson no los relee
+        data_json = json.dumps(payload.data, ensure_ascii=False, allow_nan=False)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="data no admite valores NaN ni Infinity")
     except Exception as exc:  # pragma: no cover
         raise HTTPException(status_code=400, detail=f"Datos no serializables: {exc}")
 
-    coords = (
+    return (
+        ts,
+        data_json,
+        robot_id,
         position.lat if position else None,
         position.lng if position else None,
         position.alt if position else None,
+        payload.environment,
+        payload.status,
     )
 
-    if USE_POSTGRES:
-        conn = psycopg2.connect(DB_URL)
-        try:
-            cur = conn.cursor()
-            cur.execute(
-                """
-                INSERT INTO telemetry(ts, data, robot_id, position_lat, position_lng, position_alt, environment, status)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id, ts, data, robot_id, position_lat, position_lng, position_alt, environment, status
-                """,
-                (ts, data_json, robot_id, coords[0], coords[1], coords[2], payload.environment, payload.status),
-            )
-            row = cur.fetchone()
-            conn.commit()
-        finally:
-            cur.close()
-            conn.close()
+
+def _inline_refs(node: Any, defs: Dict[str, Any]) -> Any:
+    if isinstance(node, dict):
+        ref = node.get("$ref", "")
+        if ref.startswith("#/$defs/"):
+            return _inline_refs(defs[ref[len("#/$defs/"):]], defs)
+        return {k: _inline_refs(v, defs) for k, v in node.items() if k != "$defs"}
+    if isinstance(node, list):
+        return [_inline_refs(v, defs) for v in node]
+    return node
+
+
+def ingest_request_body(batch: bool = False) -> Dict[str, Any]:
+    """requestBody de OpenAPI para /ingest y /ingest/batch: los handlers leen
+    el cuerpo a mano, así que FastAPI ya no lo deduce de TelemetryIn."""
+    schema = TelemetryIn.model_json_schema()
+    reading = _inline_refs(schema, schema.get("$defs", {}))
+    if not batch:
+        return {
+            "required": True,
+            "content": {
+                "application/json": {"schema": reading},
+                BINARY_CONTENT_TYPE: {"schema": {"type": "string", "format": "binary", "description": "Una trama (ver decode_frames)"}},
+            },
+        }
+    return {
+        "required": True,
+        "content": {
+            "application/json": {"schema": {"type": "array", "items": reading, "minItems": 1, "maxItems": INGEST_BATCH_MAX}},
+            "application/x-ndjson": {"schema": {"type": "string", "description": "Una lectura TelemetryIn en JSON por línea"}},
+            BINARY_CONTENT_TYPE: {"schema": {"type": "string", "format": "binary", "description": "Tramas concatenadas (ver decode_frames)"}},
+        },
+    }
+
+
+@app.post(
+    "/api/telemetry/ingest",
+    response_model=TelemetryOut,
+    openapi_extra={"requestBody": ingest_request_body()},
+)
+async def ingest(request: Request, x_api_key: Optional[str] = Header(default=None, convert_underscores=True)) -> Any:
+    """Una lectura como JSON (TelemetryIn) o como trama binaria (BINARY_CONTENT_TYPE)."""
+    key = check_ingest_token(x_api_key)
+    body = await request.body()
+    if BINARY_CONTENT_TYPE in request.headers.get("content-type", ""):
+        items = decode_frames(body)
+        if len(items) != 1:
+            raise HTTPException(status_code=400, detail="Se esperaba una sola trama; usa /ingest/batch para varias")
+        payload = validate_readings(items)[0]
     else:
-        with sqlite3.connect(DB_PATH) as con:
-            cur = con.cursor()
-            cur.execute(
-                """
-                INSERT INTO telemetry(ts, data, robot_id, position_lat, position_lng, position_alt, environment, status)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (ts, data_json, robot_id, coords[0], coords[1], coords[2], payload.environment, payload.status),
-            )
-            rowid = cur.lastrowid
-            cur.execute(
-                "SELECT id, ts, data, robot_id, position_lat, position_lng, position_alt, environment, status FROM telemetry WHERE id = ?",
-                (rowid,),
+        try:
+            payload = TelemetryIn.model_validate_json(body)
+        except ValidationError as exc:
+            raise body_validation_error(exc)
+    values = prepare_insert(payload)
+    KEYS.authorize(key, (values[2],))
+
+    if WRITE_BEHIND.enabled:
+        # La lectura se persiste en el siguiente flush; aún no tiene id.
+        if not WRITE_BEHIND.offer(values):
+            raise HTTPException(
+                status_code=503,
+                detail="Cola de ingesta llena",
+                headers={"Retry-After": WRITE_BEHIND.retry_after},
             )
-            row = cur.fetchone()
+        return JSONResponse(
+            status_code=202,
+            content={"status": "queued", "robot_id": values[2], "ts": values[0]},
+        )
+    return await DB.write(insert_one, values)
 
+
+def insert_one(values: Tuple[Any, ...]) -> TelemetryOut:
+    row = STORE.insert_one(values)
+    on_committed([row])
     return serialize_row(row)
 
 
+@app.post(
+    "/api/telemetry/ingest/batch",
+    response_model=BatchIngestOut,
+    openapi_extra={"requestBody": ingest_request_body(batch=True)},
+)
+async def ingest_batch(
+    request: Request,
+    x_api_key: Optional[str] = Header(default=None, convert_underscores=True),
+) -> BatchIngestOut:
+    """Ingesta masiva: un array JSON, NDJSON (una lectura por línea) o tramas
+    binarias concatenadas.
+
+    Todas las lecturas se validan antes de escribir; si alguna falla no se
+    inserta ninguna. La escritura es una única transacción.
+    """
+    key = check_ingest_token(x_api_key)
+    items = parse_batch_body(await request.body(), request.headers.get("content-type", ""))
+    if not items:
+        raise HTTPException(status_code=400, detail="Lote vacío")
+    ids = await ingest_items(items, key)
+    return BatchIngestOut(count=len(ids), ids=ids)
+
+
+@app.websocket("/api/telemetry/ws/ingest")
+async def ingest_ws(websocket: WebSocket, token: Optional[str] = None) -> None:
+    """Canal persistente de ingesta para robots de alta frecuencia.
+
+    Cada mensaje binario lleva una o más tramas y cada mensaje de texto un
+    array JSON o NDJSON; por cada mensaje se responde ``{"count", "ids"}`` o
+    ``{"error"}`` sin cerrar la conexión. El token va en ``x-api-key`` o ``?token=``.
+    """
+    try:
+        key = check_ingest_token(websocket.headers.get("x-api-key") or token)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            try:
+                if message.get("bytes") is not None:
+                    items = decode_frames(message["bytes"])
+                else:
+                    text = (message.get("text") or "").strip()
+                    items = parse_batch_body(text.encode("utf-8"), "" if text.startswith("[") else "ndjson")
+                ids = await ingest_items(items, key)
+            except HTTPException as exc:
+                await websocket.send_text(dumps({"error": exc.detail}).decode("utf-8"))
+                continue
+            except RequestValidationError as exc:
+                errors = [{"loc": list(e["loc"]), "msg": e["msg"]} for e in exc.errors()]
+                await websocket.send_text(dumps({"error": "Lectura inválida", "detail": errors}).decode("utf-8"))
+                continue
+            await websocket.send_text(dumps({"count": len(ids), "ids": ids}).decode("utf-8"))
+    except WebSocketDisconnect:
+        pass
+
+
+@app.get("/api/telemetry/binary/schema")
+def binary_schema() -> Dict[str, Any]:
+    """Formato de la trama binaria y tabla de ids de métrica vigente."""
+    return {
+        "version": FRAME_VERSION,
+        "content_type": BINARY_CONTENT_TYPE,
+        "byte_order": "little-endian",
+        "flags": {
+            "ts": FRAME_TS,
+            "position": FRAME_POSITION,
+            "alt": FRAME_ALT,
+            "environment": FRAME_ENVIRONMENT,
+            "status": FRAME_STATUS,
+        },
+        "metrics": BINARY_METRIC_IDS,
+    }
+
+
+async def ingest_items(items: List[Any], key: Optional[ApiKey] = None) -> List[int]:
+    """Valida, normaliza y persiste un lote en una transacción; devuelve los ids."""
+    if len(items) > INGEST_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Máximo {INGEST_BATCH_MAX} lecturas por lote")
+    rows = [prepare_insert(p) for p in validate_readings(items)]
+    KEYS.authorize(key, [row[2] for row in rows])
+    return await DB.write(insert_many, rows)
+
+
+def validate_readings(items: List[Any]) -> List[TelemetryIn]:
+    try:
+        return TelemetryBatch.validate_python(items)
+    except ValidationError as exc:
+        raise body_validation_error(exc)
+
+
+def body_validation_error(exc: ValidationError) -> RequestValidationError:
+    """Errores de pydantic con el mismo formato 422 que da FastAPI para el body."""
+    return RequestValidationError([{**err, "loc": ("body", *err["loc"])} for err in exc.errors(include_url=False)])
+
+
+# Trama binaria de una lectura, little-endian y autodelimitada:
+#   B versión | B flags | d ts epoch UTC (FRAME_TS) | B len + robot_id utf-8
+#   | d lat, d lng (FRAME_POSITION) | d alt (FRAME_ALT, requiere FRAME_POSITION)
+#   | B len + environment (FRAME_ENVIRONMENT) | B len + status (FRAME_STATUS)
+#   | B n | n × (H id de métrica, d valor)
+# Una lectura con posición y cuatro métricas ocupa ~80 bytes frente a ~190 en JSON.
+FRAME_VERSION = 1
+FRAME_TS, FRAME_POSITION, FRAME_ALT, FRAME_ENVIRONMENT, FRAME_STATUS = 0x01, 0x02, 0x04, 0x08, 0x10
+FRAME_HEAD = struct.Struct("<BB")
+FRAME_F64 = struct.Struct("<d")
+FRAME_LATLNG = struct.Struct("<dd")
+FRAME_METRIC = struct.Struct("<Hd")
+
+
+def decode_frames(body: bytes) -> List[Dict[str, Any]]:
+    """Tramas concatenadas → dicts con la forma de TelemetryIn.
+
+    El ts se deja como epoch: pydantic lo convierte a datetime UTC al validar.
+    """
+    items: List[Dict[str, Any]] = []
+    offset = 0
+    try:
+        while offset < len(body):
+            version, flags = FRAME_HEAD.unpack_from(body, offset)
+            offset += FRAME_HEAD.size
+            if version != FRAME_VERSION:
+                raise ValueError(f"versión {version} no soportada")
+            item: Dict[str, Any] = {}
+            if flags & FRAME_TS:
+                item["ts"] = _frame_finite(FRAME_F64.unpack_from(body, offset)[0], "ts")
+                offset += FRAME_F64.size
+            item["robot_id"], offset = _frame_text(body, offset)
+            if flags & FRAME_POSITION:
+                lat, lng = FRAME_LATLNG.unpack_from(body, offset)
+                offset += FRAME_LATLNG.size
+                item["position"] = {"lat": _frame_finite(lat, "lat"), "lng": _frame_finite(lng, "lng")}
+                if flags & FRAME_ALT:
+                    item["position"]["alt"] = _frame_finite(FRAME_F64.unpack_from(body, offset)[0], "alt")
+                    offset += FRAME_F64.size
+            if flags & FRAME_ENVIRONMENT:
+                item["environment"], offset = _frame_text(body, offset)
+            if flags & FRAME_STATUS:
+                item["status"], offset = _frame_text(body, offset)
+            end = offset + 1 + body[offset] * FRAME_METRIC.size
+            if end > len(body):
+                raise ValueError("trama truncada")
+            try:
+                item["data"] = {
+                    BINARY_METRIC_NAMES[metric_id]: _frame_finite(value, BINARY_METRIC_NAMES[metric_id])
+                    for metric_id, value in FRAME_METRIC.iter_unpack(body[offset + 1:end])
+                }
+            except IndexError:
+                raise ValueError("id de métrica desconocido")
+            offset = end
+            items.append(item)
+    except (struct.error, IndexError, ValueError, OverflowError, UnicodeDecodeError) as exc:
+        raise HTTPException(status_code=400, detail=f"Trama binaria inválida (byte {offset}): {exc}")
+    return items
+
+
+def _frame_finite(value: float, name: str) -> float:
+    # Un double admite NaN/inf, que ni el JSON guardado ni los rollups aceptan
+    if not math.isfinite(value):
+        raise ValueError(f"{name} no finito ({value})")
+    return value
+
+
+def _frame_text(body: bytes, offset: int) -> Tuple[str, int]:
+    end = offset + 1 + body[offset]
+    if end > len(body):
+        raise ValueError("trama truncada")
+    return body[offset + 1:end].decode("utf-8"), end
+
+
+def encode_frame(item: Dict[str, Any]) -> bytes:
+    """Inverso de decode_frames para una lectura (dict con la forma de TelemetryIn).
+
+    Referencia para clientes y tests; las métricas deben ser numéricas y estar
+    en BINARY_METRIC_NAMES.
+    """
+    flags = 0
+    parts: List[bytes] = []
+    ts = item.get("ts")
+    if ts is not None:
+        flags |= FRAME_TS
+        if isinstance(ts, str):
+            ts = datetime.fromisoformat(ts)
+        parts.append(FRAME_F64.pack(ts.timestamp() if isinstance(ts, datetime) else float(ts)))
+    parts.append(_pack_text(item["robot_id"]))
+    position = item.get("position")
+    if position:
+        flags |= FRAME_POSITION
+        parts.append(FRAME_LATLNG.pack(position["lat"], position["lng"]))
+        if position.get("alt") is not None:
+            flags |= FRAME_ALT
+            parts.append(FRAME_F64.pack(position["alt"]))
+    for flag, key in ((FRAME_ENVIRONMENT, "environment"), (FRAME_STATUS, "status")):
+        if item.get(key) is not None:
+            flags |= flag
+            parts.append(_pack_text(item[key]))
+    metrics = item.get("data") or {}
+    parts.append(bytes([len(metrics)]))
+    for name, value in metrics.items():
+        if name not in BINARY_METRIC_IDS:
+            raise ValueError(f"métrica sin id binario: {name}")
+        parts.append(FRAME_METRIC.pack(BINARY_METRIC_IDS[name], float(value)))
+    return FRAME_HEAD.pack(FRAME_VERSION, flags) + b"".join(parts)
+
+
+def _pack_text(value: str) -> bytes:
+    raw = value.encode("utf-8")
+    if len(raw) > 255:
+        raise ValueError("texto de más de 255 bytes")
+    return bytes([len(raw)]) + raw
+
+
+def parse_batch_body(body: bytes, content_type: str) -> List[Any]:
+    if BINARY_CONTENT_TYPE in content_type:
+        return decode_frames(body)
+    try:
+        if "ndjson" in content_type or "jsonlines" in content_type:
+            return [json.loads(line) for line in body.splitlines() if line.strip()]
+        items = json.loads(body or b"[]")
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Cuerpo inválido: {exc}")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Se esperaba un array de lecturas")
+    return items
+
+
+def insert_many(rows: Sequence[Sequence[Any]]) -> List[int]:
+    ids = STORE.insert_many(rows)
+    on_committed([(row_id, *row) for row_id, row in zip(ids, rows)])
+    return ids
+
+
 @app.get("/api/telemetry/last", response_model=TelemetryOut)
-def last(robot_id: Optional[str] = Query(default=None, description="Filtra por robot")) -> TelemetryOut:
-    row = fetch_one(robot_id)
+async def last(robot_id: Optional[str] = Query(default=None, description="Filtra por robot")) -> TelemetryOut:
+    row = LIVE.last(robot_id) if LIVE.ready else None
+    if row is None:
+        row = await DB.read(STORE.fetch_one, robot_id)
     if not row:
         raise HTTPException(status_code=404, detail="Sin datos")
     return serialize_row(row)
 
 
 @app.get("/api/telemetry/query", response_model=List[TelemetryOut])
-def query(limit: int = 100, robot_id: Optional[str] = Query(default=None)) -> List[TelemetryOut]:
+async def query(
+    limit: int = 100,
+    robot_id: Optional[str] = Query(default=None),
+    since: Optional[datetime] = Query(default=None, description="Lecturas con ts >= since"),
+    until: Optional[datetime] = Query(default=None, description="Lecturas con ts < until"),
+    before_id: Optional[int] = Query(default=None, ge=1, description="Cursor: lecturas con id < before_id"),
+    metric: List[str] = Query(default=[], description="Umbral sobre una métrica, p.ej. TEMP>28 (repetible)"),
+) -> Response:
+    """Historial paginado por keyset, del más reciente al más antiguo.
+
+    Si la página viene llena, la cabecera ``X-Next-Before-Id`` trae el cursor
+    para pedir la siguiente; cada página cuesta lo mismo sin importar su
+    profundidad. Los filtros ``metric`` se combinan con AND y se evalúan en SQL.
+    """
     limit = max(1, min(limit, 1000))
-    rows = fetch_many(limit=limit, robot_id=robot_id)
-    return [serialize_row(r) for r in rows]
+    rows = await DB.read(
+        STORE.fetch_many,
+        limit=limit,
+        robot_id=robot_id,
+        since=since,
+        until=until,
+        before_id=before_id,
+        metrics=parse_metric_filters(metric),
+    )
+    headers = {"X-Next-Before-Id": str(rows[-1][0])} if len(rows) == limit else None
+    return json_response([row_to_dict(r) for r in rows], headers=headers)
+
+
+@app.get("/api/telemetry/aggregate", response_model=List[AggregatePoint])
+async def aggregate(
+    robot_id: str = Query(..., description="Robot a consultar"),
+    metric: str = Query(..., description="Métrica numérica, p.ej. TEMP"),
+    bucket: str = Query("1m", pattern="^(1m|1h)$", description="Tamaño del bucket"),
+    since: Optional[datetime] = Query(default=None),
+    until: Optional[datetime] = Query(default=None),
+    limit: int = Query(1440, ge=1, le=10000),
+) -> List[AggregatePoint]:
+    """Serie min/max/avg/count por bucket, leída de los rollups."""
+    rows = await DB.read(STORE.fetch_rollups, robot_id, metric, bucket, since, until, limit)
+    return [
+        AggregatePoint(
+            bucket_start=datetime.fromisoformat(r[0]) if isinstance(r[0], str) else r[0],
+            count=r[1],
+            min=r[2],
+            max=r[3],
+            avg=r[4] / r[1],
+        )
+        for r in rows
+    ]
 
 
 @app.get("/api/telemetry/live", response_model=LiveResponse)
-def live(limit_per_robot: int = Query(10, ge=1, le=100)) -> LiveResponse:
-    rows = fetch_many(limit=limit_per_robot * 10)
+async def live(limit_per_robot: int = Query(10, ge=1, le=100)) -> Response:
     grouped: Dict[str, List[Sequence[Any]]] = {}
-    for row in rows:
-        robot = row[3] or "robot-unknown"
-        grouped.setdefault(robot, []).append(row)
+    if LIVE.ready and limit_per_robot <= LIVE.trail_size:
+        grouped = LIVE.trails(limit_per_robot)
+    else:
+        for row in await DB.read(STORE.fetch_latest_per_robot, limit_per_robot):
+            robot = row[3] or "robot-unknown"
+            grouped.setdefault(robot, []).append(row)
 
-    robots: List[RobotTrail] = []
+    robots: List[Dict[str, Any]] = []
     total_points = 0
     for robot_id, robot_rows in grouped.items():
-        robot_rows_sorted = sorted(robot_rows, key=lambda r: r[1] or r[0], reverse=True)
-        trimmed = robot_rows_sorted[:limit_per_robot]
-        total_points += len(trimmed)
-        serialized = [serialize_row(r) for r in trimmed]
-        robots.append(
-            RobotTrail(robot_id=robot_id, last=serialized[0], trail=list(reversed(serialized)))
-        )
+        # Tanto la caché como el store entregan cada robot por id DESC
+        total_points += len(robot_rows)
+        serialized = [row_to_dict(r) for r in robot_rows]
+        robots.append({"robot_id": robot_id, "last": serialized[0], "trail": serialized[::-1]})
 
-    robots.sort(key=lambda r: r.last.ts, reverse=True)
-    return LiveResponse(
-        robots=robots,
-        total_points=total_points,
-        updated_at=datetime.now(timezone.utc),
+    robots.sort(key=lambda r: r["last"]["ts"], reverse=True)
+    return json_response(
+        {
+            "robots": robots,
+            "total_points": total_points,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }
     )
 
 
-def fetch_one(robot_id: Optional[str]) -> Optional[Sequence[Any]]:
-    if USE_POSTGRES:
-        conn = psycopg2.connect(DB_URL)
-        try:
-            cur = conn.cursor()
-            if robot_id:
-                cur.execute(
-                    "SELECT id, ts, data, robot_id, position_lat, position_lng, position_alt, environment, status "
-                    "FROM telemetry WHERE robot_id = %s ORDER BY id DESC LIMIT 1",
-                    (robot_id,),
-                )
-            else:
-                cur.execute(
-                    "SELECT id, ts, data, robot_id, position_lat, position_lng, position_alt, environment, status "
-                    "FROM telemetry ORDER BY id DESC LIMIT 1"
-                )
-            return cur.fetchone()
-        finally:
-            cur.close()
-            conn.close()
+@app.get("/api/telemetry/area", response_model=List[TelemetryOut])
+async def area(
+    bbox: str = Query(..., description="min_lng,min_lat,max_lng,max_lat (formato de Leaflet toBBoxString)"),
+    since: Optional[datetime] = Query(default=None, description="Lecturas con ts >= since"),
+    mode: str = Query(
+        "latest", pattern="^(latest|readings)$", description="latest: última lectura de cada robot; readings: historial"
+    ),
+    limit: int = Query(500, ge=1, le=5000),
+) -> Response:
+    """Lecturas dentro de una caja geográfica, para cargar sólo lo visible en el mapa.
+
+    ``mode=latest`` devuelve los robots cuya última lectura cae en la caja
+    (desde la caché en memoria si está lista); ``mode=readings`` recorre el
+    índice geo_cell y devuelve el historial de la zona por id DESC.
+    """
+    box = parse_bbox(bbox)
+    if mode == "readings":
+        rows = await DB.read(STORE.fetch_area, box, since, limit)
     else:
-        with sqlite3.connect(DB_PATH) as con:
-            cur = con.cursor()
-            if robot_id:
-                cur.execute(
-                    "SELECT id, ts, data, robot_id, position_lat, position_lng, position_alt, environment, status "
-                    "FROM telemetry WHERE robot_id = ? ORDER BY id DESC LIMIT 1",
-                    (robot_id,),
-                )
-            else:
-                cur.execute(
-                    "SELECT id, ts, data, robot_id, position_lat, position_lng, position_alt, environment, status "
-                    "FROM telemetry ORDER BY id DESC LIMIT 1"
-                )
-            return cur.fetchone()
+        if LIVE.ready:
+            latest = [trail[0] for trail in LIVE.trails(1).values()]
+        else:
+            latest = await DB.read(STORE.fetch_latest_per_robot, 1)
+        since_utc = aware_utc(since) if since is not None else None
+        rows = [
+            row for row in latest
+            if in_bbox(row, box) and (since_utc is None or row_ts(row) >= since_utc)
+        ]
+        rows.sort(key=lambda row: row[0], reverse=True)
+        rows = rows[:limit]
+    return json_response([row_to_dict(r) for r in rows])
 
 
-def fetch_many(limit: int, robot_id: Optional[str] = None) -> List[Sequence[Any]]:
-    if DB_URL:
-        conn = psycopg2.connect(DB_URL)
-        try:
-            cur = conn.cursor()
-            if robot_id:
-                cur.execute(
-                    "SELECT id, ts, data, robot_id, position_lat, position_lng, position_alt, environment, status "
-                    "FROM telemetry WHERE robot_id = %s ORDER BY id DESC LIMIT %s",
-                    (robot_id, limit),
-                )
-            else:
-                cur.execute(
-                    "SELECT id, ts, data, robot_id, position_lat, position_lng, position_alt, environment, status "
-                    "FROM telemetry ORDER BY id DESC LIMIT %s",
-                    (limit,),
-                )
-            return cur.fetchall()
-        finally:
-            cur.close()
-            conn.close()
-    else:
-        with sqlite3.connect(DB_PATH) as con:
-            cur = con.cursor()
-            if robot_id:
-                cur.execute(
-                    "SELECT id, ts, data, robot_id, position_lat, position_lng, position_alt, environment, status "
-                    "FROM telemetry WHERE robot_id = ? ORDER BY id DESC LIMIT ?",
-                    (robot_id, limit),
-                )
-            else:
-                cur.execute(
-                    "SELECT id, ts, data, robot_id, position_lat, position_lng, position_alt, environment, status "
-                    "FROM telemetry ORDER BY id DESC LIMIT ?",
-                    (limit,),
-                )
-            return cur.fetchall()
+def parse_bbox(raw: str) -> Tuple[float, float, float, float]:
+    try:
+        min_lng, min_lat, max_lng, max_lat = (float(v) for v in raw.split(","))
+    except ValueError:
+        raise HTTPException(status_code=422, detail="bbox debe ser min_lng,min_lat,max_lng,max_lat")
+    if not (-180 <= min_lng <= max_lng <= 180 and -90 <= min_lat <= max_lat <= 90):
+        raise HTTPException(
+            status_code=422,
+            detail="bbox fuera de rango o invertida (las cajas que cruzan el antimeridiano se piden en dos partes)",
+        )
+    return min_lng, min_lat, max_lng, max_lat
+
+
+def row_ts(row: Sequence[Any]) -> datetime:
+    """ts de una fila como datetime UTC con zona (SQLite/caché guardan texto ISO)."""
+    return aware_utc(datetime.fromisoformat(row[1]) if isinstance(row[1], str) else row[1])
+
+
+def bucket_start(ts: datetime, bucket: str) -> datetime:
+    """Inicio (UTC, con zona) del bucket que contiene ``ts``."""
+    ts = to_utc(ts) if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+    if bucket == "1h":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(second=0, microsecond=0)
+
+
+def parse_metric_filters(raw: Sequence[str]) -> List[Tuple[str, str, float]]:
+    filters: List[Tuple[str, str, float]] = []
+    for item in raw:
+        match = METRIC_FILTER_RE.match(item)
+        if not match:
+            raise HTTPException(status_code=422, detail=f"Filtro de métrica inválido: {item!r} (usa p.ej. TEMP>28)")
+        filters.append((match.group(1), match.group(2), float(match.group(3))))
+    return filters
 
 
 def build_position_from_data(data: Dict[str, Any]) -> Optional[Position]:
@@ -387,3 +3120,53 @@ def serialize_row(row: Sequence[Any]) -> TelemetryOut:
         environment=row[7],
         status=row[8],
     )
+
+
+def row_to_dict(row: Sequence[Any]) -> Dict[str, Any]:
+    """Fila de telemetry → dict con el esquema de TelemetryOut, sin pydantic.
+
+    Es el camino rápido de /query, /live y el streaming: el ts de SQLite ya es
+    ISO 8601 y se copia tal cual, y ``data`` se decodifica con orjson si está.
+    """
+    tsval = row[1]
+    payload = loads(row[2]) if isinstance(row[2], (str, bytes)) else row[2]
+    position = None
+    if row[4] is not None and row[5] is not None:
+        position = {
+            "lat": float(row[4]),
+            "lng": float(row[5]),
+            "alt": float(row[6]) if row[6] is not None else None,
+        }
+    return {
+        "id": row[0],
+        "ts": tsval if isinstance(tsval, str) else tsval.isoformat(),
+        "data": payload,
+        "robot_id": row[3] or "robot-unknown",
+        "position": position,
+        "environment": row[7],
+        "status": row[8],
+    }
+
+
+def loads(raw: Any) -> Any:
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            # Filas guardadas antes de rechazar NaN/Infinity: solo json las lee
+            pass
+    return json.loads(raw)
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def json_response(content: Any, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Respuesta JSON ya serializada; FastAPI no la re-valida con response_model."""
+    start = time.perf_counter()
+    body = dumps(content)
+    PROM.observe("tg_serialize_duration_seconds", time.perf_counter() - start)
+    return Response(content=body, media_type="application/json", headers=headers)
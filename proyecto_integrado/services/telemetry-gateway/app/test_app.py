@@ -1,6 +1,13 @@
+import asyncio
+import gzip
+import json
+import sqlite3
+import time
+import uuid
 from pathlib import Path
 import importlib.util
 
+import pytest
 from fastapi.testclient import TestClient
 
 _MAIN = Path(__file__).with_name("main.py")
@@ -65,3 +72,546 @@ def test_live_endpoint_groups_by_robot():
     payload = resp.json()
     assert payload["robots"]
     assert any(robot["robot_id"] == "robot-alpha" for robot in payload["robots"])
+
+
+def test_pool_reuses_connections_and_reports_stats():
+    for _ in range(5):
+        client.post("/api/telemetry/ingest", json=sample_payload())
+        client.get("/api/telemetry/last")
+    resp = client.get("/api/telemetry/pool")
+    assert resp.status_code == 200
+    stats = resp.json()
+    assert stats["in_use"] == 0
+    assert stats["acquired_total"] >= 10
+    assert stats["open_connections"] >= 1
+
+
+def test_ingest_batch_json_and_ndjson_keep_order():
+    batch = [sample_payload("robot-batch-%d" % i) for i in range(150)]
+    r = client.post("/api/telemetry/ingest/batch", json=batch)
+    assert r.status_code == 200
+    body = r.json()
+    assert body["count"] == 150
+    assert body["ids"] == sorted(body["ids"])
+    last_id = client.get("/api/telemetry/last", params={"robot_id": "robot-batch-149"}).json()["id"]
+    assert last_id == body["ids"][-1]
+
+    ndjson = "\n".join(json.dumps(sample_payload("robot-ndjson")) for _ in range(3))
+    r = client.post(
+        "/api/telemetry/ingest/batch",
+        content=ndjson,
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert r.status_code == 200
+    assert r.json()["count"] == 3
+
+
+def test_ingest_batch_rejects_whole_batch_on_invalid_item():
+    before = client.get("/api/telemetry/last").json()["id"]
+    r = client.post("/api/telemetry/ingest/batch", json=[sample_payload(), {"robot_id": "x"}])
+    assert r.status_code == 422
+    assert r.json()["detail"][0]["loc"][:2] == ["body", 1]
+    assert client.get("/api/telemetry/last").json()["id"] == before
+
+
+def test_write_behind_mode_queues_and_drains_on_shutdown():
+    wb = mod.WRITE_BEHIND
+    wb.enabled = True
+    try:
+        with TestClient(app) as wb_client:
+            for _ in range(5):
+                r = wb_client.post("/api/telemetry/ingest", json=sample_payload("robot-queued"))
+                assert r.status_code == 202
+            stats = wb_client.get("/api/telemetry/ingest/queue").json()
+            assert stats["running"] is True
+            assert stats["enqueued_total"] >= 5
+        # El shutdown vacía la cola antes de cerrar el pool
+        assert wb.stats()["flushed_rows_total"] >= 5
+        assert wb.stats()["queue_depth"] == 0
+    finally:
+        wb.enabled = False
+    latest = client.get("/api/telemetry/last", params={"robot_id": "robot-queued"})
+    assert latest.status_code == 200
+
+
+def test_query_keyset_pagination_and_time_range():
+    robot = f"robot-pages-{uuid.uuid4().hex[:8]}"
+    for _ in range(5):
+        client.post("/api/telemetry/ingest", json=sample_payload(robot))
+    seen = []
+    params = {"robot_id": robot, "limit": 2}
+    while True:
+        r = client.get("/api/telemetry/query", params=params)
+        assert r.status_code == 200
+        seen.extend(item["id"] for item in r.json())
+        cursor = r.headers.get("X-Next-Before-Id")
+        if not cursor:
+            break
+        params["before_id"] = cursor
+    assert len(seen) == 5
+    assert seen == sorted(seen, reverse=True)
+    cross = client.get("/api/telemetry/query", params={"robot_id": robot, "limit": 2}, headers={"Origin": "https://dash.example"})
+    assert "x-next-before-id" in cross.headers["access-control-expose-headers"].lower()
+
+    future = client.get(
+        "/api/telemetry/query",
+        params={"robot_id": robot, "since": "2999-01-01T00:00:00+00:00"},
+    )
+    assert future.json() == []
+    past = client.get(
+        "/api/telemetry/query",
+        params={"robot_id": robot, "until": "2999-01-01T00:00:00+00:00", "limit": 10},
+    )
+    assert len(past.json()) == 5
+
+
+def test_live_returns_every_robot_of_a_large_fleet():
+    prefix = f"robot-fleet-{uuid.uuid4().hex[:6]}"
+    fleet = [f"{prefix}-{i:02d}" for i in range(15)]
+    batch = [sample_payload(robot) for robot in fleet for _ in range(4)]
+    assert client.post("/api/telemetry/ingest/batch", json=batch).status_code == 200
+    resp = client.get("/api/telemetry/live", params={"limit_per_robot": 3})
+    assert resp.status_code == 200
+    trails = {r["robot_id"]: r for r in resp.json()["robots"]}
+    for robot in fleet:
+        assert len(trails[robot]["trail"]) == 3
+        ids = [p["id"] for p in trails[robot]["trail"]]
+        assert ids == sorted(ids)
+        assert trails[robot]["last"]["id"] == ids[-1]
+
+
+def test_live_store_serves_last_and_live_from_memory():
+    with TestClient(app) as cached_client:
+        assert mod.LIVE.ready
+        robot = f"robot-cache-{uuid.uuid4().hex[:6]}"
+        posted = [cached_client.post("/api/telemetry/ingest", json=sample_payload(robot)).json()["id"] for _ in range(3)]
+        hits = mod.LIVE.stats()["hits_total"]
+        latest = cached_client.get("/api/telemetry/last", params={"robot_id": robot})
+        assert latest.json()["id"] == posted[-1]
+        live = cached_client.get("/api/telemetry/live", params={"limit_per_robot": 2}).json()
+        trail = next(r for r in live["robots"] if r["robot_id"] == robot)["trail"]
+        assert [p["id"] for p in trail] == posted[-2:]
+        assert cached_client.get("/api/telemetry/cache").json()["hits_total"] >= hits + 2
+
+
+def test_live_store_caps_robots_and_trail_length():
+    store = mod.LiveStore(max_robots=2, trail_size=3, idle_seconds=0)
+    rows = [(i, "2025-01-01T00:00:00+00:00", "{}", f"robot-{i % 3}", None, None, None, None, None) for i in range(1, 10)]
+    store.add(rows)
+    trails = store.trails(10)
+    assert set(trails) == {"robot-2", "robot-0"}
+    assert [r[0] for r in trails["robot-2"]] == [8, 5, 2]
+    assert store.last(None)[0] == 9
+    assert store.stats()["evicted_total"] >= 1
+
+
+def test_live_store_warm_uses_reading_age_and_drops_purged_rows():
+    from datetime import datetime, timedelta, timezone
+
+    now = datetime.now(timezone.utc)
+
+    def row(i, robot, age):
+        return (i, (now - age).isoformat(), "{}", robot, None, None, None, None, None)
+
+    store = mod.LiveStore(max_robots=10, trail_size=5, idle_seconds=3600)
+    store.warm([
+        row(4, "robot-old", timedelta(days=3)),
+        row(6, "robot-new", timedelta(minutes=1)),
+        row(5, "robot-new", timedelta(days=2)),
+    ])
+    # Callado hace días: no reaparece en /live por reiniciar
+    assert set(store.trails(10)) == {"robot-new"}
+    assert store.last(None)[0] == 6
+
+    assert store.purge_before(now - timedelta(hours=1)) == 1
+    assert [r[0] for r in store.trails(10)["robot-new"]] == [6]
+    assert store.purge_before(now) == 1
+    assert store.trails(10) == {} and store.last(None) is None
+
+
+def test_live_store_keeps_trail_ordered_when_commits_arrive_out_of_order():
+    store = mod.LiveStore(max_robots=2, trail_size=3, idle_seconds=0)
+
+    def row(i):
+        return (i, "2025-01-01T00:00:00+00:00", "{}", "robot-x", None, None, None, None, None)
+
+    for i in (10, 12, 11, 9, 13, 8, 12):
+        store.add([row(i)])
+    assert [r[0] for r in store.trails(10)["robot-x"]] == [13, 12, 11]
+    assert store.last("robot-x")[0] == 13 and store.last(None)[0] == 13
+
+
+def test_websocket_stream_pushes_filtered_readings():
+    robot = f"robot-ws-{uuid.uuid4().hex[:6]}"
+    with TestClient(app) as ws_client:
+        with ws_client.websocket_connect(f"/api/telemetry/ws?robot_id={robot}") as ws:
+            assert ws_client.get("/api/telemetry/stream/stats").json()["connected_clients"] == 1
+            ws_client.post("/api/telemetry/ingest", json=sample_payload("robot-other"))
+            posted = ws_client.post("/api/telemetry/ingest", json=sample_payload(robot)).json()
+            message = ws.receive_json()
+            assert message["robot_id"] == robot
+            assert message["id"] == posted["id"]
+    assert mod.STREAM.stats()["connected_clients"] == 0
+
+
+def test_sse_events_format_and_slow_consumer_drop():
+    async def scenario():
+        sub = mod.STREAM.subscribe(None)
+        row = (7, "2025-01-01T00:00:00+00:00", '{"TEMP": 1}', "robot-sse", None, None, None, None, None)
+        for _ in range(mod.STREAM.client_queue + 2):
+            mod.STREAM.publish([row])
+        assert sub.dropped == 2
+
+        async def connected() -> bool:
+            return False
+
+        events = mod.sse_events(sub, connected)
+        assert await events.__anext__() == "retry: 3000\n\n"
+        event = await events.__anext__()
+        await events.aclose()
+        return event
+
+    event = asyncio.run(scenario())
+    assert event.startswith("id: 7\nevent: telemetry\ndata: {")
+    assert '"robot_id":"robot-sse"' in event
+    assert mod.STREAM.stats()["connected_clients"] == 0
+
+
+def test_aggregate_rollups_by_minute_and_hour():
+    robot = f"robot-agg-{uuid.uuid4().hex[:6]}"
+    readings = []
+    for ts, temp in (("2025-03-01T10:00:05+00:00", 10.0), ("2025-03-01T10:00:40+00:00", 30.0),
+                     ("2025-03-01T10:01:10+00:00", 20.0), ("2025-03-01T11:15:00+00:00", 5.0)):
+        item = sample_payload(robot)
+        item["ts"] = ts
+        item["data"]["TEMP"] = temp
+        readings.append(item)
+    assert client.post("/api/telemetry/ingest/batch", json=readings[:2]).status_code == 200
+    for item in readings[2:]:
+        assert client.post("/api/telemetry/ingest", json=item).status_code == 200
+
+    minutes = client.get("/api/telemetry/aggregate", params={"robot_id": robot, "metric": "TEMP", "bucket": "1m"}).json()
+    assert [(m["count"], m["min"], m["max"], m["avg"]) for m in minutes] == [
+        (2, 10.0, 30.0, 20.0), (1, 20.0, 20.0, 20.0), (1, 5.0, 5.0, 5.0)
+    ]
+    hours = client.get(
+        "/api/telemetry/aggregate",
+        params={"robot_id": robot, "metric": "TEMP", "bucket": "1h", "until": "2025-03-01T11:00:00+00:00"},
+    ).json()
+    assert len(hours) == 1
+    assert hours[0]["count"] == 3
+    assert hours[0]["bucket_start"].startswith("2025-03-01T10:00:00")
+
+
+def test_retention_archives_then_purges_expired_rows(tmp_path):
+    robot = f"robot-old-{uuid.uuid4().hex[:6]}"
+    old = []
+    for minute in range(3):
+        item = sample_payload(robot)
+        item["ts"] = f"2000-01-01T00:0{minute}:00+00:00"
+        old.append(item)
+    client.post("/api/telemetry/ingest/batch", json=old)
+    client.post("/api/telemetry/ingest", json=sample_payload(robot))
+
+    worker = mod.RetentionWorker(
+        raw_days=365 * 20,
+        rollup_days={"1m": 365 * 20, "1h": 0},
+        interval=3600,
+        chunk=2,
+        pause=0,
+        archive_dir=str(tmp_path),
+    )
+    writes = mod.DB.writes_total
+    purged = asyncio.run(worker.run_once())
+    assert mod.DB.writes_total - writes >= 4  # cada lote pasa por el escritor de DB
+    assert purged["raw"] >= 3
+    assert purged["rollups"] >= 6  # TEMP/HUM/LAT/LON × 3 minutos
+    remaining = client.get("/api/telemetry/query", params={"robot_id": robot}).json()
+    assert len(remaining) == 1
+    with gzip.open(tmp_path / "telemetry-2000-01-01.ndjson.gz", "rt", encoding="utf-8") as fh:
+        archived = [json.loads(line) for line in fh if robot in line]
+    assert len(archived) == 3
+    assert worker.stats()["archived_total"] >= 3
+
+
+def _ingest_temps(robot, temps):
+    batch = []
+    for temp in temps:
+        item = sample_payload(robot)
+        item["data"]["TEMP"] = temp
+        item["data"]["MODE"] = "auto"
+        batch.append(item)
+    assert client.post("/api/telemetry/ingest/batch", json=batch).status_code == 200
+
+
+def test_query_metric_threshold_filters_json_storage():
+    robot = f"robot-thr-{uuid.uuid4().hex[:6]}"
+    _ingest_temps(robot, [20.0, 28.0, 29.5, 35.0])
+    r = client.get("/api/telemetry/query", params=[("robot_id", robot), ("metric", "TEMP>28"), ("metric", "TEMP<35")])
+    assert r.status_code == 200
+    assert [item["data"]["TEMP"] for item in r.json()] == [29.5]
+    assert client.get("/api/telemetry/query", params={"metric": "TEMP>>1"}).status_code == 422
+
+
+def test_query_metric_threshold_filters_narrow_storage(monkeypatch):
+    monkeypatch.setattr(mod, "METRICS_STORAGE", "narrow")
+    mod.init_db()
+    robot = f"robot-narrow-{uuid.uuid4().hex[:6]}"
+    _ingest_temps(robot, [20.0, 28.0, 29.5, 35.0])
+    r = client.get("/api/telemetry/query", params={"robot_id": robot, "metric": "TEMP>=28"})
+    assert sorted(item["data"]["TEMP"] for item in r.json()) == [28.0, 29.5, 35.0]
+    assert r.json()[0]["data"]["MODE"] == "auto"
+
+
+def test_fast_serialization_matches_schema():
+    rows = [
+        (i, "2025-01-01T00:00:%02d+00:00" % (i % 60), json.dumps({"TEMP": 20.0 + i % 7, "HUM": 40.0, "MODE": "auto"}),
+         f"robot-{i % 25}", 19.43, -99.13, None if i % 2 else 2240.0, "lab", "idle")
+        for i in range(1, 1001)
+    ]
+    adapter = mod.TypeAdapter(list[mod.TelemetryOut])
+
+    def model_path() -> bytes:
+        return adapter.dump_json(adapter.validate_python([mod.serialize_row(r) for r in rows]))
+
+    def fast_path() -> bytes:
+        return mod.dumps([mod.row_to_dict(r) for r in rows])
+
+    slow, fast = json.loads(model_path()), json.loads(fast_path())
+    for a, b in zip(slow, fast):
+        assert mod.datetime.fromisoformat(a.pop("ts").replace("Z", "+00:00")) == mod.datetime.fromisoformat(b.pop("ts"))
+        assert a == b
+
+
+def test_async_db_mode_uses_dedicated_executors(monkeypatch):
+    monkeypatch.setattr(mod.DB, "mode", "async")
+    try:
+        robot = f"robot-async-{uuid.uuid4().hex[:6]}"
+        posted = client.post("/api/telemetry/ingest", json=sample_payload(robot)).json()
+        assert client.get("/api/telemetry/query", params={"robot_id": robot}).json()[0]["id"] == posted["id"]
+        executor = client.get("/api/telemetry/pool").json()["executor"]
+        assert executor["mode"] == "async"
+        assert executor["writers"] == 1 or executor["writers"] == executor["readers"]
+    finally:
+        mod.DB.close()
+
+
+@pytest.mark.parametrize("engine", ["sqlite", "memory"])
+def test_store_engines_share_the_same_contract(engine):
+    store = mod.SQLiteStore(mod.POOL) if engine == "sqlite" else mod.MemoryStore()
+    store.init()
+    robot = f"robot-{engine}-{uuid.uuid4().hex[:6]}"
+    values = []
+    for minute, temp in enumerate((20.0, 28.0, 29.5)):
+        item = sample_payload(robot)
+        item["ts"] = f"2001-01-01T00:0{minute}:00+00:00"
+        item["data"]["TEMP"] = temp
+        values.append(mod.prepare_insert(mod.TelemetryIn(**item)))
+
+    ids = store.insert_many(values[:2])
+    row = store.insert_one(values[2])
+    assert ids == sorted(ids) and row[0] > ids[-1]
+    assert store.fetch_one(robot)[0] == row[0]
+    hot = store.fetch_many(limit=10, robot_id=robot, metrics=[("TEMP", ">", 25.0)])
+    assert [r[0] for r in hot] == [row[0], ids[1]]
+    assert [r[0] for r in store.fetch_many(limit=10, robot_id=robot, before_id=row[0])] == ids[::-1]
+    latest = [r for r in store.fetch_latest_per_robot(2) if r[3] == robot]
+    assert [r[0] for r in latest] == [row[0], ids[1]]
+    lat, lng = values[0][3], values[0][4]
+    box = (lng - 0.001, lat - 0.001, lng + 0.001, lat + 0.001)
+    assert {row[0], *ids} <= {r[0] for r in store.fetch_area(box, None, 1000)}
+    assert not [r for r in store.fetch_area((10.0, 10.0, 10.5, 10.5), None, 10) if r[3] == robot]
+    minutes = store.fetch_rollups(robot, "TEMP", "1m", None, None, 10)
+    assert [(r[1], r[2], r[3]) for r in minutes] == [(1, 20.0, 20.0), (1, 28.0, 28.0), (1, 29.5, 29.5)]
+
+    cutoff = mod.datetime(2001, 1, 1, 0, 1, tzinfo=mod.timezone.utc)
+    archived = []
+    while store.purge_raw(cutoff, 100, archived.extend):
+        pass
+    assert robot in {r[3] for r in archived}
+    assert [r[0] for r in store.fetch_many(limit=10, robot_id=robot)] == [row[0], ids[1]]
+
+
+def test_sqlite_single_ingest_runs_one_insert_and_one_rollup_upsert():
+    pool = mod.ConnectionPool(size=1, timeout=1)
+    store = mod.SQLiteStore(pool)
+    statements = []
+    try:
+        with pool.connection() as conn:
+            conn.set_trace_callback(statements.append)
+        values = mod.prepare_insert(mod.TelemetryIn(**sample_payload(f"robot-one-{uuid.uuid4().hex[:6]}")))
+        row = store.insert_one(values)
+        assert tuple(row) == tuple(store.fetch_one(values[2]))
+    finally:
+        pool.close()
+    writes = [s for s in statements if s.lstrip().upper().startswith(("INSERT", "SELECT"))]
+    assert len(writes) == 3  # INSERT telemetry, UPSERT rollups, SELECT de la verificación
+    assert writes[0].startswith("INSERT INTO telemetry(") and "telemetry_rollup" in writes[1]
+
+
+def test_binary_frames_on_ingest_batch_and_websocket():
+    robot = f"robot-bin-{uuid.uuid4().hex[:6]}"
+    item = sample_payload(robot)
+    item.update(ts="2025-04-01T12:00:00+00:00", status="ok")
+    item["position"]["alt"] = 2240.5
+    frame = mod.encode_frame(item)
+    assert len(frame) < len(json.dumps(item)) / 2
+    headers = {"content-type": mod.BINARY_CONTENT_TYPE}
+
+    one = client.post("/api/telemetry/ingest", content=frame, headers=headers)
+    assert one.status_code == 200, one.text
+    body = one.json()
+    assert body["data"] == item["data"] and body["position"] == item["position"]
+    assert body["status"] == "ok" and body["ts"].startswith("2025-04-01T12:00:00")
+
+    batch = client.post("/api/telemetry/ingest/batch", content=frame * 3, headers=headers)
+    assert batch.json()["count"] == 3
+    assert client.post("/api/telemetry/ingest/batch", content=frame[:-3], headers=headers).status_code == 400
+
+    with client.websocket_connect("/api/telemetry/ws/ingest") as ws:
+        ws.send_bytes(frame + frame)
+        assert ws.receive_json()["count"] == 2
+        ws.send_text(json.dumps(sample_payload(robot)))
+        assert ws.receive_json()["count"] == 1
+        ws.send_bytes(b"\x09\x00")
+        assert "error" in ws.receive_json()
+    assert len(client.get("/api/telemetry/query", params={"robot_id": robot}).json()) == 7
+
+
+def test_binary_frames_reject_non_finite_values():
+    robot = f"robot-binnan-{uuid.uuid4().hex[:6]}"
+    headers = {"content-type": mod.BINARY_CONTENT_TYPE}
+    good = mod.encode_frame(sample_payload(robot))
+    inf_metric = sample_payload(robot)
+    inf_metric["data"] = {"TEMP": float("inf")}
+    nan_position = sample_payload(robot)
+    nan_position["position"] = {"lat": float("nan"), "lng": -99.1}
+    for bad in (mod.encode_frame(inf_metric), mod.encode_frame(nan_position)):
+        r = client.post("/api/telemetry/ingest/batch", content=good + bad, headers=headers)
+        assert r.status_code == 400 and "no finito" in r.json()["detail"]
+        assert client.post("/api/telemetry/ingest", content=bad, headers=headers).status_code == 400
+    with client.websocket_connect("/api/telemetry/ws/ingest") as ws:
+        ws.send_bytes(mod.encode_frame(inf_metric))
+        assert "no finito" in ws.receive_json()["error"]
+    assert client.get("/api/telemetry/query", params={"robot_id": robot}).json() == []
+    json_nan = '{"robot_id": "%s", "data": {}, "position": {"lat": NaN, "lng": 1}}' % robot
+    r = client.post("/api/telemetry/ingest", content=json_nan, headers={"content-type": "application/json"})
+    assert r.status_code == 422
+
+
+def test_compression_negotiates_gzip_and_decodes_gzip_request_bodies():
+    robot = f"robot-gz-{uuid.uuid4().hex[:6]}"
+    batch = json.dumps([sample_payload(robot) for _ in range(50)]).encode()
+    r = client.post(
+        "/api/telemetry/ingest/batch",
+        content=gzip.compress(batch),
+        headers={"content-type": "application/json", "content-encoding": "gzip"},
+    )
+    assert r.status_code == 200 and r.json()["count"] == 50
+    bad = client.post("/api/telemetry/ingest/batch", content=batch, headers={"content-encoding": "br"})
+    assert bad.status_code == 415
+
+    params = {"robot_id": robot, "limit": 50}
+    compressed = client.get("/api/telemetry/query", params=params, headers={"accept-encoding": "gzip"})
+    plain = client.get("/api/telemetry/query", params=params, headers={"accept-encoding": "identity"})
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert "content-encoding" not in plain.headers
+    assert compressed.json() == plain.json()
+    assert int(compressed.headers["content-length"]) < len(plain.content) / 4
+    assert "content-encoding" not in client.get("/healthz", headers={"accept-encoding": "gzip"}).headers
+
+
+def test_area_returns_latest_positions_and_readings_inside_bbox():
+    tag = uuid.uuid4().hex[:6]
+    inside, outside = f"robot-in-{tag}", f"robot-out-{tag}"
+    readings = []
+    for robot, lat, lng in ((inside, -33.45, -70.66), (inside, -33.46, -70.65), (outside, -33.45, -71.60)):
+        item = sample_payload(robot)
+        item["position"] = {"lat": lat, "lng": lng}
+        readings.append(item)
+    assert client.post("/api/telemetry/ingest/batch", json=readings).status_code == 200
+    bbox = "-70.70,-33.50,-70.60,-33.40"
+
+    latest = client.get("/api/telemetry/area", params={"bbox": bbox}).json()
+    assert [r["position"]["lat"] for r in latest if r["robot_id"] in (inside, outside)] == [-33.46]
+    history = client.get("/api/telemetry/area", params={"bbox": bbox, "mode": "readings"}).json()
+    assert [r["robot_id"] for r in history if r["robot_id"] in (inside, outside)] == [inside, inside]
+    assert client.get("/api/telemetry/area", params={"bbox": "10,5,0,0"}).status_code == 422
+
+
+def test_metrics_exposes_routes_db_timings_and_rows_per_robot():
+    robot = f"robot-prom-{uuid.uuid4().hex[:6]}"
+    assert client.post("/api/telemetry/ingest", json=sample_payload(robot)).status_code == 200
+    assert client.get("/api/telemetry/query", params={"robot_id": robot}).status_code == 200
+    r = client.get("/metrics", headers={"accept-encoding": "identity"})
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/plain")
+    lines = r.text.splitlines()
+    assert 'tg_http_requests_total{method="POST",route="/api/telemetry/ingest",status="200"}' in "\n".join(lines)
+    assert any(l.startswith('tg_http_request_duration_seconds_bucket{method="GET",route="/api/telemetry/query",le="+Inf"}') for l in lines)
+    assert any(l.startswith('tg_db_query_duration_seconds_count{operation="fetch_many"}') for l in lines)
+    assert f'tg_rows_ingested_total{{robot_id="{robot}"}} 1' in lines
+    assert "tg_http_requests_in_flight 1" in lines
+
+    client.get(f"/api/telemetry/nope/{robot}")
+    assert f"/api/telemetry/nope/{robot}" not in client.get("/metrics").text
+
+
+def test_key_registry_authenticates_binds_robots_and_rate_limits(monkeypatch, tmp_path):
+    robot = f"robot-key-{uuid.uuid4().hex[:6]}"
+    keys_file = tmp_path / "keys.json"
+    keys_file.write_text(json.dumps([{"key": "robot-secret", "robot_id": robot, "rate": 1, "burst": 2}]))
+    croody = tmp_path / "croody.db"
+    with sqlite3.connect(croody) as conn:
+        conn.execute("CREATE TABLE landing_userprofile (user_id INTEGER, ingest_token TEXT)")
+        conn.execute("INSERT INTO landing_userprofile VALUES (7, 'user-secret')")
+    registry = mod.KeyRegistry(
+        shared_token="shared", keys_file=str(keys_file), keys_db=str(croody),
+        db_query=mod.KEYS_DB_QUERY, refresh=60, rate=0, burst=0,
+    )
+    assert registry.load() == 2
+    monkeypatch.setattr(mod, "KEYS", registry)
+
+    def post(key, robot_id=robot):
+        return client.post("/api/telemetry/ingest", json=sample_payload(robot_id), headers={"x-api-key": key} if key else {})
+
+    assert post(None).status_code == 401
+    assert post("nope").status_code == 401
+    assert post("shared", "robot-any").status_code == 200
+    assert post("user-secret", "robot-any").status_code == 200
+    assert post("robot-secret", "robot-other").status_code == 403
+    assert [post("robot-secret").status_code for _ in range(3)] == [200, 200, 429]
+    assert client.get("/api/telemetry/keys").json()["rate_limited_total"] == 1
+
+
+def test_openapi_documents_ingest_body_for_json_and_binary_frames():
+    body = client.get("/openapi.json").json()["paths"]["/api/telemetry/ingest"]["post"]["requestBody"]
+    schema = body["content"]["application/json"]["schema"]
+    assert "robot_id" in schema["required"] and "$ref" not in json.dumps(schema)
+    assert body["content"][mod.BINARY_CONTENT_TYPE]["schema"]["format"] == "binary"
+    batch = client.get("/openapi.json").json()["paths"]["/api/telemetry/ingest/batch"]["post"]["requestBody"]["content"]
+    assert set(batch) == {"application/json", "application/x-ndjson", mod.BINARY_CONTENT_TYPE}
+    assert batch["application/json"]["schema"]["items"]["required"] == schema["required"]
+    assert client.post("/api/telemetry/ingest/batch", json=[]).status_code == 400
+
+
+def test_ingest_rejects_non_finite_metrics_and_reads_legacy_rows():
+    robot = f"robot-nan-{uuid.uuid4().hex[:6]}"
+    body = '{"robot_id": "%s", "data": {"TEMP": Infinity, "HUM": 40}}' % robot
+    r = client.post("/api/telemetry/ingest", content=body, headers={"Content-Type": "application/json"})
+    assert r.status_code == 422 and "NaN" in r.json()["detail"]
+
+    # Filas con NaN guardadas antes del rechazo siguen siendo legibles
+    legacy = ("2025-01-01T00:00:00+00:00", '{"TEMP": NaN, "HUM": 40}', robot, None, None, None, None, None)
+    mod.STORE.insert_one(legacy)
+    rows = client.get("/api/telemetry/query", params={"robot_id": robot}).json()
+    assert len(rows) == 1 and rows[0]["data"]["HUM"] == 40
+
+
+def test_incomplete_store_fails_at_instantiation():
+    class HalfSqlStore(mod.SqlTelemetryStore):
+        def latest_join(self) -> str:
+            return ""
+
+    with pytest.raises(TypeError, match="insert_rows"):
+        HalfSqlStore(None)
+    assert not mod.MemoryStore.__abstractmethods__ and not mod.SQLiteStore.__abstractmethods__
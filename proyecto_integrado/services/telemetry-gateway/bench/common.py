@@ -0,0 +1,31 @@
+"""
+Utilidades compartidas por los benchmarks de bench/: cargar una versión de
+app/main.py contra una base temporal y percentiles de latencia.
+"""
+from __future__ import annotations
+
+import importlib.util
+import os
+from pathlib import Path
+from typing import Any, List
+
+DEFAULT_MAIN = Path(__file__).resolve().parent.parent / "app" / "main.py"
+
+
+def load_app(main_path: Path, db_path: str, store: str = "") -> Any:
+    """Importa ``main_path`` con TG_DB_PATH/TG_STORE apuntando a la base del benchmark."""
+    os.environ["TG_DB_PATH"] = db_path
+    os.environ["TG_STORE"] = store
+    if store != "postgres":
+        os.environ.pop("TG_DB_URL", None)
+    spec = importlib.util.spec_from_file_location("tg_bench_main", main_path)
+    mod = importlib.util.module_from_spec(spec)  # type: ignore
+    assert spec and spec.loader
+    spec.loader.exec_module(mod)  # type: ignore
+    mod.init_db()
+    return mod
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
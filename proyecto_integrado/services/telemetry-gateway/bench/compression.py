@@ -0,0 +1,79 @@
+"""
+Benchmark de compresión del Telemetry Gateway con cargas de 1000 filas:
+tamaño en el cable y latencia de GET /api/telemetry/query?limit=1000 y de
+POST /api/telemetry/ingest/batch con cada Content-Encoding.
+
+  python3 bench/compression.py
+  TG_GZIP_LEVEL=1 python3 bench/compression.py
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from common import DEFAULT_MAIN, load_app
+
+
+def reading(i: int) -> dict:
+    return {
+        "robot_id": f"robot-{i % 24:03d}",
+        "data": {"TEMP": 20.0 + i % 10, "HUM": 40.0 + i % 7, "BATT": 90.0 - i % 30, "MODE": "auto"},
+        "position": {"lat": 19.4326 + i * 1e-5, "lng": -99.1332},
+        "status": "ok",
+    }
+
+
+def timed(fn, rounds: int) -> float:
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--main", type=Path, default=DEFAULT_MAIN, help="main.py a medir")
+    ap.add_argument("--rows", type=int, default=1000)
+    ap.add_argument("--rounds", type=int, default=20)
+    args = ap.parse_args()
+
+    from fastapi.testclient import TestClient
+
+    with tempfile.TemporaryDirectory() as tmp:
+        mod = load_app(args.main, os.path.join(tmp, "telemetry.db"))
+        batch = json.dumps([reading(i) for i in range(args.rows)]).encode()
+        with TestClient(mod.app) as client:
+            bodies = {"identity": (batch, {}), "gzip": (gzip.compress(batch, 6), {"content-encoding": "gzip"})}
+            for coding, (body, extra) in bodies.items():
+                headers = {"content-type": "application/json", **extra}
+                ms = timed(lambda: client.post("/api/telemetry/ingest/batch", content=body, headers=headers), args.rounds)
+                print(f"POST /ingest/batch {args.rows} filas [{coding:8}] {len(body):>9,} bytes  p50 {ms:6.1f} ms")
+            codings = ["identity", "gzip"] + (["zstd"] if getattr(mod, "zstandard", None) else [])
+            for coding in codings:
+                r = client.get(
+                    "/api/telemetry/query", params={"limit": args.rows}, headers={"accept-encoding": coding}
+                )
+                wire = r.num_bytes_downloaded
+                ms = timed(
+                    lambda: client.get(
+                        "/api/telemetry/query", params={"limit": args.rows}, headers={"accept-encoding": coding}
+                    ),
+                    args.rounds,
+                )
+                print(f"GET /query limit={args.rows} [{coding:8}] {wire:>9,} bytes  p50 {ms:6.1f} ms")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -0,0 +1,87 @@
+"""
+Prueba de carga del Telemetry Gateway con muchos clientes concurrentes: lanza
+--clients corrutinas contra la app (ASGI en proceso) mezclando ingest, last,
+query y live, y reporta p50/p95/p99 por modo de acceso a la BD (TG_DB_MODE).
+
+  python3 bench/concurrency.py --clients 500 --modes threadpool async
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from common import DEFAULT_MAIN, load_app, percentile
+
+
+async def drive(mod, clients: int, rounds: int, robots: int) -> Dict[str, List[float]]:
+    import httpx
+
+    latencies: Dict[str, List[float]] = {"ingest": [], "last": [], "query": [], "live": []}
+    await mod.startup()
+    try:
+        transport = httpx.ASGITransport(app=mod.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+
+            async def client_loop(n: int) -> None:
+                robot = f"robot-{n % robots:03d}"
+                for i in range(rounds):
+                    calls = (
+                        ("ingest", http.post(
+                            "/api/telemetry/ingest",
+                            json={"robot_id": robot, "data": {"TEMP": 20.0 + i % 10, "HUM": 40.0}},
+                        )),
+                        ("last", http.get("/api/telemetry/last", params={"robot_id": robot})),
+                        ("query", http.get("/api/telemetry/query", params={"robot_id": robot, "limit": 50})),
+                        ("live", http.get("/api/telemetry/live", params={"limit_per_robot": 5})),
+                    )
+                    for name, call in calls:
+                        start = time.perf_counter()
+                        r = await call
+                        latencies[name].append(time.perf_counter() - start)
+                        assert r.status_code in (200, 202), r.text
+
+            await asyncio.gather(*(client_loop(n) for n in range(clients)))
+    finally:
+        await mod.shutdown()
+    return latencies
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--main", type=Path, default=DEFAULT_MAIN, help="main.py a medir")
+    ap.add_argument("--clients", type=int, default=500)
+    ap.add_argument("--rounds", type=int, default=4, help="Ciclos ingest/last/query/live por cliente")
+    ap.add_argument("--robots", type=int, default=50)
+    ap.add_argument("--modes", nargs="+", default=["threadpool", "async"])
+    ap.add_argument("--store", default="", help="Motor: sqlite, memory, postgres")
+    args = ap.parse_args()
+
+    for mode in args.modes:
+        os.environ["TG_DB_MODE"] = mode
+        with tempfile.TemporaryDirectory() as tmp:
+            mod = load_app(args.main, os.path.join(tmp, "telemetry.db"), args.store)
+            start = time.perf_counter()
+            latencies = asyncio.run(drive(mod, args.clients, args.rounds, args.robots))
+            elapsed = time.perf_counter() - start
+        total = sum(len(v) for v in latencies.values())
+        print(f"[{mode}] {args.clients} clientes, {total} requests en {elapsed:.2f}s ({total / elapsed:,.0f} req/s)")
+        for name, values in latencies.items():
+            ms = [v * 1000 for v in values]
+            print(
+                f"  {name:<6} p50={statistics.median(ms):7.1f} ms  "
+                f"p95={percentile(ms, 95):7.1f} ms  p99={percentile(ms, 99):7.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -0,0 +1,61 @@
+"""
+Benchmark de ingesta de una lectura por request: mide lecturas/seg de
+insert_one directamente contra el store y de POST /api/telemetry/ingest por
+HTTP (un solo cliente, para aislar el coste por sentencia).
+
+  git show <rev>:proyecto_integrado/services/telemetry-gateway/app/main.py > /tmp/main_old.py
+  python3 bench/ingest.py --main /tmp/main_old.py
+  python3 bench/ingest.py
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from common import DEFAULT_MAIN, load_app
+
+
+def payload(i: int, robots: int) -> dict:
+    return {
+        "robot_id": f"robot-{i % robots:03d}",
+        "data": {"TEMP": 20.0 + i % 10, "HUM": 40.0, "LAT": 19.43, "LON": -99.13},
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--main", type=Path, default=DEFAULT_MAIN, help="main.py a medir")
+    ap.add_argument("--readings", type=int, default=5000)
+    ap.add_argument("--robots", type=int, default=24)
+    ap.add_argument("--store", default="", help="Motor: sqlite, memory, postgres")
+    args = ap.parse_args()
+
+    from fastapi.testclient import TestClient
+
+    with tempfile.TemporaryDirectory() as tmp:
+        mod = load_app(args.main, os.path.join(tmp, "telemetry.db"), args.store)
+        values = [mod.prepare_insert(mod.TelemetryIn(**payload(i, args.robots))) for i in range(args.readings)]
+        insert = mod.STORE.insert_one if hasattr(mod, "STORE") else mod.insert_one
+        start = time.perf_counter()
+        for v in values:
+            insert(v)
+        direct = args.readings / (time.perf_counter() - start)
+
+        with TestClient(mod.app) as client:
+            start = time.perf_counter()
+            for i in range(args.readings):
+                r = client.post("/api/telemetry/ingest", json=payload(i, args.robots))
+                assert r.status_code == 200, r.text
+            http = args.readings / (time.perf_counter() - start)
+    print(f"{args.main}: insert_one {direct:,.0f} lecturas/s, POST /ingest {http:,.0f} lecturas/s")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -0,0 +1,74 @@
+"""
+Benchmark de GET /api/telemetry/live con una flota grande: siembra una base
+SQLite temporal con --robots robots × --rows lecturas cada uno y mide la
+latencia del endpoint y cuántos robots devuelve.
+
+  git show <rev>:proyecto_integrado/services/telemetry-gateway/app/main.py > /tmp/main_old.py
+  python3 bench/live.py --main /tmp/main_old.py
+  python3 bench/live.py
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from common import DEFAULT_MAIN, load_app
+
+
+def seed(db_path: str, robots: int, rows: int) -> None:
+    con = sqlite3.connect(db_path)
+    try:
+        con.executemany(
+            "INSERT INTO telemetry(ts, data, robot_id, position_lat, position_lng) VALUES (?, ?, ?, ?, ?)",
+            (
+                (f"2025-01-01T00:{i // robots // 60 % 60:02d}:{i // robots % 60:02d}+00:00",
+                 '{"TEMP": 21.5, "HUM": 40.0}', f"robot-{i % robots:04d}", 19.43, -99.13)
+                for i in range(robots * rows)
+            ),
+        )
+        con.commit()
+    finally:
+        con.close()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--main", type=Path, default=DEFAULT_MAIN, help="main.py a medir")
+    ap.add_argument("--robots", type=int, default=1000)
+    ap.add_argument("--rows", type=int, default=100, help="Lecturas por robot")
+    ap.add_argument("--limit-per-robot", type=int, default=10)
+    ap.add_argument("--iterations", type=int, default=10)
+    args = ap.parse_args()
+
+    from fastapi.testclient import TestClient
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "telemetry.db")
+        mod = load_app(args.main, db_path)
+        seed(db_path, args.robots, args.rows)
+        with TestClient(mod.app) as client:
+            timings = []
+            for _ in range(args.iterations):
+                start = time.perf_counter()
+                r = client.get("/api/telemetry/live", params={"limit_per_robot": args.limit_per_robot})
+                timings.append((time.perf_counter() - start) * 1000.0)
+                assert r.status_code == 200, r.text
+            body = r.json()
+        print(
+            f"{args.main}: {len(body['robots'])}/{args.robots} robots, {body['total_points']} puntos, "
+            f"p50={statistics.median(timings):.1f} ms max={max(timings):.1f} ms "
+            f"({args.robots * args.rows} filas)"
+        )
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(130)
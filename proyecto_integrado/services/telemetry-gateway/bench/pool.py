@@ -0,0 +1,72 @@
+"""
+Benchmark de conexiones del Telemetry Gateway: mide requests/seg de ingest y
+last con N clientes concurrentes contra una base SQLite temporal.
+
+Para comparar antes/después se puede apuntar a otra versión de main.py:
+
+  git show <rev>:proyecto_integrado/services/telemetry-gateway/app/main.py > /tmp/main_old.py
+  python3 bench/pool.py --main /tmp/main_old.py
+  python3 bench/pool.py
+
+--store elige el motor (sqlite, memory; postgres con TG_DB_URL) para correr la
+misma carga contra cada uno.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from common import DEFAULT_MAIN, load_app
+
+
+def run(client, requests: int, concurrency: int, robots: int) -> float:
+    def one(i: int) -> None:
+        robot = f"robot-{i % robots:03d}"
+        r = client.post(
+            "/api/telemetry/ingest",
+            json={"robot_id": robot, "data": {"TEMP": 20.0 + i % 10, "HUM": 40.0}},
+        )
+        assert r.status_code == 200, r.text
+        r = client.get("/api/telemetry/last", params={"robot_id": robot})
+        assert r.status_code == 200, r.text
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+    return (requests * 2) / elapsed
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--main", type=Path, default=DEFAULT_MAIN, help="main.py a medir")
+    ap.add_argument("--requests", type=int, default=2000, help="Pares ingest+last a ejecutar")
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--robots", type=int, default=24)
+    ap.add_argument("--store", nargs="+", default=[""], help="Motores a medir: sqlite, memory, postgres")
+    args = ap.parse_args()
+
+    from fastapi.testclient import TestClient
+
+    for store in args.store:
+        with tempfile.TemporaryDirectory() as tmp:
+            mod = load_app(args.main, os.path.join(tmp, "telemetry.db"), store)
+            with TestClient(mod.app) as client:
+                run(client, min(100, args.requests), args.concurrency, args.robots)  # warm-up
+                rps = run(client, args.requests, args.concurrency, args.robots)
+                label = f"{args.main} [{getattr(mod, 'STORE_ENGINE', store or 'default')}]"
+                print(f"{label}: {rps:,.0f} req/s ({args.requests * 2} requests, concurrency={args.concurrency})")
+                if hasattr(mod, "POOL"):
+                    print("pool:", mod.POOL.stats())
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -0,0 +1,51 @@
+"""
+Benchmark de serialización de respuestas: filas/seg del camino pydantic
+(serialize_row + TypeAdapter(list[TelemetryOut])) frente al rápido
+(row_to_dict + dumps) con las mismas filas.
+
+  python3 bench/serialization.py --rows 1000 --rounds 20
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from common import DEFAULT_MAIN, load_app
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--main", type=Path, default=DEFAULT_MAIN, help="main.py a medir")
+    ap.add_argument("--rows", type=int, default=1000)
+    ap.add_argument("--rounds", type=int, default=20)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        mod = load_app(args.main, str(Path(tmp) / "telemetry.db"), "memory")
+    rows = [
+        (i, "2025-01-01T00:00:%02d+00:00" % (i % 60), json.dumps({"TEMP": 20.0 + i % 7, "HUM": 40.0, "MODE": "auto"}),
+         f"robot-{i % 25}", 19.43, -99.13, None if i % 2 else 2240.0, "lab", "idle")
+        for i in range(1, args.rows + 1)
+    ]
+    adapter = mod.TypeAdapter(list[mod.TelemetryOut])
+    paths = {
+        "pydantic": lambda: adapter.dump_json(adapter.validate_python([mod.serialize_row(r) for r in rows])),
+        "fast": lambda: mod.dumps([mod.row_to_dict(r) for r in rows]),
+    }
+    best = {}
+    for name, fn in paths.items():
+        timings = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+        best[name] = min(timings)
+        print(f"{name:<9} {args.rows / best[name]:>12,.0f} filas/s  (mejor de {args.rounds}: {best[name] * 1000:.2f} ms)")
+    print(f"fast/pydantic: {best['pydantic'] / best['fast']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
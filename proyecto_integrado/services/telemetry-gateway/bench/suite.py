@@ -0,0 +1,402 @@
+"""
+Suite de rendimiento del Telemetry Gateway.
+
+Levanta la app (en proceso vía ASGI o como servidor uvicorn en un puerto
+local) contra cada motor de almacenamiento y simula flotas de robots: cada
+robot ingiere a una tasa fija mientras un grupo de dashboards consulta live y
+query. Reporta throughput, p50/p95/p99 por operación, lecturas confirmadas y
+tamaño de la BD, y puede volcarlo todo a JSON para comparar entre commits.
+
+  python3 bench/suite.py --stores sqlite memory --fleets 50x2 200x1 --json /tmp/bench.json
+  python3 bench/suite.py --target uvicorn --stores sqlite --fleets 500x1 --duration 20
+  python3 bench/suite.py --compare /tmp/bench_main.json --json /tmp/bench_pr.json
+  python3 bench/suite.py --micro all --json /tmp/bench_micro.json
+
+Las flotas se escriben ROBOTSxHZ (lecturas por segundo de cada robot). Con
+--batch N cada robot agrupa N lecturas por POST /ingest/batch. --compare lee
+un JSON anterior, imprime la variación de throughput y p95 por escenario y
+sale con código 1 si alguna empeora más de --threshold por ciento.
+
+--micro corre además los microbenchmarks de este directorio (pool, live,
+ingest, concurrency, compression, serialization; cada uno es un script
+independiente con sus propias opciones) y guarda su salida en el JSON; con
+--micro y sin --fleets no se corren flotas. --micro-main apunta todos a otro
+main.py para comparar con una versión anterior.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import platform
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from common import percentile
+
+BENCH_DIR = Path(__file__).resolve().parent
+APP_DIR = BENCH_DIR.parent / "app"
+OPERATIONS = ("ingest", "live", "query")
+MICRO = ("pool", "live", "ingest", "concurrency", "compression", "serialization")
+
+
+@dataclass
+class Fleet:
+    robots: int
+    rate: float
+
+    @property
+    def label(self) -> str:
+        return f"{self.robots}x{self.rate:g}"
+
+    @classmethod
+    def parse(cls, raw: str) -> "Fleet":
+        robots, _, rate = raw.lower().partition("x")
+        try:
+            return cls(robots=int(robots), rate=float(rate or "1"))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Flota inválida '{raw}', se espera ROBOTSxHZ (p. ej. 50x2)")
+
+
+@dataclass
+class Recorder:
+    latencies: Dict[str, List[float]] = field(default_factory=lambda: {op: [] for op in OPERATIONS})
+    errors: Dict[str, int] = field(default_factory=lambda: {op: 0 for op in OPERATIONS})
+    ingested: int = 0
+
+    async def call(self, op: str, request: Any, readings: int = 0) -> None:
+        start = time.perf_counter()
+        try:
+            r = await request
+            ok = r.status_code in (200, 202)
+        except httpx.HTTPError:
+            ok = False
+        self.latencies[op].append(time.perf_counter() - start)
+        if not ok:
+            self.errors[op] += 1
+        elif op == "ingest":
+            self.ingested += readings
+
+
+def reading(robot: str, seq: int) -> Dict[str, Any]:
+    return {
+        "robot_id": robot,
+        "data": {"TEMP": 20.0 + seq % 10, "HUM": 40.0 + seq % 7, "BATT": 100.0 - seq % 100},
+        "position": {"lat": 19.43 + random.uniform(-0.05, 0.05), "lng": -99.13 + random.uniform(-0.05, 0.05)},
+        "status": "ok",
+    }
+
+
+async def drive(
+    http: httpx.AsyncClient, fleet: Fleet, duration: float, batch: int, dashboards: int, poll: float
+) -> Tuple[Recorder, float]:
+    """Carga en lazo abierto: cada robot envía cada batch/rate segundos sin esperar a terminar el anterior."""
+    rec = Recorder()
+    robots = [f"bench-{n:05d}" for n in range(fleet.robots)]
+    deadline = time.perf_counter() + duration
+    pending: List[asyncio.Task] = []
+
+    async def robot_loop(robot: str) -> None:
+        interval = batch / fleet.rate
+        await asyncio.sleep(random.uniform(0, interval))
+        seq = 0
+        next_at = time.perf_counter()
+        while next_at < deadline:
+            items = [reading(robot, seq + i) for i in range(batch)]
+            seq += batch
+            if batch == 1:
+                request = http.post("/api/telemetry/ingest", json=items[0])
+            else:
+                request = http.post("/api/telemetry/ingest/batch", json=items)
+            pending.append(asyncio.ensure_future(rec.call("ingest", request, batch)))
+            next_at += interval
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+
+    async def dashboard_loop() -> None:
+        while time.perf_counter() < deadline:
+            await rec.call("live", http.get("/api/telemetry/live", params={"limit_per_robot": 5}))
+            robot = random.choice(robots)
+            await rec.call("query", http.get("/api/telemetry/query", params={"robot_id": robot, "limit": 100}))
+            await asyncio.sleep(poll)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(robot_loop(r) for r in robots), *(dashboard_loop() for _ in range(dashboards)))
+    await asyncio.gather(*pending)
+    return rec, time.perf_counter() - start
+
+
+def load_module(db_path: str, store: str) -> Any:
+    os.environ["TG_DB_PATH"] = db_path
+    os.environ["TG_STORE"] = store
+    spec = importlib.util.spec_from_file_location("tg_bench_suite", APP_DIR / "main.py")
+    mod = importlib.util.module_from_spec(spec)  # type: ignore
+    assert spec and spec.loader
+    spec.loader.exec_module(mod)  # type: ignore
+    return mod
+
+
+async def run_inprocess(store: str, db_path: str, fleet: Fleet, args: argparse.Namespace) -> Tuple[Recorder, float, Dict[str, Any]]:
+    mod = load_module(db_path, store)
+    await mod.startup()
+    try:
+        transport = httpx.ASGITransport(app=mod.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as http:
+            rec, elapsed = await drive(http, fleet, args.duration, args.batch, args.dashboards, args.poll)
+    finally:
+        await mod.shutdown()
+    return rec, elapsed, mod.STORE.stats()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_uvicorn(store: str, db_path: str, fleet: Fleet, args: argparse.Namespace) -> Tuple[Recorder, float, Dict[str, Any]]:
+    port = free_port()
+    env = {**os.environ, "TG_DB_PATH": db_path, "TG_STORE": store}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", str(APP_DIR), "--port", str(port),
+         "--log-level", "warning", "--workers", str(args.workers)],
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        limits = httpx.Limits(max_connections=args.connections)
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as http:
+            await wait_ready(http, server)
+            rec, elapsed = await drive(http, fleet, args.duration, args.batch, args.dashboards, args.poll)
+            stats = (await http.get("/api/telemetry/pool")).json()
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+    return rec, elapsed, stats
+
+
+async def run_url(store: str, db_path: str, fleet: Fleet, args: argparse.Namespace) -> Tuple[Recorder, float, Dict[str, Any]]:
+    limits = httpx.Limits(max_connections=args.connections)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as http:
+        rec, elapsed = await drive(http, fleet, args.duration, args.batch, args.dashboards, args.poll)
+        stats = (await http.get("/api/telemetry/pool")).json()
+    return rec, elapsed, stats
+
+
+async def wait_ready(http: httpx.AsyncClient, server: subprocess.Popen, timeout: float = 15.0) -> None:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"uvicorn terminó con código {server.returncode}")
+        try:
+            if (await http.get("/healthz")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("uvicorn no respondió /healthz a tiempo")
+
+
+def db_size(db_path: str) -> Dict[str, Optional[int]]:
+    """Bytes del archivo SQLite y de su WAL, y filas de telemetry (None si no hay archivo)."""
+    if not os.path.exists(db_path):
+        return {"db_bytes": None, "wal_bytes": None, "rows": None}
+    wal = db_path + "-wal"
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute("SELECT COUNT(*) FROM telemetry").fetchone()[0]
+    return {
+        "db_bytes": os.path.getsize(db_path),
+        "wal_bytes": os.path.getsize(wal) if os.path.exists(wal) else 0,
+        "rows": rows,
+    }
+
+
+def summarize(rec: Recorder, elapsed: float) -> Dict[str, Any]:
+    ops: Dict[str, Any] = {}
+    for op, values in rec.latencies.items():
+        if not values:
+            continue
+        ms = [v * 1000.0 for v in values]
+        ops[op] = {
+            "requests": len(ms),
+            "errors": rec.errors[op],
+            "rps": round(len(ms) / elapsed, 1),
+            "p50_ms": round(percentile(ms, 50), 3),
+            "p95_ms": round(percentile(ms, 95), 3),
+            "p99_ms": round(percentile(ms, 99), 3),
+            "max_ms": round(max(ms), 3),
+        }
+    return ops
+
+
+def git_revision() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def scenario_key(result: Dict[str, Any]) -> Tuple[str, str, str, int]:
+    return (result["target"], result["store"], result["fleet"], result["batch"])
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> bool:
+    """Imprime la variación frente a ``baseline``; False si algo empeora más de ``threshold`` %."""
+    previous = {scenario_key(r): r for r in baseline.get("results", [])}
+    ok = True
+    print(f"\nComparación con {baseline.get('revision') or '?'} (umbral {threshold:g}%)")
+    if not any(scenario_key(r) in previous for r in current["results"]):
+        print("  sin escenarios comunes (target/store/fleet/batch)")
+    for result in current["results"]:
+        before = previous.get(scenario_key(result))
+        if before is None:
+            continue
+        for op, now in result["operations"].items():
+            old = before["operations"].get(op)
+            if not old:
+                continue
+            rps = (now["rps"] - old["rps"]) * 100.0 / old["rps"] if old["rps"] else 0.0
+            p95 = (now["p95_ms"] - old["p95_ms"]) * 100.0 / old["p95_ms"] if old["p95_ms"] else 0.0
+            worse = rps < -threshold or p95 > threshold
+            ok = ok and not worse
+            print(
+                f"  {'!!' if worse else '  '} {'/'.join(map(str, scenario_key(result)))} {op:<6} "
+                f"rps {old['rps']:>9,.1f} -> {now['rps']:>9,.1f} ({rps:+.1f}%)  "
+                f"p95 {old['p95_ms']:>8.2f} -> {now['p95_ms']:>8.2f} ms ({p95:+.1f}%)"
+            )
+    return ok
+
+
+def run_micro(names: List[str], main_path: Optional[Path]) -> Dict[str, Any]:
+    """Ejecuta cada microbenchmark en su propio proceso (cada uno carga su app) y recoge su salida."""
+    results: Dict[str, Any] = {}
+    for name in names:
+        cmd = [sys.executable, str(BENCH_DIR / f"{name}.py")]
+        if main_path is not None:
+            cmd += ["--main", str(main_path)]
+        print(f"\n== bench/{name}.py")
+        start = time.perf_counter()
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        sys.stdout.write(proc.stdout)
+        if proc.returncode:
+            sys.stderr.write(proc.stderr)
+        results[name] = {
+            "returncode": proc.returncode,
+            "seconds": round(time.perf_counter() - start, 3),
+            "output": proc.stdout.splitlines(),
+        }
+    return results
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--target", choices=("inprocess", "uvicorn", "url"), default="inprocess")
+    ap.add_argument("--url", help="Gateway ya levantado (con --target url)")
+    ap.add_argument("--stores", nargs="+", default=["sqlite", "memory"], help="sqlite, memory, postgres")
+    ap.add_argument("--fleets", nargs="+", type=Fleet.parse, help="Por defecto 50x2 200x1 (ninguna con --micro)")
+    ap.add_argument("--duration", type=float, default=10.0, help="Segundos de carga por escenario")
+    ap.add_argument("--batch", type=int, default=1, help="Lecturas por POST (1 = /ingest, >1 = /ingest/batch)")
+    ap.add_argument("--dashboards", type=int, default=4, help="Clientes que consultan live y query")
+    ap.add_argument("--poll", type=float, default=0.5, help="Pausa entre consultas de cada dashboard")
+    ap.add_argument("--workers", type=int, default=1, help="Workers de uvicorn")
+    ap.add_argument("--connections", type=int, default=200, help="Conexiones HTTP máximas (uvicorn/url)")
+    ap.add_argument("--timeout", type=float, default=30.0)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--json", type=Path, help="Escribe los resultados en este archivo")
+    ap.add_argument("--compare", type=Path, help="JSON de una corrida anterior para comparar")
+    ap.add_argument("--threshold", type=float, default=10.0, help="Regresión tolerada en % (rps y p95)")
+    ap.add_argument("--micro", nargs="+", choices=("all", *MICRO), help="Microbenchmarks a correr")
+    ap.add_argument("--micro-main", type=Path, help="main.py que miden los microbenchmarks")
+    args = ap.parse_args()
+    if args.target == "url" and not args.url:
+        ap.error("--target url requiere --url")
+    if args.fleets is None:
+        args.fleets = [] if args.micro else [Fleet(50, 2.0), Fleet(200, 1.0)]
+
+    runner = {"inprocess": run_inprocess, "uvicorn": run_uvicorn, "url": run_url}[args.target]
+    stores = ["remote"] if args.target == "url" else args.stores
+    results: List[Dict[str, Any]] = []
+    for store in stores:
+        for fleet in args.fleets:
+            random.seed(args.seed)
+            with tempfile.TemporaryDirectory() as tmp:
+                db_path = os.path.join(tmp, "telemetry.db")
+                rec, elapsed, stats = asyncio.run(runner(store, db_path, fleet, args))
+                size = db_size(db_path)
+            if size["rows"] is None and "rows" in stats:
+                size["rows"] = stats["rows"]
+            ops = summarize(rec, elapsed)
+            target_rate = fleet.robots * fleet.rate
+            result = {
+                "target": args.target,
+                "store": store,
+                "fleet": fleet.label,
+                "batch": args.batch,
+                "duration_s": round(elapsed, 3),
+                "target_readings_per_s": target_rate,
+                "readings_per_s": round(rec.ingested / elapsed, 1),
+                "readings_ingested": rec.ingested,
+                "operations": ops,
+                **size,
+                "server": stats,
+            }
+            results.append(result)
+            print(
+                f"[{store} {fleet.label} batch={args.batch}] {rec.ingested:,} lecturas en {elapsed:.1f}s "
+                f"({result['readings_per_s']:,.0f}/s de {target_rate:,.0f}/s), "
+                f"BD {size['db_bytes'] if size['db_bytes'] is not None else '-'} B + WAL {size['wal_bytes'] or 0} B"
+            )
+            for op, o in ops.items():
+                print(
+                    f"  {op:<6} {o['requests']:>7} req  {o['rps']:>8,.1f} req/s  p50={o['p50_ms']:8.2f} ms  "
+                    f"p95={o['p95_ms']:8.2f} ms  p99={o['p99_ms']:8.2f} ms  errores={o['errors']}"
+                )
+
+    report = {
+        "revision": git_revision(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "target": args.target,
+            "duration_s": args.duration,
+            "batch": args.batch,
+            "dashboards": args.dashboards,
+            "poll_s": args.poll,
+            "workers": args.workers,
+            "env": {k: v for k, v in os.environ.items() if k.startswith("TG_") and k not in ("TG_DB_PATH", "TG_DB_URL", "TG_STORE")},
+        },
+        "results": results,
+    }
+    if args.micro:
+        names = list(MICRO) if "all" in args.micro else args.micro
+        report["micro"] = run_micro(names, args.micro_main)
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2, default=str))
+        print(f"\nResultados en {args.json}")
+    if args.compare and not compare(json.loads(args.compare.read_text()), report, args.threshold):
+        sys.exit(1)
+    if any(m["returncode"] for m in report.get("micro", {}).values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(130)